@@ -7,3 +7,9 @@ arc_iface = ArcInterface("/path/to/config", log_level=LogLevels.DEBUG)
 
 # Disable logging
 arc_iface = ArcInterface("/path/to/config", log=None)
+
+# Send log messages to the standard logging module. Messages are handled on a background thread,
+# and records have job_id, phase and duration attributes where relevant
+import logging
+logging.basicConfig(format="%(levelname)s %(phase)s %(job_id)s: %(message)s")
+arc_iface = ArcInterface("/path/to/config", log=logging.getLogger("jasmin_arc"))
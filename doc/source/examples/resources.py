@@ -0,0 +1,4 @@
+# Request 4 cores, 8GB of memory and a 2 hour wall time limit, and set an environment variable
+job_id = arc_iface.submit_job("/path/to/my/program", args=["--threads", "4"],
+                              cpus=4, memory=8 * 1024, wall_time=2 * 60 * 60,
+                              environment={"OMP_NUM_THREADS": "4"})
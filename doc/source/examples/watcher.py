@@ -0,0 +1,16 @@
+"""
+Submit some jobs and print their statuses as they change, without writing a polling loop
+"""
+from jasmin_arc import ArcInterface, JobWatcher
+
+arc_iface = ArcInterface("/path/to/config.json")
+job_ids = [arc_iface.submit_job("/bin/sleep", [str(n)]) for n in (10, 20, 30)]
+
+
+def on_status_change(job_id, old, new):
+    print("Job {} changed from {} to {}".format(job_id, old, new))
+
+# All subscribers share a single status query every 10 seconds
+watcher = JobWatcher(arc_iface, interval=10)
+watcher.subscribe(on_status_change, job_ids)
+watcher.start()
@@ -0,0 +1,20 @@
+"""
+Run a three stage pipeline: a preprocessing job, two jobs that process its output in parallel,
+and a final job that combines their outputs
+"""
+from jasmin_arc import ArcInterface, Workflow
+
+arc_iface = ArcInterface("/path/to/config.json")
+
+# If this script is interrupted, running it again resumes from where it stopped
+workflow = Workflow(arc_iface, state_file="/tmp/pipeline_state.json", max_concurrent=10)
+workflow.add_job("prepare", "/bin/bash", ["-c", "seq 1 100 > output"])
+workflow.add_job("evens", "/bin/bash", ["-c", "mv output numbers; awk '$1 % 2 == 0' numbers > output"],
+                 depends_on=["prepare"], use_parent_outputs=True)
+workflow.add_job("odds", "/bin/bash", ["-c", "mv output numbers; awk '$1 % 2 == 1' numbers > output"],
+                 depends_on=["prepare"], use_parent_outputs=True)
+workflow.add_job("count", "/bin/bash", ["-c", "echo 'done' > output"],
+                 depends_on=["evens", "odds"])
+
+for name, state in workflow.run().items():
+    print("{}: {}".format(name, state["state"]))
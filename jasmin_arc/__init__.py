@@ -1,2 +1,4 @@
 from arc_interface import ArcInterface
 from constants import JobStatuses, LogLevels
+from watcher import JobWatcher
+from workflow import Workflow
@@ -0,0 +1,232 @@
+import threading
+import time
+
+from exceptions import SubmissionLimitError
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter. Tokens are added at a fixed rate up to a maximum of `burst`, and
+    each submission uses one token. Not thread safe - callers must provide their own locking
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate:  Number of tokens added per second. If 0 the rate is unlimited
+        :param burst: Maximum number of tokens that can be stored
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.last_time = time.time()
+
+    def refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+
+    def time_until_available(self):
+        """
+        Return the number of seconds until a token is available, or 0 if one is available now
+        """
+        if self.rate <= 0:
+            return 0
+        self.refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """
+        Use a token. `time_until_available` should have returned 0 before calling this
+        """
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class AdmissionController(object):
+    """
+    Limit the rate at which jobs are submitted and the number of jobs in flight (submitted and
+    not yet seen in a terminal state). Jobs are tracked locally, so only jobs submitted through
+    this controller count towards the limit.
+
+    When a limit is reached, submissions either block until there is capacity (``block`` mode) or
+    fail immediately with `SubmissionLimitError` (``reject`` mode).
+
+    Jobs are released by `job_finished` when the caller sees them in a terminal state. So that
+    callers that never check job statuses do not run out of capacity, the `reconcile` function
+    is used to find finished jobs whenever the in-flight limit is reached, at most once every
+    `RECONCILE_INTERVAL` seconds.
+    """
+
+    #: Minimum number of seconds between calls to `reconcile`
+    RECONCILE_INTERVAL = 10.0
+
+    def __init__(self, rate=0, burst=1, max_in_flight=0, mode="block", timeout=0, reconcile=None):
+        """
+        :param rate:          Maximum submissions per second, or 0 for no limit
+        :param burst:         Number of submissions allowed in a burst above `rate`
+        :param max_in_flight: Maximum number of jobs in flight, or 0 for no limit
+        :param mode:          ``block`` or ``reject``
+        :param timeout:       Maximum number of seconds to wait in ``block`` mode, or 0 to wait
+                              indefinitely
+        :param reconcile:     Optional function that takes a list of in-flight job IDs and returns
+                              the IDs of those that have finished
+        """
+        self.condition = threading.Condition()
+        self.in_flight = set()
+        self.reserved = 0
+        self.reconcile = reconcile
+        self.last_reconcile_time = None
+        self.bucket = None
+
+        # Statistics
+        self.queue_depth = 0
+        self.admitted = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+        self.configure(rate, burst, max_in_flight, mode, timeout)
+
+    def configure(self, rate, burst, max_in_flight, mode, timeout):
+        """
+        Change the limits. Any waiting submissions are re-evaluated against the new limits. Tokens
+        already used are kept, so changing the config does not refill the burst
+        """
+        with self.condition:
+            if self.bucket is None:
+                self.bucket = TokenBucket(rate, burst)
+            else:
+                self.bucket.refill()
+                self.bucket.rate = rate
+                self.bucket.burst = max(burst, 1)
+                self.bucket.tokens = min(self.bucket.tokens, self.bucket.burst)
+            self.max_in_flight = max_in_flight
+            self.mode = mode
+            self.timeout = timeout
+            self.condition.notify_all()
+
+    def has_capacity(self):
+        return self.max_in_flight <= 0 or len(self.in_flight) + self.reserved < self.max_in_flight
+
+    def time_until_reconcile(self):
+        """
+        Return the number of seconds until `reconcile` may be called again, 0 if it may be called
+        now, or ``None`` if there is no `reconcile` function
+        """
+        if self.reconcile is None:
+            return None
+        if self.last_reconcile_time is None:
+            return 0
+        return max(self.last_reconcile_time + self.RECONCILE_INTERVAL - time.time(), 0)
+
+    def reconcile_in_flight(self):
+        """
+        Stop tracking in-flight jobs that `reconcile` reports as finished. Must be called with
+        `condition` held, which is released while `reconcile` runs so that other threads are not
+        blocked by the query
+        """
+        job_ids = list(self.in_flight)
+        self.last_reconcile_time = time.time()
+        self.condition.release()
+        try:
+            finished = self.reconcile(job_ids)
+        finally:
+            self.condition.acquire()
+        for job_id in finished:
+            self.in_flight.discard(job_id)
+
+    def acquire(self, block=True):
+        """
+        Reserve capacity for a single submission, waiting if necessary. Each successful call must
+        be followed by a call to either `add_job` or `cancel_reservation`
+
+        :param block:                 Whether to wait for capacity in ``block`` mode. If ``False``
+                                      the call never waits, as in ``reject`` mode
+        :raises SubmissionLimitError: if in ``reject`` mode (or `block` is ``False``) and a limit
+                                      has been reached, or if in ``block`` mode and the timeout
+                                      expires
+        """
+        start_time = time.time()
+        deadline = start_time + self.timeout if self.timeout > 0 else None
+
+        with self.condition:
+            self.queue_depth += 1
+            try:
+                while True:
+                    if not self.has_capacity():
+                        if self.in_flight and self.time_until_reconcile() == 0:
+                            self.reconcile_in_flight()
+                            continue
+                        reason = "maximum of {} jobs in flight reached".format(self.max_in_flight)
+                        # Wake up to reconcile again if no jobs are released in the meantime
+                        delay = self.time_until_reconcile() if self.in_flight else None
+                    else:
+                        delay = self.bucket.time_until_available()
+                        if delay == 0:
+                            break
+                        reason = "submission rate limit of {}/s reached".format(self.bucket.rate)
+
+                    if self.mode == "reject" or not block:
+                        raise SubmissionLimitError("Cannot submit job: {}".format(reason))
+
+                    if deadline is not None:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise SubmissionLimitError("Timed out waiting to submit job: {}"
+                                                       .format(reason))
+                        delay = remaining if delay is None else min(delay, remaining)
+
+                    self.condition.wait(delay)
+
+                self.bucket.take()
+                self.reserved += 1
+
+                wait_time = time.time() - start_time
+                self.admitted += 1
+                self.total_wait_time += wait_time
+                self.max_wait_time = max(self.max_wait_time, wait_time)
+            finally:
+                self.queue_depth -= 1
+
+    def add_job(self, job_id):
+        """
+        Convert a reservation made with `acquire` into a tracked in-flight job
+        """
+        with self.condition:
+            self.reserved -= 1
+            self.in_flight.add(job_id)
+
+    def cancel_reservation(self):
+        """
+        Release a reservation made with `acquire` when the submission failed
+        """
+        with self.condition:
+            self.reserved -= 1
+            self.condition.notify_all()
+
+    def job_finished(self, job_id):
+        """
+        Stop tracking a job that has reached a terminal state, freeing capacity for another
+        submission. Jobs that are not tracked are ignored
+        """
+        with self.condition:
+            if job_id in self.in_flight:
+                self.in_flight.discard(job_id)
+                self.condition.notify_all()
+
+    def stats(self):
+        """
+        Return a dictionary of statistics: the number of submissions currently waiting for
+        capacity (``queue_depth``), the number of jobs in flight (``in_flight``), the total number
+        of submissions admitted (``admitted``), and the mean and maximum time in seconds
+        submissions have waited for (``mean_wait_time`` and ``max_wait_time``)
+        """
+        with self.condition:
+            return {
+                "queue_depth": self.queue_depth,
+                "in_flight": len(self.in_flight) + self.reserved,
+                "admitted": self.admitted,
+                "mean_wait_time": self.total_wait_time / self.admitted if self.admitted else 0.0,
+                "max_wait_time": self.max_wait_time
+            }
@@ -0,0 +1,367 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import arc
+
+from backend import Backend
+from exceptions import (AgentError, ProxyGenerationError, InvalidJobDescription,
+                        JobSubmissionError, NoTargetsAvailableError, JobNotFoundError,
+                        InputFileError, SubmissionLimitError)
+
+
+#: Exceptions raised by a backend in the agent that are raised again with the same type in the
+#: client. Other exceptions are raised as `AgentError`
+REMOTE_EXCEPTIONS = dict((cls.__name__, cls) for cls in (
+    ProxyGenerationError, InvalidJobDescription, JobSubmissionError, NoTargetsAvailableError,
+    JobNotFoundError, InputFileError, SubmissionLimitError, IOError, OSError
+))
+
+
+def error_response(ex):
+    """
+    Return the response sent to a client for an exception raised by a backend
+    """
+    return {"error": type(ex).__name__, "message": str(ex)}
+
+
+def response_error(response):
+    """
+    Return the exception to raise in a client for an error response from the agent
+    """
+    return REMOTE_EXCEPTIONS.get(response["error"], AgentError)(response["message"])
+
+
+# Number of seconds to wait for the agent to answer a ping before assuming it is not running
+PING_TIMEOUT = 1.0
+
+
+class StatusCache(object):
+    """
+    Cache of the states of the jobs clients are polling. Requests made while the cached states are
+    fresh and cover the requested jobs are answered from the cache, and requests made while the
+    states are being queried wait for that query rather than starting another, so that many
+    clients polling at once cause only one query per `ttl` seconds.
+
+    Each query asks only for the union of the job IDs requested since the previous query, so jobs
+    nobody polls any more are not looked up, and all jobs are only queried if a client asked for
+    all of them
+    """
+
+    def __init__(self, fetch, ttl):
+        """
+        :param fetch: Function that takes a list of job IDs (or ``None`` for all jobs) and returns
+                      a dictionary mapping job IDs to states, e.g. `Backend.get_states`
+        :param ttl:   Number of seconds to reuse queried states for, or 0 to query every time
+        """
+        self.fetch = fetch
+        self.ttl = ttl
+        self.states = None
+        self.time = None
+        self.lock = threading.Lock()
+
+        # Job IDs (or all jobs) requested since the last query, and those the cached states cover
+        self.requested = set()
+        self.requested_all = False
+        self.cached_ids = set()
+        self.cached_all = False
+
+    def get(self, job_ids=None):
+        if self.ttl <= 0:
+            return self.fetch(job_ids)
+
+        with self.lock:
+            if job_ids is None:
+                self.requested_all = True
+                covered = self.cached_all
+            else:
+                self.requested.update(job_ids)
+                covered = self.cached_all or self.cached_ids.issuperset(job_ids)
+
+            expired = self.states is None or time.time() - self.time > self.ttl
+            if expired or not covered:
+                if not expired:
+                    # Keep covering the jobs already cached until the states expire
+                    self.requested.update(self.cached_ids)
+                    self.requested_all = self.requested_all or self.cached_all
+                self.states = self.fetch(None if self.requested_all else sorted(self.requested))
+                self.time = time.time()
+                self.cached_ids, self.cached_all = self.requested, self.requested_all
+                self.requested, self.requested_all = set(), False
+            states = self.states
+
+        if job_ids is None:
+            return dict(states)
+        return dict((job_id, states[job_id]) for job_id in job_ids if job_id in states)
+
+    def invalidate(self):
+        """
+        Discard the cached states, e.g. after submitting a job that is not in them yet
+        """
+        with self.lock:
+            self.states = None
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Read JSON requests from a client connection, one per line, and write a JSON response line for
+    each
+    """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, b""):
+            response = self.server.agent.handle_request(line.decode("utf-8"))
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class AgentServer(object):
+    """
+    Process that owns a single backend and serves requests for it from many client processes over
+    a Unix socket, so that the proxy, the cached execution targets and the job list are shared
+    instead of being created by every client.
+
+    Requests are JSON objects of the form ``{"method": <name>, "args": [...]}`` with one of the
+    methods of `Backend` (or ``ping``), and each is answered with ``{"result": ...}`` or
+    ``{"error": <exception name>, "message": ...}``. Each connection is handled on its own thread
+    and calls the backend concurrently, relying on the backend to protect its shared state (e.g.
+    `ArcBackend` guards the proxy and job list), so a long download does not hold up other
+    clients. Status requests are answered from a `StatusCache`.
+    """
+
+    METHODS = ("ping", "submit", "submit_jobs", "get_states", "cancel", "cancel_jobs",
+               "retrieve", "retrieve_jobs")
+
+    def __init__(self, backend, backend_name, socket_path, status_ttl=5.0):
+        """
+        :param backend:      The `Backend` to serve requests for
+        :param backend_name: Name of the backend type (the `BACKEND` option), so clients only use
+                             the agent if it runs their jobs in the same place
+        :param socket_path:  Path of the Unix socket to listen on
+        :param status_ttl:   Number of seconds to reuse job states for (see `StatusCache`)
+        """
+        self.backend = backend
+        self.backend_name = backend_name
+        self.socket_path = socket_path
+        self.status_cache = StatusCache(self.backend.get_states, status_ttl)
+        self.server = None
+        self.thread = None
+
+    def handle_request(self, line):
+        """
+        Handle a request line from a client and return the response
+        """
+        try:
+            request = json.loads(line)
+            method = request.get("method")
+            if method not in self.METHODS:
+                raise AgentError("Unknown method '{}'".format(method))
+            return {"result": getattr(self, method)(*request.get("args", []))}
+        except Exception as ex:
+            return error_response(ex)
+
+    def ping(self):
+        return {"backend": self.backend_name, "pid": os.getpid()}
+
+    def submit(self, description):
+        job_id = self.backend.submit(description)
+        self.status_cache.invalidate()
+        return job_id
+
+    def submit_jobs(self, descriptions):
+        results = self.backend.submit_jobs(descriptions)
+        self.status_cache.invalidate()
+        # Errors for individual jobs are sent in the same form as errors for whole requests
+        return [error_response(result) if isinstance(result, Exception) else {"result": result}
+                for result in results]
+
+    def get_states(self, job_ids=None):
+        return self.status_cache.get(job_ids)
+
+    def cancel(self, job_id):
+        cancelled = self.backend.cancel(job_id)
+        self.status_cache.invalidate()
+        return cancelled
+
+    def cancel_jobs(self, job_ids):
+        results = self.backend.cancel_jobs(job_ids)
+        self.status_cache.invalidate()
+        return results
+
+    def retrieve(self, job_id, directory):
+        return list(self.backend.retrieve(job_id, directory))
+
+    def retrieve_jobs(self, directories, parallel=1):
+        return dict((job_id, list(result)) for job_id, result in
+                    self.backend.retrieve_jobs(directories, parallel).items())
+
+    def start(self):
+        """
+        Start listening on the socket in a background thread
+
+        :raises AgentError: if another agent is already listening on the socket
+        """
+        if AgentBackend.ping(self.socket_path) is not None:
+            raise AgentError("An agent is already running on {}".format(self.socket_path))
+        if os.path.exists(self.socket_path):
+            # Left behind by an agent that did not shut down cleanly
+            os.unlink(self.socket_path)
+
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, AgentRequestHandler)
+        self.server.daemon_threads = True
+        self.server.agent = self
+        # Only the user running the agent may send it requests
+        os.chmod(self.socket_path, 0o600)
+
+        self.thread = threading.Thread(target=self.server.serve_forever, name="AgentServer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop listening and remove the socket
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+class AgentBackend(Backend):
+    """
+    Backend that forwards requests to an agent running on `AGENT_SOCKET` (see `AgentServer`).
+    Requests fail with `AgentError` if the agent does not answer within `AGENT_TIMEOUT` seconds,
+    or `AGENT_RETRIEVE_TIMEOUT` seconds for downloads
+    """
+
+    @staticmethod
+    def ping(socket_path, timeout=PING_TIMEOUT):
+        """
+        Return information about the agent listening on a socket, or ``None`` if there is none
+        """
+        if not os.path.exists(socket_path):
+            return None
+        try:
+            return AgentBackend.call(socket_path, "ping", timeout=timeout)
+        except (AgentError, IOError, OSError):
+            return None
+
+    @staticmethod
+    def call(socket_path, method, *args, **kwargs):
+        """
+        Send a request to the agent and return the result
+
+        :param timeout:     Optional keyword argument: number of seconds to wait for the agent to
+                            answer, or ``None`` to wait indefinitely
+        :raises AgentError: if the agent cannot be reached, does not answer in time or fails to
+                            handle the request. Errors in `REMOTE_EXCEPTIONS` are raised with their
+                            original type
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(kwargs.get("timeout"))
+        try:
+            sock.connect(socket_path)
+            sock.sendall(json.dumps({"method": method, "args": args}).encode("utf-8") + b"\n")
+            response_file = sock.makefile("rb")
+            line = response_file.readline()
+            response_file.close()
+        except (IOError, OSError) as ex:
+            raise AgentError("Failed to contact agent on {}: {}".format(socket_path, ex))
+        finally:
+            sock.close()
+
+        if not line:
+            raise AgentError("Agent on {} closed the connection".format(socket_path))
+        response = json.loads(line.decode("utf-8"))
+        if "error" in response:
+            raise response_error(response)
+        return response["result"]
+
+    def request(self, method, *args):
+        """
+        Send a request to the agent with the timeout from the config
+        """
+        if method in ("retrieve", "retrieve_jobs"):
+            timeout = self.config.AGENT_RETRIEVE_TIMEOUT
+        else:
+            timeout = self.config.AGENT_TIMEOUT
+        return self.call(self.config.AGENT_SOCKET, method, *args, timeout=timeout or None)
+
+    def submit(self, description):
+        return self.request("submit", description)
+
+    def submit_jobs(self, descriptions):
+        return [response_error(response) if "error" in response else response["result"]
+                for response in self.request("submit_jobs", descriptions)]
+
+    def get_states(self, job_ids=None):
+        return self.request("get_states", job_ids)
+
+    def cancel(self, job_id):
+        return self.request("cancel", job_id)
+
+    def cancel_jobs(self, job_ids):
+        return self.request("cancel_jobs", job_ids)
+
+    def retrieve(self, job_id, directory):
+        success, state = self.request("retrieve", job_id, os.path.abspath(directory))
+        return (success, state)
+
+    def retrieve_jobs(self, directories, parallel=1):
+        directories = dict((job_id, os.path.abspath(directory))
+                           for job_id, directory in directories.items())
+        results = self.request("retrieve_jobs", directories, parallel)
+        return dict((job_id, tuple(result)) for job_id, result in results.items())
+
+
+def main(argv=None):
+    """
+    Run an agent in the foreground until interrupted
+    """
+    # Imported here since arc_interface imports this module to use the agent
+    from arc_interface import ArcInterface
+
+    parser = argparse.ArgumentParser(description="Run a jasmin_arc agent to serve requests from "
+                                                 "other processes on this host")
+    parser.add_argument("--config", help="Path to config JSON file")
+    parser.add_argument("--profile", help="Name of a profile in the config file to apply")
+    args = parser.parse_args(argv)
+
+    arc_iface = ArcInterface(args.config, profile=args.profile)
+    # The agent must use the backend directly rather than connect to itself or another agent
+    arc_iface.config = arc_iface.config.replace(USE_AGENT=False)
+    config = arc_iface.config
+
+    agent = AgentServer(arc_iface.backend, config.BACKEND, config.AGENT_SOCKET,
+                        config.AGENT_STATUS_TTL)
+    try:
+        agent.start()
+    except AgentError as ex:
+        sys.stderr.write("{}\n".format(ex))
+        return 1
+
+    arc_iface.logger.msg(arc.INFO, "Agent listening on {}".format(config.AGENT_SOCKET))
+    try:
+        while agent.thread.is_alive():
+            agent.thread.join(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        agent.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
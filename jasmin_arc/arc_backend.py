@@ -0,0 +1,660 @@
+import os
+import tempfile
+import subprocess
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import arc
+
+from backend import Backend
+from broker import TargetBroker
+from federation import ServerPool
+from retry import RetryPolicy, CircuitBreaker
+from constants import ARC_TERMINAL_STATES
+from outputs import checksum_matches
+from exceptions import (ProxyGenerationError, InvalidJobDescription, JobSubmissionError,
+                        NoTargetsAvailableError, JobNotFoundError)
+
+
+class ArcBackend(Backend):
+    """
+    Backend that runs jobs on LOTUS via one or more ARC CE servers
+    """
+
+    def __init__(self, config, logger, env):
+        """
+        :param config: The `ConnectionConfig` in use
+        :param logger: `JasminArcLogger` to write log messages to
+        :param env:    jinja2 ``Environment`` to load the ARC client config template from
+        """
+        super(ArcBackend, self).__init__(config, logger)
+        self.env = env
+        self.cached_user_config = None
+        # Held while creating or renewing the proxy, so that concurrent requests do not run
+        # arcproxy at the same time
+        self.user_config_lock = threading.Lock()
+        # Held while writing to the local job list, which ARC does not protect against concurrent
+        # writes from one process
+        self.job_list_lock = threading.Lock()
+
+        # Statistics about targets are kept across calls to rank targets for submission
+        self.broker = TargetBroker(config.TARGET_RANKING_STRATEGY, config.TARGET_STATS_DECAY)
+        self.servers = ServerPool(config.arc_servers(), config.TARGET_CACHE_TTL,
+                                  config.BREAKER_COOLDOWN)
+        self.retry = RetryPolicy(logger=logger)
+        self.circuit_breaker = CircuitBreaker()
+        self.configure(config)
+
+    def configure(self, config):
+        if config != self.config:
+            self.cached_user_config = None
+            self.servers.reconfigure(config.arc_servers(), config.TARGET_CACHE_TTL,
+                                     config.BREAKER_COOLDOWN)
+        self.broker.strategy = config.TARGET_RANKING_STRATEGY
+        self.broker.decay = config.TARGET_STATS_DECAY
+
+        self.retry.attempts = max(config.RETRY_ATTEMPTS, 1)
+        self.retry.base_delay = config.RETRY_BASE_DELAY
+        self.retry.max_delay = config.RETRY_MAX_DELAY
+        self.circuit_breaker.failure_threshold = config.BREAKER_FAILURE_THRESHOLD
+        self.circuit_breaker.cooldown = config.BREAKER_COOLDOWN
+        self.config = config
+
+    def submit(self, description):
+        result = self.submit_jobs([description])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def submit_jobs(self, descriptions):
+        """
+        Submit several jobs together: the descriptions are parsed using a single temporary file,
+        each target is given all the jobs that have not been submitted yet (see
+        `submit_job_descriptions`), and the submitted jobs are written to the local job list at
+        once
+        """
+        results = [None] * len(descriptions)
+        parsed = []
+        for index, result in enumerate(self.parse_job_descriptions(descriptions)):
+            if isinstance(result, Exception):
+                results[index] = result
+            else:
+                parsed.append((index, result))
+        if not parsed:
+            return results
+
+        submitted = []
+        outcomes = self.submit_job_descriptions([job_descriptions[0]
+                                                 for _, job_descriptions in parsed])
+        for (index, _), outcome in zip(parsed, outcomes):
+            if isinstance(outcome, Exception):
+                results[index] = outcome
+            else:
+                results[index] = outcome.JobID
+                submitted.append(outcome)
+
+        if submitted:
+            self.write_job_list(submitted)
+        return results
+
+    def write_job_list(self, jobs):
+        """
+        Write information on submitted jobs to the local job list, so standard arc tools (arcstat,
+        arcget etc) can be used with them
+
+        :param jobs: List of ``arc.Job`` objects
+        """
+        with self.job_list_lock:
+            job_list = arc.JobInformationStorageBDB(self.config.JOBS_INFO_FILE)
+            written = job_list.Write(jobs)
+        if not written:
+          self.logger.msg(arc.WARNING, "Failed to write to local job list {}".format(self.config.JOBS_INFO_FILE))
+
+    def get_states(self, job_ids=None):
+        """
+        Return the states of several jobs, querying each server at most once
+        """
+        return dict((job_id, job.State.GetGeneralState())
+                    for job_id, job in self.get_jobs(job_ids).items())
+
+    def cancel(self, job_id):
+        return self.cancel_job(self.get_job(job_id))
+
+    def cancel_jobs(self, job_ids):
+        """
+        Cancel several jobs, querying each server at most once to find them
+        """
+        return dict((job_id, self.cancel_job(job))
+                    for job_id, job in self.get_jobs(job_ids).items())
+
+    def cancel_job(self, job):
+        """
+        Cancel a job given as an ``arc.Job``, returning whether it was cancelled
+        """
+        cancelled = job.Cancel()
+        if cancelled:
+            self.servers.job_finished(job.JobID)
+        return cancelled
+
+    def retrieve(self, job_id, directory):
+        return self.retrieve_job(self.get_job(job_id), directory)
+
+    def retrieve_jobs(self, directories, parallel=1):
+        """
+        Retrieve the outputs of several jobs, querying each server at most once to find them
+        """
+        jobs = self.get_jobs(list(directories))
+        job_ids = list(jobs)
+        with ThreadPoolExecutor(max(parallel, 1)) as executor:
+            results = executor.map(lambda job_id: self.retrieve_job(jobs[job_id],
+                                                                    directories[job_id]),
+                                   job_ids)
+            return dict(zip(job_ids, results))
+
+    def retrieve_job(self, job, directory):
+        """
+        Download the outputs of a job. Files already in `directory` with the size and checksum
+        reported by the server are not downloaded again, so an interrupted retrieval can be
+        resumed
+
+        :param job:       Instance of ``arc.Job`` representing the job
+        :param directory: Existing directory to save the outputs in
+        :return:          A tuple of (whether all outputs were retrieved, ARC general state of the
+                          job)
+        """
+        state = job.State.GetGeneralState()
+        if state not in ARC_TERMINAL_STATES:
+            # Outputs are not complete until the job has ended
+            return (False, state)
+
+        user_config = self.get_user_config()
+        try:
+            files = self.list_job_files(job, user_config)
+        except RuntimeError as ex:
+            # Raised by the ARC bindings for errors in the underlying C++ library
+            self.logger.msg(arc.VERBOSE, "Could not list outputs of job {}: {}"
+                                         .format(job.JobID, ex))
+            files = None
+
+        if files is None:
+            # Last argument is 'force' - whether to continue if destination directory already
+            # exists
+            success = self.retry.call("Retrieval of job {}".format(job.JobID), job.Retrieve,
+                                      user_config, arc.URL("file://{}".format(directory)), True,
+                                      retry_if=lambda success: not success)
+            return (success, state)
+
+        success = True
+        for path, url, size, checksum in files:
+            local_path = os.path.join(directory, path)
+            if os.path.isfile(local_path) and os.path.getsize(local_path) == size:
+                matches = checksum_matches(local_path, checksum)
+                if matches is None:
+                    self.logger.msg(arc.VERBOSE, "No usable checksum for {}, so only its size was "
+                                                 "compared".format(url.str()))
+                if matches is not False:
+                    continue
+            if os.path.exists(local_path):
+                # Incomplete or changed since an earlier attempt
+                os.remove(local_path)
+            elif not os.path.isdir(os.path.dirname(local_path)):
+                os.makedirs(os.path.dirname(local_path))
+            copied = self.retry.call("Download of {}".format(url.str()), self.download_file,
+                                     url, local_path, user_config,
+                                     retry_if=lambda copied: not copied)
+            success = success and copied
+        return (success, state)
+
+    def list_job_files(self, job, user_config):
+        """
+        List the files in a job's session directory on the server
+
+        :return: List of tuples of (path relative to the session directory, ``arc.URL``, size,
+                 checksum as ``<algorithm>:<value>`` or an empty string), or ``None`` if the
+                 session directory could not be listed
+        """
+        session_url = arc.URL()
+        if not job.GetURLToResource(arc.Job.SESSIONDIR, session_url):
+            return None
+
+        files = []
+        directories = [("", session_url.str().rstrip("/"))]
+        while directories:
+            prefix, url = directories.pop()
+            datapoint = arc.datapoint_from_url(url, user_config)
+            if datapoint is None:
+                self.logger.msg(arc.VERBOSE, "Unsupported URL {}".format(url))
+                return None
+
+            # The bindings return the list of files, an output argument in C++, in a tuple with
+            # the DataStatus. Check which is which rather than rely on the order
+            result = datapoint.List(arc.DataPoint.INFO_TYPE_ALL)
+            if isinstance(result[0], arc.DataStatus):
+                status, listing = result
+            else:
+                listing, status = result
+            if not status:
+                self.logger.msg(arc.VERBOSE, "Could not list {}: {}".format(url, status))
+                return None
+            for info in listing:
+                path = os.path.join(prefix, info.GetName())
+                file_url = "{}/{}".format(url, info.GetName())
+                if info.GetType() == arc.FileInfo.file_type_dir:
+                    directories.append((path, file_url))
+                else:
+                    files.append((path, arc.URL(file_url), info.GetSize(),
+                                  info.GetCheckSum()))
+        return files
+
+    def download_file(self, url, local_path, user_config):
+        """
+        Download a single file to a local path, returning whether the transfer succeeded
+        """
+        source = arc.datapoint_from_url(url.str(), user_config)
+        destination = arc.datapoint_from_url("file://{}".format(local_path), user_config)
+        if source is None or destination is None:
+            return False
+        mover = arc.DataMover()
+        mover.retry(False)
+        status = mover.Transfer(source, destination, arc.FileCache(), arc.URLMap())
+        return bool(status)
+
+    def get_jobs(self, job_ids=None):
+        """
+        Return ``arc.Job`` objects for several jobs, querying each server at most once
+
+        :param job_ids: List of job IDs, or ``None`` to return all jobs on all servers
+        :return:        Dictionary mapping job IDs to ``arc.Job`` objects. Jobs that could not be
+                        found, including jobs on servers that could not be reached, are omitted
+        """
+        found = {}
+        user_config = self.get_user_config()
+
+        if job_ids is None:
+            servers = self.servers.all_servers()
+            wanted = None
+        else:
+            servers = []
+            for job_id in job_ids:
+                for server in self.servers.servers_for_job(job_id):
+                    if server not in servers:
+                        servers.append(server)
+            wanted = set(job_ids)
+
+        for server in servers:
+            try:
+                jobs = self.retry.call("Job list retrieval from {}".format(server.url),
+                                       self.get_server_jobs, server, user_config)
+            except RetryPolicy.RETRY_EXCEPTIONS as ex:
+                # Jobs on other servers can still be reported
+                self.logger.msg(arc.WARNING, "Could not retrieve jobs from {}: {}"
+                                             .format(server.url, ex))
+                continue
+            for job in jobs:
+                if wanted is None or job.JobID in wanted:
+                    found[job.JobID] = job
+                    self.servers.set_owner(job.JobID, server)
+                    if job.State.GetGeneralState() in ARC_TERMINAL_STATES:
+                        self.servers.job_finished(job.JobID)
+
+        return found
+
+    def submit_job_description(self, job_description):
+        """
+        Submit a parsed job description to the best available target on any server
+
+        :param job_description: The ``arc.JobDescription`` to submit
+
+        :raises NoTargetsAvailableError: if no execution targets can be found on any ARC server
+        :raises JobSubmissionError:      if the job cannot be submitted to any targets
+
+        :return: Instance of ``arc.Job`` representing the submitted job
+        """
+        result = self.submit_job_descriptions([job_description])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def submit_job_descriptions(self, job_descriptions):
+        """
+        Submit parsed job descriptions to the best available targets on any server. Servers are
+        tried in order of health and load, and each is given all the jobs that have not been
+        submitted to an earlier one
+
+        :param job_descriptions: List of ``arc.JobDescription`` objects to submit
+        :return:                 List with, for each description, the ``arc.Job`` representing
+                                 the submitted job, or the `NoTargetsAvailableError` or
+                                 `JobSubmissionError` that prevented it from being submitted
+        """
+        user_config = self.get_user_config()
+
+        # Create empty job objects which will contain our submitted jobs
+        jobs = [arc.Job() for _ in job_descriptions]
+        submitted = [False] * len(jobs)
+
+        total_targets = 0
+        discovery_error = None
+        for server in self.servers.ranked():
+            remaining = [index for index, done in enumerate(submitted) if not done]
+            if not remaining:
+                break
+
+            # An unreachable server must not lose the jobs already submitted to other servers
+            try:
+                targets = self.get_targets(server, user_config)
+            except RetryPolicy.RETRY_EXCEPTIONS as ex:
+                self.logger.msg(arc.VERBOSE, "Could not get targets from {}: {}"
+                                             .format(server.url, ex))
+                server.record_failure()
+                discovery_error = ex
+                continue
+            total_targets += len(targets)
+
+            results = self.submit_to_targets(targets,
+                                             [job_descriptions[index] for index in remaining],
+                                             [jobs[index] for index in remaining], user_config)
+            for index, result in zip(remaining, results):
+                if result:
+                    submitted[index] = True
+                    self.servers.add_job(jobs[index].JobID, server)
+
+            if any(results):
+                server.record_success()
+            else:
+                server.record_failure()
+                # Targets may have changed if submission failed to all of them
+                server.clear_targets()
+
+        if all(submitted):
+            return jobs
+
+        if total_targets == 0 and discovery_error is not None:
+            error = NoTargetsAvailableError("No targets available: {}".format(discovery_error))
+        elif total_targets == 0:
+            error = NoTargetsAvailableError("No targets available")
+        else:
+            error = JobSubmissionError("Could not submit job to any of the {} available target(s)"
+                                       .format(total_targets))
+        return [job if done else error for job, done in zip(jobs, submitted)]
+
+    def get_targets(self, server, user_config):
+        """
+        Return the execution targets of an ARC server, using the cached targets if they have not
+        expired
+
+        :param server:      The `ArcServer` to get targets for
+        :param user_config: An instance of ``arc.UserConfig``
+        :return:            List of ``arc.ExecutionTarget`` objects
+        """
+        targets = server.get_cached_targets(self.servers.target_cache_ttl)
+        if targets is not None:
+            return targets
+
+        # An empty result is not retried, since a server can legitimately have no targets. It is
+        # not cached either, so discovery is attempted again for the next submission
+        targets = self.retry.call("Target discovery on {}".format(server.url),
+                                  self.discover_targets, server, user_config)
+
+        if targets:
+            server.set_targets(targets)
+        else:
+            self.logger.msg(arc.DEBUG, "No targets available on {}".format(server.url))
+        return targets
+
+    def discover_targets(self, server, user_config):
+        """
+        Query an ARC server for its execution targets
+
+        :param server:      The `ArcServer` to query
+        :param user_config: An instance of ``arc.UserConfig``
+        :return:            List of ``arc.ExecutionTarget`` objects
+        """
+        # Get the ExecutionTargets of this ComputingElement
+        endpoint = arc.Endpoint(server.url, arc.Endpoint.COMPUTINGINFO)
+        retriever = arc.ComputingServiceRetriever(user_config, [endpoint])
+        retriever.wait()
+        self.check_endpoint(retriever, endpoint)
+        return list(retriever.GetExecutionTargets())
+
+    def check_endpoint(self, retriever, endpoint):
+        """
+        Raise `RuntimeError` if a retriever failed to query an endpoint. Retrievers do not raise
+        when a server cannot be reached, and the empty result would otherwise be taken to mean the
+        server has no targets or jobs
+
+        :param retriever: ``arc.ComputingServiceRetriever`` or ``arc.JobListRetriever`` that has
+                          finished querying (see ``wait``)
+        :param endpoint:  The ``arc.Endpoint`` that was queried
+        """
+        status = retriever.GetStatusOfEndpoint(endpoint)
+        if status.getStatus() != arc.EndpointQueryingStatus.SUCCESSFUL:
+            raise RuntimeError("Could not query {}: {}".format(endpoint.URLString, status.str()))
+
+    def submit_to_targets(self, targets, job_descriptions, jobs, user_config):
+        """
+        Submit jobs to targets in order of preference, giving each target all the jobs that have
+        not been submitted yet, and record the outcomes so that future submissions can prefer fast
+        and reliable targets. Targets that have failed repeatedly are skipped until their
+        cool-down period has passed.
+
+        Submissions are only retried when they raise one of `RetryPolicy.RETRY_EXCEPTIONS`. A
+        target rejecting a job is usually permanent, so the job is left for the next target while
+        the rest of the jobs are submitted. Only errors from the target itself count towards its
+        circuit breaker, and after one the remaining jobs are moved on to the next target
+
+        :param targets:          List of ``arc.ExecutionTarget`` objects
+        :param job_descriptions: List of ``arc.JobDescription`` objects to submit
+        :param jobs:             List of ``arc.Job`` objects, one per description, that are filled
+                                 in with the submitted jobs
+        :param user_config:      An instance of ``arc.UserConfig``
+        :return:                 List of whether each job was submitted
+        """
+        def submit(target, job_description, job):
+            start_time = time.time()
+            try:
+                submitted = bool(target.Submit(user_config, job_description, job))
+            except RetryPolicy.RETRY_EXCEPTIONS:
+                self.broker.record(target, time.time() - start_time, False)
+                raise
+            self.broker.record(target, time.time() - start_time, submitted)
+            return submitted
+
+        submitted = [False] * len(job_descriptions)
+        for target in self.broker.rank(targets):
+            remaining = [index for index, done in enumerate(submitted) if not done]
+            if not remaining:
+                break
+
+            endpoint = target.ComputingEndpoint
+            key = TargetBroker.target_key(target)
+            if not self.circuit_breaker.allow(key):
+                self.logger.msg(arc.DEBUG, "Skipping {} ({}) after repeated failures"
+                                           .format(endpoint.URLString, endpoint.InterfaceName))
+                continue
+
+            msg = "Attempting to submit {} job(s) to {} ({})".format(len(remaining),
+                                                                      endpoint.URLString,
+                                                                      endpoint.InterfaceName)
+            self.logger.msg(arc.DEBUG, msg)
+
+            for index in remaining:
+                try:
+                    submitted[index] = self.retry.call("Submission to {}"
+                                                       .format(endpoint.URLString), submit,
+                                                       target, job_descriptions[index],
+                                                       jobs[index])
+                except RetryPolicy.RETRY_EXCEPTIONS as ex:
+                    self.logger.msg(arc.DEBUG, "Error submitting job: {}".format(ex))
+                    self.circuit_breaker.record_failure(key)
+                    break
+
+                if submitted[index]:
+                    self.circuit_breaker.record_success(key)
+                else:
+                    self.logger.msg(arc.DEBUG, "Failed to submit job")
+
+        return submitted
+
+    def create_proxy(self):
+        """
+        Use ``arcproxy`` to create a proxy certificate from private key and certificate, and save
+        it to the path given in the config
+
+        :raises ProxyGenerationError: if the certificate cannot be generated
+        """
+        try:
+            output = subprocess.check_output([
+                self.config.ARCPROXY_PATH,
+                "-C", self.config.CLIENT_CERT,
+                "-K", self.config.CLIENT_KEY,
+                "-P", self.config.PROXY_FILE,
+                "-c", "validityPeriod={}".format(self.config.PROXY_VALIDITY_PERIOD)
+            ])
+
+        except subprocess.CalledProcessError:
+            raise ProxyGenerationError("Could not create proxy with arcproxy")
+
+        except OSError as ex:
+            raise OSError("Failed to run arcproxy command: {}".format(ex))
+
+        self.logger.msg(arc.INFO, "arcproxy output:\n{}".format(output))
+
+    def get_job(self, job_id):
+        """
+        Return an instance of ``arc.Job`` representing the job with the given ID
+
+        :param job_id:            ID of the job as returned by `submit_job`
+        :raises JobNotFoundError: if no job with the given ID could be found
+        :raises RuntimeError:     if a server that could own the job cannot be reached
+        :return:                  Instance of ``arc.Job`` representing the job
+        """
+        user_config = self.get_user_config()
+
+        # Only query the server(s) that could own this job
+        for server in self.servers.servers_for_job(job_id):
+            jobs = self.retry.call("Job list retrieval from {}".format(server.url),
+                                   self.get_server_jobs, server, user_config)
+            for job in jobs:
+                if job.JobID == job_id:
+                    self.servers.set_owner(job_id, server)
+                    return job
+
+        raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+
+    def get_server_jobs(self, server, user_config):
+        """
+        Return all jobs on the given ARC server, with their states updated
+
+        :param server:      The `ArcServer` to query
+        :param user_config: An instance of ``arc.UserConfig``
+        :return:            List of ``arc.Job`` objects
+        """
+        # Create a JobSupervisor to handle all the jobs
+        job_supervisor = arc.JobSupervisor(user_config)
+
+        # Retrieve all the jobs from this computing element
+        endpoint = arc.Endpoint(server.url, arc.Endpoint.JOBLIST)
+        retriever = arc.JobListRetriever(user_config)
+        retriever.addConsumer(job_supervisor)
+        retriever.addEndpoint(endpoint)
+        retriever.wait()
+        self.check_endpoint(retriever, endpoint)
+
+        # Update the states of the jobs
+        job_supervisor.Update()
+
+        return job_supervisor.GetAllJobs()
+
+    def get_user_config(self):
+        """
+        Return the cached user config, or create a new one. Also check if proxy has expired, and
+        create a new one if so
+
+        :return: An instance of ``arc.UserConfig`` (see `create_user_config`)
+        """
+        with self.user_config_lock:
+            return self.check_user_config()
+
+    def check_user_config(self):
+        """
+        Implementation of `get_user_config`. Callers must hold the lock
+        """
+        # Create a new config if this is the first time
+        if not self.cached_user_config:
+            self.cached_user_config = self.create_user_config()
+            return self.cached_user_config
+
+        # Check proxy is still valid if using cached user config
+        # Call arcproxy to query how many seconds proxy is valid for
+        try:
+            output = subprocess.check_output([self.config.ARCPROXY_PATH, "-P",
+                                              self.config.PROXY_FILE, "-i", "validityLeft"])
+        except subprocess.CalledProcessError:
+            raise ProxyGenerationError("Failed to check proxy expiry time")
+        except OSError as ex:
+            raise OSError("Failed to run arcproxy command: {}".format(ex))
+
+        try:
+            seconds_left = int(output)
+        except ValueError as ex:
+            raise ProxyGenerationError("Failed to determine proxy expiry time: {}".format(ex))
+
+        if seconds_left <= self.config.PROXY_RENEWAL_THRESHOLD:
+            self.logger.msg(arc.INFO, "Renewing proxy")
+            self.create_proxy()
+
+        return self.cached_user_config
+
+    def create_user_config(self):
+        """
+        Create a user config for use with ARC client
+
+        :return: An instance of ``arc.UserConfig`` containing information about the necessary
+                 keys, certificates and proxy files
+        """
+        self.create_proxy()
+
+        # Write client config to temp file - arc python library seems buggy when using a
+        # proxy file in non-default location. Default location has the current user's
+        # UID appended to it, so this is probably the cleanest way
+        conf_template = self.env.get_template("arc_config.ini")
+        conf_filename = None
+        with tempfile.NamedTemporaryFile(delete=False) as conf_file:
+            conf_filename = conf_file.name
+            conf_file.write(conf_template.render({
+                "proxy_file": self.config.PROXY_FILE,
+                "certs_dir": self.config.CERTS_DIR
+            }))
+
+        user_config = arc.UserConfig(conf_filename)
+        os.unlink(conf_filename)
+        return user_config
+
+    def parse_job_descriptions(self, jsdls):
+        """
+        Parse several job descriptions, reusing a single temporary file
+
+        :param jsdls: List of strings containing job descriptions in JSDL format
+        :return:      List with, for each description, an instance of ``arc.JobDescriptionList``
+                      containing the described job, or an `InvalidJobDescription` if it could not
+                      be parsed
+        """
+        results = []
+        temp_fd, temp_filename = tempfile.mkstemp()
+        os.close(temp_fd)
+        try:
+            for jsdl in jsdls:
+                with open(temp_filename, "w") as temp_file:
+                    temp_file.write(jsdl)
+
+                job_descriptions = arc.JobDescriptionList()
+                if arc.JobDescription_ParseFromFile(temp_filename, job_descriptions):
+                    results.append(job_descriptions)
+                else:
+                    results.append(InvalidJobDescription("Could not parse job description XML"))
+        finally:
+            # Delete the temp file - finally clause is run even if exception is raised
+            os.unlink(temp_filename)
+
+        return results
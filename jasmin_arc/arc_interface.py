@@ -2,48 +2,69 @@ import os
 import sys
 import tempfile
 import json
-import subprocess
+import shutil
+import time
 
 from jinja2 import Environment, PackageLoader, select_autoescape
 import arc
 
-from constants import JobStatuses, ARC_STATUS_MAPPING, LogLevels
+from constants import ARC_STATUS_MAPPING, ARC_TERMINAL_STATES, LogLevels
 from config import ConnectionConfig
-from exceptions import (InvalidConfigError, ProxyGenerationError, InvalidJobDescription,
-                        JobSubmissionError, NoTargetsAvailableError, JobNotFoundError,
-                        InputFileError)
+from admission import AdmissionController
+from result_cache import ResultCache
+from job_store import JobStore
+from arc_backend import ArcBackend
+from local_backend import LocalBackend
+from agent import AgentBackend
+from arc_logging import create_logger
+from outputs import copy_missing, finalise, is_complete, list_files, prepare_staging
+from exceptions import (InvalidConfigError, InvalidJobDescription, JobSubmissionError,
+                        NoTargetsAvailableError, JobNotFoundError, InputFileError,
+                        ProxyGenerationError, AgentError, SubmissionLimitError)
 
 
 # Location of directory containing templates for JSDL XML
 TEMPLATES_DIR = "templates"
 
+# Errors that submitting a job can raise, caught by `ArcInterface.resubmit_failed` and
+# `ArcInterface.submit_jobs` so that one failed submission does not stop the others
+SUBMIT_ERRORS = (InvalidJobDescription, JobSubmissionError, NoTargetsAvailableError,
+                 JobNotFoundError, InputFileError, ProxyGenerationError, AgentError, IOError,
+                 OSError)
+
 
 class ArcInterface(object):
     """
     Class to handle interactions with the ARC-CE server
+
+    Jobs are run by a backend chosen with the `BACKEND` config option: `ArcBackend` submits them
+    to LOTUS via ARC, and `LocalBackend` runs them on the local machine. Admission control, result
+    caching and resubmission work the same way with either backend. If an agent (see
+    `AgentServer`) is running with the same backend, requests are sent through it instead.
     """
 
-    def __init__(self, config_path=None, log=sys.stdout, log_level=LogLevels.INFO):
+    def __init__(self, config_path=None, log=sys.stdout, log_level=LogLevels.INFO, profile=None):
         """
         Create an object to interface with the ARC server.
 
         :param config_path: Path to config JSON file, or ``None`` to use the default settings
-        :param log:         File-like object to write log messages to, or ``None`` to disable
-                            logging. Use ``sys.stdout`` or ``sys.stderr`` to print messages
-                            (default: ``sys.stdout``).
+        :param log:         File-like object or ``logging.Logger`` to write log messages to, or
+                            ``None`` to disable logging. Use ``sys.stdout`` or ``sys.stderr`` to
+                            print messages (default: ``sys.stdout``). Messages sent to a
+                            ``logging.Logger`` are handled on a background thread, and records
+                            have ``job_id``, ``phase`` and ``duration`` attributes where
+                            relevant.
         :param log_level:   The level of detail logs should show (default: `LogLevels.INFO`).
                             See `LogLevels` for the available levels
+        :param profile:     Name of a profile in the config file to apply (default: the value of
+                            the ``JASMIN_ARC_PROFILE`` environment variable, if set)
 
         :raises InvalidConfigError: if config is not valid JSON or is otherwise invalid
         """
 
-        self.logger = arc.Logger(arc.Logger_getRootLogger(), "jobsubmit")
-        # Add a log destination if the user has provided one
-        if log:
-            log_dest = arc.LogStream(log)
-            log_dest.setFormat(arc.ShortFormat)
-            arc.Logger_getRootLogger().addDestination(log_dest)
-            arc.Logger_getRootLogger().setThreshold(log_level.value)
+        # Add a log destination if the user has provided one. Destinations are shared by all
+        # instances in this process, so messages are not duplicated
+        self.logger = create_logger(log, log_level)
 
         config_dict = {}
         if config_path:
@@ -57,15 +78,139 @@ class ArcInterface(object):
             except ValueError as e:
                 raise InvalidConfigError(e.message)
 
-        self.config = ConnectionConfig(config_dict, logger=self.logger)
+        self._config = ConnectionConfig(config_dict, logger=self.logger, profile=profile)
+
+        self.admission = AdmissionController(reconcile=self.find_finished_jobs)
+        self.configure_admission(self.config)
+
+        # Map IDs of jobs returned from the result cache to cache keys, and IDs of submitted jobs
+        # to the keys their outputs should be cached under
+        self.result_cache = None
+        self.cached_jobs = {}
+        self.configure_result_cache(self.config)
+
+        self.job_store = None
+        self.configure_job_store(self.config)
 
         # Create jinja2 environment for loading JSDL template(s)
         self.env = Environment(loader=PackageLoader(__name__, TEMPLATES_DIR),
                                autoescape=select_autoescape(["xml"]))
 
-        self.cached_user_config = None
+        self.backend = self.create_backend(self.config)
+
+    @property
+    def config(self):
+        """
+        The `ConnectionConfig` in use. Config objects are immutable, so to change options assign
+        a modified copy, e.g. ``arc_iface.config = arc_iface.config.replace(OUTPUT_FILE="out")``.
+        Assigning a different config invalidates any cached state that depends on it
+        """
+        return self._config
+
+    @config.setter
+    def config(self, new_config):
+        backend_options = ("BACKEND", "USE_AGENT", "AGENT_SOCKET")
+        if any(getattr(new_config, name) != getattr(self._config, name)
+               for name in backend_options):
+            self.backend = self.create_backend(new_config)
+        else:
+            self.backend.configure(new_config)
+        self.configure_admission(new_config)
+        self.configure_result_cache(new_config)
+        self.configure_job_store(new_config)
+        self._config = new_config
+
+    def create_backend(self, config):
+        """
+        Return a new `Backend` of the type given by the `BACKEND` option in the given config, or an
+        `AgentBackend` if `USE_AGENT` is set and an agent with the same backend type is running
+        """
+        if config.USE_AGENT:
+            agent_info = AgentBackend.ping(config.AGENT_SOCKET)
+            if agent_info is not None and agent_info.get("backend") == config.BACKEND:
+                self.logger.msg(arc.DEBUG, "Using agent on {}".format(config.AGENT_SOCKET))
+                return AgentBackend(config, self.logger)
+
+        if config.BACKEND == "local":
+            return LocalBackend(config, self.logger)
+        return ArcBackend(config, self.logger, self.env)
+
+    def configure_admission(self, config):
+        """
+        Apply the admission control limits from the given config
+        """
+        self.admission.configure(config.SUBMIT_RATE, config.SUBMIT_BURST, config.MAX_IN_FLIGHT,
+                                 config.ADMISSION_MODE, config.ADMISSION_TIMEOUT)
+
+    def configure_job_store(self, config):
+        """
+        Create the job store if `JOB_STORE_DIR` is set, or remove it if not
+        """
+        directory = config.JOB_STORE_DIR
+        if not directory:
+            self.job_store = None
+        elif self.job_store is None or self.job_store.directory != directory:
+            self.job_store = JobStore(directory)
+
+    def latest_job_id(self, job_id):
+        """
+        Return the ID of the most recent resubmission of a job, or the job ID itself if it has not
+        been resubmitted or there is no job store
+        """
+        if self.job_store is None:
+            return job_id
+        return self.job_store.latest(job_id)
+
+    def configure_result_cache(self, config):
+        """
+        Create or remove the result cache according to the given config
+        """
+        if not config.RESULT_CACHE_DIR:
+            self.result_cache = None
+        elif (self.result_cache is None or
+              self.result_cache.directory != config.RESULT_CACHE_DIR):
+            self.result_cache = ResultCache(config.RESULT_CACHE_DIR, config.RESULT_CACHE_SIZE)
+        else:
+            self.result_cache.max_entries = config.RESULT_CACHE_SIZE
+
+    def get_result_cache_key(self, executable, args=[], input_files=[], environment=None):
+        """
+        Return the key identifying a job's outputs in the result cache (see
+        `ResultCache.make_key`). Environment variables are included in the key since they may
+        affect a job's outputs, but other resource requirements are not
+        """
+        environment = self.get_job_environment(environment)
+        return ResultCache.make_key(executable, args, input_files, self.config.OUTPUT_FILE,
+                                    extra={"environment": environment} if environment else None)
+
+    def invalidate_cached_result(self, executable, args=[], input_files=[], environment=None):
+        """
+        Remove the cached result for a job, if there is one, so that it is run again next time it
+        is submitted. Arguments are the same as for `submit_job`
+        """
+        if self.result_cache is not None:
+            self.result_cache.invalidate(self.get_result_cache_key(executable, args, input_files,
+                                                                   environment))
+
+    def get_job_environment(self, environment=None):
+        """
+        Return the environment variables for a job: those in `JOB_ENVIRONMENT`, updated with the
+        given dictionary
+        """
+        job_environment = dict(self.config.JOB_ENVIRONMENT)
+        job_environment.update(environment or {})
+        return job_environment
+
+    def get_admission_stats(self):
+        """
+        Return statistics about admission control: the number of submissions waiting for
+        capacity, the number of jobs in flight, and how long submissions have waited. See
+        `AdmissionController.stats`
+        """
+        return self.admission.stats()
 
-    def submit_job(self, executable, args=[], input_files=[]):
+    def submit_job(self, executable, args=[], input_files=[], cpus=None, memory=None,
+                   wall_time=None, queue=None, environment=None):
         """
         Submit a job and return the job ID
 
@@ -73,26 +218,122 @@ class ArcInterface(object):
         :param args:        List of arguments to pass to the executable
         :param input_files: A list of paths to local files to copy to the remote session directory
                             (the directory the job will run from on JASMIN)
+        :param cpus:        Number of CPU cores to request (default: `JOB_CPUS`)
+        :param memory:      Amount of memory to request in MB (default: `JOB_MEMORY`)
+        :param wall_time:   Wall time limit in seconds (default: `JOB_WALL_TIME`)
+        :param queue:       Name of the queue to submit to (default: `JOB_QUEUE`)
+        :param environment: Dictionary of environment variables to set for the job, in addition to
+                            those in `JOB_ENVIRONMENT`
+
+        `cpus`, `memory` and `wall_time` must be positive integers when given; use ``None`` for
+        the default.
+
+        If `RESULT_CACHE_DIR` is set and an identical job has already completed and had its outputs
+        saved, the ID of that job is returned without submitting a new one, and `save_job_outputs`
+        returns a copy of its cached outputs.
 
         :raises InputFileError:          if any of the specified input files do not exist or are
                                          directories
-        :raises NoTargetsAvailableError: if no execution targets can be found on the ARC server
+        :raises InvalidJobDescription:   if any of the resource requirements are invalid (not a
+                                         positive integer, or a negative `JOB_*` default)
+        :raises NoTargetsAvailableError: if no execution targets can be found on any ARC server
         :raises JobSubmissionError:      if the job cannot be submitted to any targets
+        :raises SubmissionLimitError:    if the job cannot be submitted without exceeding the
+                                         configured admission limits (see `ADMISSION_MODE`)
 
         :return: Job ID
         """
-        endpoint = arc.Endpoint(self.config.ARC_SERVER, arc.Endpoint.COMPUTINGINFO)
+        jsdl, cache_key, cached_job_id = self.prepare_job(executable, args, input_files, cpus,
+                                                          memory, wall_time, queue, environment)
+        if cached_job_id is not None:
+            return cached_job_id
+
+        job_id = self.submit_description(jsdl)
+        if cache_key is not None:
+            self.result_cache.add_pending(job_id, cache_key)
+        return job_id
 
-        user_config = self.get_user_config()
+    def submit_jobs(self, jobs):
+        """
+        Submit several jobs, as in `submit_job`. Jobs admitted by admission control at the same
+        time are handed to the backend together, so that it can submit them in one go (see
+        `Backend.submit_jobs`)
 
-        # Get the ExecutionTargets of this ComputingElement
-        retriever = arc.ComputingServiceRetriever(user_config, [endpoint])
-        retriever.wait()
-        targets = retriever.GetExecutionTargets()
+        :param jobs: List of dictionaries of keyword arguments for `submit_job`
+        :return:     List with, for each job, its ID or the exception that prevented it from being
+                     submitted
+        """
+        results = [None] * len(jobs)
+        pending = []
+        for index, job in enumerate(jobs):
+            try:
+                jsdl, cache_key, cached_job_id = self.prepare_job(**job)
+            except (InputFileError, InvalidJobDescription) as ex:
+                results[index] = ex
+                continue
+            if cached_job_id is not None:
+                results[index] = cached_job_id
+            else:
+                pending.append((index, jsdl, cache_key))
+
+        position = 0
+        while position < len(pending):
+            # Only the first job in a batch waits for capacity, since waiting while holding
+            # reservations for the rest of the batch could stop it from ever being admitted
+            batch = []
+            while position < len(pending):
+                try:
+                    self.admission.acquire(block=not batch)
+                except SubmissionLimitError as ex:
+                    if batch:
+                        break
+                    results[pending[position][0]] = ex
+                else:
+                    batch.append(pending[position])
+                position += 1
+
+            if batch:
+                self.submit_batch(batch, results)
+
+        return results
+
+    def submit_batch(self, batch, results):
+        """
+        Submit a batch of jobs that have been admitted by admission control with a single call to
+        the backend
 
-        if len(targets) == 0:
-            raise NoTargetsAvailableError("No targets available")
+        :param batch:   List of tuples of (index in `results`, JSDL description, result cache
+                        key or ``None``)
+        :param results: List to store each job's ID, or the exception that prevented it from
+                        being submitted, in
+        """
+        start_time = time.time()
+        try:
+            outcomes = self.backend.submit_jobs([jsdl for _, jsdl, _ in batch])
+        except Exception as ex:
+            # Every job in the batch holds a reservation, which must be released below
+            outcomes = [ex] * len(batch)
+
+        for (index, jsdl, cache_key), outcome in zip(batch, outcomes):
+            results[index] = outcome
+            if isinstance(outcome, Exception):
+                self.admission.cancel_reservation()
+                continue
+
+            self.admission.add_job(outcome)
+            self.record_submission(outcome, jsdl, start_time)
+            if cache_key is not None:
+                self.result_cache.add_pending(outcome, cache_key)
+
+    def prepare_job(self, executable, args=[], input_files=[], cpus=None, memory=None,
+                    wall_time=None, queue=None, environment=None):
+        """
+        Check the arguments of a job and render its JSDL description. Arguments and exceptions are
+        the same as for `submit_job`
 
+        :return: A tuple of (JSDL description, result cache key or ``None``, ID of a job whose
+                 cached result can be used instead or ``None``)
+        """
         input_files_map = {}  # Map local paths to destination file names
         for filename in input_files:
             if not os.path.isfile(filename):
@@ -101,226 +342,454 @@ class ArcInterface(object):
             # Use absolute local path
             input_files_map[os.path.abspath(filename)] = os.path.basename(filename)
 
+        resources = {"cpus": cpus, "memory": memory, "wall_time": wall_time}
+        defaults = {
+            "cpus": self.config.JOB_CPUS,
+            "memory": self.config.JOB_MEMORY,
+            "wall_time": self.config.JOB_WALL_TIME
+        }
+        for name, value in resources.items():
+            if value is None:
+                # A default of 0 leaves the requirement out so the LOTUS default is used
+                value = resources[name] = defaults[name]
+                if value < 0:
+                    raise InvalidJobDescription("Default '{}' must be a non-negative integer"
+                                                .format(name))
+            elif not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                raise InvalidJobDescription("'{}' must be a positive integer".format(name))
+
+        environment = self.get_job_environment(environment)
+
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = self.get_result_cache_key(executable, args, input_files, environment)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                job_id, _ = cached
+                self.logger.msg(arc.INFO, "Using cached result of job {}".format(job_id),
+                                job_id=job_id, phase="submit")
+                self.cached_jobs[job_id] = cache_key
+                return (None, cache_key, job_id)
+
         template = self.env.get_template("job_template.xml")
         jsdl = template.render({
             "name": "ARC job",  # TODO: Use sensible name or omit
             "executable": executable,
             "arguments": args,
             "input_files_map": input_files_map,
-            "output_file": self.config.OUTPUT_FILE
+            "output_file": self.config.OUTPUT_FILE,
+            "cpus": resources["cpus"],
+            "memory": resources["memory"],
+            "wall_time": resources["wall_time"],
+            "queue": queue or self.config.JOB_QUEUE,
+            "environment": environment
         })
-        job_descriptions = self.get_job_descriptions(jsdl)
+        return (jsdl, cache_key, None)
+
+    def submit_description(self, jsdl, block=True):
+        """
+        Submit a job from its JSDL description, subject to admission control, and store the
+        description (if `JOB_STORE_DIR` is set) so the job can be resubmitted later
+
+        :param jsdl:  String containing the job description in JSDL format
+        :param block: Whether to wait for capacity if admission limits are reached (see
+                      `AdmissionController.acquire`)
+        :return:      Job ID
+        """
+        # Wait for (or fail if there is no) capacity before contacting the backend
+        self.admission.acquire(block)
+        start_time = time.time()
+        try:
+            job_id = self.backend.submit(jsdl)
+        except Exception:
+            self.admission.cancel_reservation()
+            raise
+        self.admission.add_job(job_id)
+        self.record_submission(job_id, jsdl, start_time)
+        return job_id
+
+    def record_submission(self, job_id, jsdl, start_time):
+        """
+        Log a submitted job and store its description if `JOB_STORE_DIR` is set
+        """
+        self.logger.msg(arc.INFO, "Started job with ID: {}".format(job_id), job_id=job_id,
+                        phase="submit", duration=time.time() - start_time)
 
-        # Create an empty job object which will contain our submitted job
-        job = arc.Job()
+        if self.job_store is not None:
+            try:
+                self.job_store.save(job_id, jsdl)
+            except (IOError, OSError) as ex:
+                self.logger.msg(arc.WARNING, "Failed to store job description: {}".format(ex))
 
-        # Submit job directly to the execution targets, without a broker
-        # Try each target until successfully submitted
-        for target in targets:
-            msg = "Attempting to submit job to {} ({})".format(target.ComputingEndpoint.URLString,
-                                                               target.ComputingEndpoint.InterfaceName)
-            self.logger.msg(arc.DEBUG, msg)
+    def resubmit_job(self, job_id, block=True):
+        """
+        Submit a job again using the description it was originally submitted with. Input files
+        are uploaded again from their original paths. If the job has already been resubmitted,
+        the most recent resubmission is resubmitted, so the lineage stays linear (see
+        `get_job_lineage`). Requires the `JOB_STORE_DIR` option to be set
+
+        :param job_id:                   ID of the job as returned by `submit_job`
+        :param block:                    Whether to wait for capacity if admission limits are
+                                         reached
+        :raises InvalidConfigError:      if `JOB_STORE_DIR` is not set
+        :raises JobNotFoundError:        if no description is stored for the job
+        :raises NoTargetsAvailableError: if no execution targets can be found on any ARC server
+        :raises JobSubmissionError:      if the job cannot be submitted to any targets
 
-            if target.Submit(user_config, job_descriptions[0], job):
-                break
-            else:
-                self.logger.msg(arc.DEBUG, "Failed to submit job")
-        else:
-            raise JobSubmissionError("Could not submit job to any of the {} available target(s)"
-                                     .format(len(targets)))
+        :return: ID of the new job
+        """
+        if self.job_store is None:
+            raise InvalidConfigError("JOB_STORE_DIR must be set to resubmit jobs")
+        job_id = self.job_store.latest(job_id)
+        jsdl = self.job_store.load(job_id)
+        if jsdl is None:
+            raise JobNotFoundError("No stored description for job '{}'".format(job_id))
+
+        self.logger.msg(arc.INFO, "Resubmitting job {}".format(job_id), job_id=job_id,
+                        phase="resubmit")
+        new_job_id = self.submit_description(jsdl, block)
+        self.job_store.add_retry(job_id, new_job_id)
+
+        if self.result_cache is not None:
+            cache_key = self.result_cache.pop_pending(job_id)
+            if cache_key is not None:
+                self.result_cache.add_pending(new_job_id, cache_key)
+        return new_job_id
+
+    def get_job_lineage(self, job_id):
+        """
+        Return the IDs of a job and all its resubmissions, starting with the original job
 
-        self.logger.msg(arc.INFO, "Started job with ID: {}".format(job.JobID))
+        :param job_id: ID of the original job or any of its resubmissions
+        :return:       List of job IDs. Only the given job if there is no job store
+        """
+        if self.job_store is None:
+            return [job_id]
+        return self.job_store.get_lineage(job_id)
 
-        # Write information on submitted job to local job list so standard arc tools (arcstat,
-        # arcget etc) can be used with this job
-        job_list = arc.JobInformationStorageBDB(self.config.JOBS_INFO_FILE)
-        if not job_list.Write([job]):
-          self.logger.msg(arc.WARNING, "Failed to write to local job list {}".format(self.config.JOBS_INFO_FILE))
+    def resubmit_failed(self, job_ids):
+        """
+        Resubmit jobs that have failed according to the auto-resubmit policy: jobs whose most
+        recent resubmission is in one of the `AUTO_RESUBMIT_STATES` are resubmitted, up to
+        `AUTO_RESUBMIT_ATTEMPTS` times each. Requires `JOB_STORE_DIR` to be set.
+
+        Resubmissions never wait for admission capacity; jobs that cannot be resubmitted now are
+        skipped and can be retried by a later call. Errors are logged rather than raised.
+
+        :param job_ids: List of job IDs as returned by `submit_job`
+        :return:        Dictionary mapping the IDs of jobs that were resubmitted to the IDs of
+                        their new resubmissions
+        """
+        if self.job_store is None or self.config.AUTO_RESUBMIT_ATTEMPTS <= 0:
+            return {}
+
+        latest_ids = dict((job_id, self.job_store.latest(job_id)) for job_id in job_ids)
+        states = self.query_job_states(list(set(latest_ids.values())))
+
+        # Map each resubmitted job to its new ID, so that a lineage given more than once is only
+        # resubmitted once
+        new_ids = {}
+        for latest_id in set(latest_ids.values()):
+            if (states.get(latest_id) not in self.config.AUTO_RESUBMIT_STATES or
+                    self.job_store.resubmissions(latest_id) >= self.config.AUTO_RESUBMIT_ATTEMPTS):
+                continue
+            try:
+                new_ids[latest_id] = self.resubmit_job(latest_id, block=False)
+            except SUBMIT_ERRORS as ex:
+                self.logger.msg(arc.WARNING, "Failed to resubmit job {}: {}"
+                                             .format(latest_id, ex),
+                                job_id=latest_id, phase="resubmit")
 
-        return job.JobID
+        return dict((job_id, new_ids[latest_id]) for job_id, latest_id in latest_ids.items()
+                    if latest_id in new_ids)
 
     def get_job_status(self, job_id):
         """
         Return the status of the given job
 
+        If the job has been resubmitted, the status of the most recent resubmission is returned.
+
         :param job_id:            ID of the job as returned by `submit_job`
         :raises JobNotFoundError: if no job with the given ID could be found
 
         :return: The status of the job (see `JobStatuses` for the available values)
         """
-        job = self.get_job(job_id)
+        states = self.get_job_states([job_id])
+        if job_id not in states:
+            raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+
         # Map ARC status to a value in JobStatuses
-        return ARC_STATUS_MAPPING[job.State.GetGeneralState()]
+        return ARC_STATUS_MAPPING[states[job_id]]
 
-    def cancel_job(self, job_id):
+    def get_job_states(self, job_ids=None):
         """
-        Cancel the given job
+        Return the ARC states of several jobs, querying the backend (and each ARC server) at most
+        once.
 
-        :param job_id:            ID of the job as returned by `submit_job`
-        :raises JobNotFoundError: if no job with the given ID could be found
-        """
-        self.logger.msg(arc.INFO, "Cancelling job {}".format(job_id))
-        job = self.get_job(job_id)
-        if not job.Cancel():
-            self.logger.msg(arc.WARNING, "Failed to cancel job")
+        As in `get_job_status`, the state of the most recent resubmission of each given job is
+        returned. This only applies when job IDs are given.
 
-    def save_job_outputs(self, job_id):
+        :param job_ids: List of job IDs, or ``None`` to return the states of all jobs known to
+                        the backend
+        :return:        Dictionary mapping job IDs to ARC general states (e.g. ``Running``). Jobs
+                        that could not be found are omitted
         """
-        Retrieve output files from a job and save them to a temp directory. The file/directory
-        specified in `OUTPUT_FILE` will be downloaded, and ``stdout`` and ``stderr`` outputs are
-        saved as ``stdout.txt`` and ``stderr.txt`` respectively.
+        if job_ids is None:
+            return self.query_job_states(None)
+
+        states = {}
+        latest_ids = {}
+        for job_id in job_ids:
+            # Jobs with cached results do not need to be queried
+            if self.get_cached_result(job_id) is not None:
+                states[job_id] = "Finished"
+            else:
+                latest_ids[job_id] = self.latest_job_id(job_id)
 
-        :param job_id:            ID of the job as returned by `submit_job`
-        :raises JobNotFoundError: if no job with the given ID could be found
+        if latest_ids:
+            latest_states = self.query_job_states(list(set(latest_ids.values())))
+            for job_id, latest_id in latest_ids.items():
+                if latest_id in latest_states:
+                    states[job_id] = latest_states[latest_id]
 
-        :return: Path to the directory the output files were saved in, or ``None`` if no files
-                 were saved
+        return states
+
+    def query_job_states(self, job_ids=None):
         """
-        job = self.get_job(job_id)
-        user_config = self.get_user_config()
-        temp_dir = tempfile.mkdtemp()
-        # Last argument is 'force' - whether to continue if destination directory already exists
-        success = job.Retrieve(user_config, arc.URL("file://{}".format(temp_dir)), True)
+        Query the backend for the ARC states of the given jobs (or all jobs if ``None``), and
+        release the admission slots of jobs that have finished. Unlike `get_job_states`,
+        resubmissions and cached results are not taken into account
 
-        # Remove temp dir and fail if no files were downloaded
-        if not os.listdir(temp_dir):
-            success = False
-            os.rmdir(temp_dir)
+        :return: Dictionary mapping job IDs to ARC general states
+        """
+        start_time = time.time()
+        states = self.backend.get_states(job_ids)
+        self.logger.msg(arc.DEBUG, "Queried states of {} job(s)".format(len(states)),
+                        phase="status", duration=time.time() - start_time)
+        for job_id, state in states.items():
+            if state in ARC_TERMINAL_STATES:
+                self.admission.job_finished(job_id)
 
-        return temp_dir if success else None
+        return states
 
-    def create_proxy(self):
+    def find_finished_jobs(self, job_ids):
         """
-        Use ``arcproxy`` to create a proxy certificate from private key and certificate, and save
-        it to the path given in the config
-
-        :raises ProxyGenerationError: if the certificate cannot be generated
+        Return the IDs of the given jobs that have reached a terminal state. Used by admission
+        control to release the slots of jobs whose status is never checked
         """
         try:
-            output = subprocess.check_output([
-                self.config.ARCPROXY_PATH,
-                "-C", self.config.CLIENT_CERT,
-                "-K", self.config.CLIENT_KEY,
-                "-P", self.config.PROXY_FILE,
-                "-c", "validityPeriod={}".format(self.config.PROXY_VALIDITY_PERIOD)
-            ])
+            states = self.backend.get_states(job_ids)
+        except Exception as ex:
+            self.logger.msg(arc.WARNING, "Failed to query states of jobs in flight: {}".format(ex))
+            return []
+        return [job_id for job_id, state in states.items() if state in ARC_TERMINAL_STATES]
 
-        except subprocess.CalledProcessError:
-            raise ProxyGenerationError("Could not create proxy with arcproxy")
-
-        except OSError as ex:
-            raise OSError("Failed to run arcproxy command: {}".format(ex))
+    def get_job_statuses(self, job_ids=None):
+        """
+        Return the statuses of several jobs, querying the backend (and each ARC server) at most
+        once
 
-        self.logger.msg(arc.INFO, "arcproxy output:\n{}".format(output))
+        :param job_ids: List of job IDs, or ``None`` to return the statuses of all jobs known to
+                        the backend
+        :return:        Dictionary mapping job IDs to values in `JobStatuses`. Jobs that could not
+                        be found are omitted
+        """
+        return dict((job_id, ARC_STATUS_MAPPING[state])
+                    for job_id, state in self.get_job_states(job_ids).items())
 
-    def get_job(self, job_id):
+    def cancel_job(self, job_id):
         """
-        Return an instance of ``arc.Job`` representing the job with the given ID
+        Cancel the given job, or its most recent resubmission if it has been resubmitted
 
         :param job_id:            ID of the job as returned by `submit_job`
         :raises JobNotFoundError: if no job with the given ID could be found
-        :return:                  Instance of ``arc.Job`` representing the job
         """
-        user_config = self.get_user_config()
-
-        # Create a JobSupervisor to handle all the jobs
-        job_supervisor = arc.JobSupervisor(user_config)
+        job_id = self.latest_job_id(job_id)
+        self.logger.msg(arc.INFO, "Cancelling job {}".format(job_id), job_id=job_id,
+                        phase="cancel")
+        if self.backend.cancel(job_id):
+            self.admission.job_finished(job_id)
+        else:
+            self.logger.msg(arc.WARNING, "Failed to cancel job", job_id=job_id, phase="cancel")
 
-        # Retrieve all the jobs from this computing element
-        endpoint = arc.Endpoint(self.config.ARC_SERVER, arc.Endpoint.JOBLIST)
-        retriever = arc.JobListRetriever(user_config)
-        retriever.addConsumer(job_supervisor)
-        retriever.addEndpoint(endpoint)
-        retriever.wait()
+    def cancel_jobs(self, job_ids):
+        """
+        Cancel several jobs as in `cancel_job`, looking up the jobs with a single query to each
+        ARC server
 
-        # Update the states of the jobs
-        job_supervisor.Update()
+        :param job_ids: List of job IDs as returned by `submit_job`
+        :return:        Dictionary mapping job IDs to whether each job was cancelled. Jobs that
+                        could not be found are omitted
+        """
+        latest_ids = dict((job_id, self.latest_job_id(job_id)) for job_id in job_ids)
+        self.logger.msg(arc.INFO, "Cancelling {} job(s)".format(len(latest_ids)), phase="cancel")
+        results = self.backend.cancel_jobs(list(set(latest_ids.values())))
+
+        cancelled = {}
+        for job_id, latest_id in latest_ids.items():
+            if latest_id not in results:
+                continue
+            cancelled[job_id] = results[latest_id]
+            if results[latest_id]:
+                self.admission.job_finished(latest_id)
+            else:
+                self.logger.msg(arc.WARNING, "Failed to cancel job", job_id=latest_id,
+                                phase="cancel")
+        return cancelled
 
-        # Get all jobs and find job by ID
-        jobs = job_supervisor.GetAllJobs()
+    def save_job_outputs(self, job_id, dest=None):
+        """
+        Retrieve output files from a job and save them to a directory. The file/directory
+        specified in `OUTPUT_FILE` will be downloaded, and ``stdout`` and ``stderr`` outputs are
+        saved as ``stdout.txt`` and ``stderr.txt`` respectively. If the job has been resubmitted,
+        the outputs of the most recent resubmission are retrieved.
 
-        for job in jobs:
-            if job.JobID == job_id:
-                return job
+        Files are downloaded to a staging directory next to the destination (``<dest>.partial``),
+        which is moved into place once every file has been retrieved, along with a manifest
+        (`outputs.MANIFEST_FILENAME`) giving the job ID and the size and SHA-256 checksum of each
+        file. If a retrieval is interrupted, calling this again with the same `dest` only
+        downloads the files that are missing or incomplete, and nothing is downloaded if `dest`
+        already contains complete outputs of the same job. A `dest` holding the outputs of a
+        different job is not overwritten.
 
-        raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+        :param job_id:            ID of the job as returned by `submit_job`
+        :param dest:              Directory to save the outputs in. It must not exist, be empty or
+                                  have been created by an earlier call. A new temp directory is used
+                                  if not given
+        :raises JobNotFoundError: if no job with the given ID could be found
+        :raises IOError:          if `dest` contains files that were not saved by this method for
+                                  the same job
 
-    def get_user_config(self):
+        :return: Path to the directory the output files were saved in, or ``None`` if they could
+                 not all be retrieved, e.g. because the job has not finished yet. The directory
+                 contains only the manifest if the job had no outputs
         """
-        Return the cached user config, or create a new one. Also check if proxy has expired, and
-        create a new one if so
+        destinations = {job_id: dest} if dest is not None else None
+        outputs = self.save_jobs_outputs([job_id], destinations=destinations)
+        if job_id not in outputs:
+            raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+        return outputs[job_id]
 
-        :return: An instance of ``arc.UserConfig`` (see `create_user_config`)
+    def save_jobs_outputs(self, job_ids, parallel=1, destinations=None):
         """
-        # Create a new config if this is the first time
-        if not self.cached_user_config:
-            self.cached_user_config = self.create_user_config()
-            return self.cached_user_config
-
-        # Check proxy is still valid if using cached user config
-        # Call arcproxy to query how many seconds proxy is valid for
-        try:
-            output = subprocess.check_output([self.config.ARCPROXY_PATH, "-P",
-                                              self.config.PROXY_FILE, "-i", "validityLeft"])
-        except subprocess.CalledProcessError:
-            raise ProxyGenerationError("Failed to check proxy expiry time")
-        except OSError as ex:
-            raise OSError("Failed to run arcproxy command: {}".format(ex))
-
+        Retrieve the output files of several jobs as in `save_job_outputs`, looking up the jobs
+        with a single query to each ARC server
+
+        :param job_ids:      List of job IDs as returned by `submit_job`
+        :param parallel:     Maximum number of jobs to download outputs from at once
+        :param destinations: Optional dictionary mapping job IDs to the directory to save each
+                             job's outputs in (see `save_job_outputs`). Jobs not in the dictionary
+                             are saved in new temp directories
+        :return:             Dictionary mapping job IDs to the path to the directory each job's
+                             output files were saved in, or ``None`` if they could not be
+                             retrieved. Jobs that could not be found are omitted
+        """
+        destinations = destinations or {}
+        outputs = {}
+        # Map the most recent resubmission of each job to be downloaded to a list of tuples of
+        # (requested job ID, destination, staging directory, whether the destination is temporary)
+        pending = {}
         try:
-            seconds_left = int(output)
-        except ValueError as ex:
-            raise ProxyGenerationError("Failed to determine proxy expiry time: {}".format(ex))
-
-        if seconds_left <= self.config.PROXY_RENEWAL_THRESHOLD:
-            self.logger.msg(arc.INFO, "Renewing proxy")
-            self.create_proxy()
-
-        return self.cached_user_config
-
-    def create_user_config(self):
+            for job_id in job_ids:
+                temporary = destinations.get(job_id) is None
+                if temporary:
+                    dest = tempfile.mkdtemp()
+                else:
+                    dest = os.path.abspath(os.path.expanduser(destinations[job_id]))
+                    if is_complete(dest, job_id):
+                        outputs[job_id] = dest
+                        continue
+                staging = prepare_staging(dest, job_id)
+
+                cached_dir = self.get_cached_result(job_id)
+                if cached_dir is not None:
+                    # Copy so that callers can modify or delete the outputs without affecting the
+                    # cache
+                    copy_missing(cached_dir, staging)
+                    finalise(staging, dest, job_id)
+                    outputs[job_id] = dest
+                    continue
+                pending.setdefault(self.latest_job_id(job_id), []).append(
+                    (job_id, dest, staging, temporary)
+                )
+
+            if not pending:
+                return outputs
+
+            directories = dict((latest_id, targets[0][2]) for latest_id, targets in pending.items())
+            start_time = time.time()
+            results = self.backend.retrieve_jobs(directories, parallel)
+        except Exception:
+            for targets in pending.values():
+                self.discard_staging(targets)
+            raise
+        self.logger.msg(arc.DEBUG, "Retrieved outputs of {} job(s)".format(len(results)),
+                        phase="retrieve", duration=time.time() - start_time)
+
+        for latest_id, targets in pending.items():
+            if latest_id not in results:
+                # Job could not be found
+                self.discard_staging(targets)
+                continue
+
+            success, state = results[latest_id]
+            if not success:
+                self.logger.msg(arc.WARNING, "Failed to retrieve outputs", job_id=latest_id,
+                                phase="retrieve")
+                self.discard_staging(targets)
+                for job_id, _, _, _ in targets:
+                    outputs[job_id] = None
+                continue
+
+            first_id, first_dest, first_staging, _ = targets[0]
+            finalise(first_staging, first_dest, first_id)
+            # The same job was requested more than once, e.g. as the original and a resubmission
+            for job_id, dest, staging, _ in targets[1:]:
+                copy_missing(first_dest, staging)
+                finalise(staging, dest, job_id)
+            for job_id, dest, _, _ in targets:
+                outputs[job_id] = dest
+
+            # Cache outputs of successful jobs so identical jobs do not need to run again
+            if self.result_cache is not None and state == "Finished":
+                cache_key = self.result_cache.get_pending(latest_id)
+                if cache_key is not None:
+                    self.result_cache.put(cache_key, first_dest, latest_id)
+                    self.result_cache.pop_pending(latest_id)
+
+        return outputs
+
+    @staticmethod
+    def discard_staging(targets):
         """
-        Create a user config for use with ARC client
-
-        :return: An instance of ``arc.UserConfig`` containing information about the necessary
-                 keys, certificates and proxy files
+        Remove the staging directories of failed downloads that cannot be resumed: those for temp
+        directories, and those with no files other than the manifest naming their job. Others are
+        kept so a later call can continue from where this one stopped
         """
-        self.create_proxy()
-
-        # Write client config to temp file - arc python library seems buggy when using a
-        # proxy file in non-default location. Default location has the current user's
-        # UID appended to it, so this is probably the cleanest way
-        conf_template = self.env.get_template("arc_config.ini")
-        conf_filename = None
-        with tempfile.NamedTemporaryFile(delete=False) as conf_file:
-            conf_filename = conf_file.name
-            conf_file.write(conf_template.render({
-                "proxy_file": self.config.PROXY_FILE,
-                "certs_dir": self.config.CERTS_DIR
-            }))
-
-        user_config = arc.UserConfig(conf_filename)
-        os.unlink(conf_filename)
-        return user_config
-
-    def get_job_descriptions(self, jsdl):
+        for _, dest, staging, temporary in targets:
+            if temporary:
+                shutil.rmtree(staging, ignore_errors=True)
+                shutil.rmtree(dest, ignore_errors=True)
+            elif os.path.isdir(staging) and not list_files(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+    def get_cached_result(self, job_id):
         """
-        Return an instance of ``arc.JobDescriptionList`` containing the job described by the
-        given JSDL
-
-        :param jsdl: String containing the job description in JSDL format
+        Return the path to the cached outputs of a job returned from the result cache by
+        `submit_job`, or ``None`` if the job did not come from the cache or its result has since
+        been removed from the cache
         """
-        job_descriptions = arc.JobDescriptionList()
-        temp_filename = None
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_filename = temp_file.name
-            temp_file.write(jsdl)
-
-        try:
-            if not arc.JobDescription_ParseFromFile(temp_filename, job_descriptions):
-                raise InvalidJobDescription("Could not parse job description XML")
-        finally:
-            # Delete the temp file - finally clause is run even if exception is raised
-            os.unlink(temp_filename)
-
-        return job_descriptions
+        if self.result_cache is None:
+            return None
+        cache_key = self.cached_jobs.get(job_id)
+        if cache_key is None:
+            # The job may have been returned from the cache in another process
+            cache_key = self.result_cache.find_job(job_id)
+            if cache_key is None:
+                return None
+
+        cached = self.result_cache.get(cache_key, mark_used=False)
+        if cached is None:
+            self.cached_jobs.pop(job_id, None)
+            return None
+        return cached[1]
@@ -0,0 +1,235 @@
+import os
+import re
+import atexit
+import logging
+import threading
+
+try:
+    from logging.handlers import QueueHandler, QueueListener
+except ImportError:
+    from logutils.queue import QueueHandler, QueueListener
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import arc
+
+
+#: Level used for ARC's VERBOSE messages in the ``logging`` module, between DEBUG and INFO
+VERBOSE = 15
+logging.addLevelName(VERBOSE, "VERBOSE")
+
+#: Map ARC log levels to ``logging`` levels
+ARC_LOGGING_LEVELS = {
+    arc.DEBUG: logging.DEBUG,
+    arc.VERBOSE: VERBOSE,
+    arc.INFO: logging.INFO,
+    arc.WARNING: logging.WARNING,
+    arc.ERROR: logging.ERROR,
+    arc.FATAL: logging.CRITICAL
+}
+
+#: Structured fields added to every record sent to the ``logging`` module. Records for messages
+#: logged by ARC itself have these set to ``None``
+RECORD_FIELDS = ("job_id", "phase", "duration")
+
+# Lines written by ARC in its short format start with the level name, e.g. "WARNING: message"
+ARC_LINE_REGEX = re.compile(r"^\[?(DEBUG|VERBOSE|INFO|WARNING|ERROR|FATAL)\]?:? (.*)$")
+
+# Line written to the pipe by `LoggingBridge.flush` to find when the reader has caught up
+FLUSH_MARKER = "\x00jasmin_arc flush "
+
+# Log destinations added to the ARC root logger by this process, keyed on the stream or logger
+# they write to, so that creating several `ArcInterface` instances does not duplicate messages.
+# Keeping a reference also stops the destinations being garbage collected while ARC uses them
+_destinations = {}
+_destinations_lock = threading.Lock()
+
+
+class LoggingBridge(object):
+    """
+    Send log messages to a ``logging.Logger`` without blocking the caller. Records are put on a
+    queue by a ``QueueHandler`` and passed to the logger's handlers by a ``QueueListener`` thread.
+
+    Messages logged by the ARC library itself are written by an ``arc.LogStream`` to a pipe, and a
+    reader thread turns each line into a record on the same queue.
+    """
+
+    def __init__(self, logger):
+        """
+        :param logger: The ``logging.Logger`` to send messages to
+        """
+        self.logger = logger
+        self.queue = queue.Queue()
+        self.queue_handler = QueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, LoggerHandler(logger))
+        self.listener.start()
+
+        read_fd, write_fd = os.pipe()
+        self.pipe_reader = os.fdopen(read_fd, "r")
+        self.pipe_writer = os.fdopen(write_fd, "w")
+        self.log_stream = arc.LogStream(self.pipe_writer)
+        self.log_stream.setFormat(arc.ShortFormat)
+        arc.Logger_getRootLogger().addDestination(self.log_stream)
+
+        self.flush_events = {}
+        self.flush_lock = threading.Lock()
+        self.next_flush = 0
+
+        self.reader = threading.Thread(target=self.read_arc_output, name="ArcLogReader")
+        self.reader.daemon = True
+        self.reader.start()
+
+    def emit(self, level, message, **fields):
+        """
+        Queue a record for the logger if it is enabled for the given ``logging`` level
+
+        :param fields: Values for the fields in `RECORD_FIELDS`
+        """
+        if not self.logger.isEnabledFor(level):
+            return
+        extra = dict((name, fields.get(name)) for name in RECORD_FIELDS)
+        record = self.logger.makeRecord(self.logger.name, level, "(arc)", 0, message, (), None,
+                                        extra=extra)
+        self.queue_handler.handle(record)
+
+    def read_arc_output(self):
+        level = logging.INFO
+        for line in iter(self.pipe_reader.readline, ""):
+            if line.startswith(FLUSH_MARKER):
+                with self.flush_lock:
+                    event = self.flush_events.pop(line[len(FLUSH_MARKER):].strip(), None)
+                if event is not None:
+                    event.set()
+                continue
+
+            match = ARC_LINE_REGEX.match(line.rstrip("\n"))
+            if match:
+                level = ARC_LOGGING_LEVELS[getattr(arc, match.group(1))]
+                message = match.group(2)
+            else:
+                # Continuation of a multi-line message
+                message = line.rstrip("\n")
+            self.emit(level, message)
+
+    def flush(self):
+        """
+        Wait until everything ARC has written so far has been read and all queued records have
+        been handled
+        """
+        event = threading.Event()
+        with self.flush_lock:
+            token = str(self.next_flush)
+            self.next_flush += 1
+            self.flush_events[token] = event
+            self.pipe_writer.write(FLUSH_MARKER + token + "\n")
+            self.pipe_writer.flush()
+        event.wait()
+        self.queue.join()
+
+    def stop(self):
+        """
+        Handle any queued records and stop the listener thread
+        """
+        self.listener.stop()
+
+
+class LoggerHandler(logging.Handler):
+    """
+    Handler that passes records to the handlers of a logger, used by `LoggingBridge` on its
+    listener thread
+    """
+
+    def __init__(self, logger):
+        logging.Handler.__init__(self)
+        self.logger = logger
+
+    def emit(self, record):
+        self.logger.handle(record)
+
+
+class JasminArcLogger(object):
+    """
+    Logger for jasmin_arc's own messages, with the same ``msg(level, message)`` interface as
+    ``arc.Logger``. Messages can include the structured fields in `RECORD_FIELDS`, which are
+    added to the records when logging to a ``logging.Logger`` and ignored otherwise
+    """
+
+    def __init__(self, arc_logger, bridge=None):
+        """
+        :param arc_logger: ``arc.Logger`` to write messages to when not logging to the ``logging``
+                           module
+        :param bridge:     `LoggingBridge` to send messages to instead, if any
+        """
+        self.arc_logger = arc_logger
+        self.bridge = bridge
+
+    def msg(self, level, message, **fields):
+        """
+        Log a message
+
+        :param level:   ARC log level, e.g. ``arc.INFO``
+        :param message: The message to log
+        :param fields:  Optional values for the fields in `RECORD_FIELDS`, e.g. ``job_id``
+        """
+        if self.bridge is not None:
+            self.bridge.emit(ARC_LOGGING_LEVELS[level], message, **fields)
+        else:
+            self.arc_logger.msg(level, message)
+
+    def flush(self):
+        """
+        Wait until all messages sent to the ``logging`` module have been handled
+        """
+        if self.bridge is not None:
+            self.bridge.flush()
+
+
+def add_stream_destination(stream):
+    """
+    Send ARC log messages to a file-like object, unless this process already does so
+    """
+    with _destinations_lock:
+        if id(stream) in _destinations:
+            return
+        log_dest = arc.LogStream(stream)
+        log_dest.setFormat(arc.ShortFormat)
+        arc.Logger_getRootLogger().addDestination(log_dest)
+        _destinations[id(stream)] = (stream, log_dest)
+
+
+def get_logging_bridge(logger):
+    """
+    Return the `LoggingBridge` for a ``logging.Logger``, creating it if this process does not
+    already have one
+    """
+    with _destinations_lock:
+        key = ("logger", logger.name)
+        if key not in _destinations:
+            bridge = LoggingBridge(logger)
+            atexit.register(bridge.stop)
+            _destinations[key] = bridge
+        return _destinations[key]
+
+
+def create_logger(log, log_level):
+    """
+    Create a `JasminArcLogger` and set up ARC log output for an `ArcInterface`
+
+    :param log:       File-like object or ``logging.Logger`` to write log messages to, or ``None``
+                      to disable logging
+    :param log_level: The `LogLevels` value to set as the ARC logging threshold
+    """
+    arc_logger = arc.Logger(arc.Logger_getRootLogger(), "jobsubmit")
+    if not log:
+        return JasminArcLogger(arc_logger)
+
+    bridge = None
+    if isinstance(log, logging.Logger):
+        bridge = get_logging_bridge(log)
+    else:
+        add_stream_destination(log)
+    arc.Logger_getRootLogger().setThreshold(log_level.value)
+    return JasminArcLogger(arc_logger, bridge)
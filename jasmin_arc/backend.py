@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from exceptions import (InvalidJobDescription, NoTargetsAvailableError, JobSubmissionError,
+                        JobNotFoundError)
+
+
+class Backend(object):
+    """
+    Base class for the services that run jobs on behalf of `ArcInterface`. A backend receives
+    job descriptions rendered from the JSDL template and reports job states using ARC's general
+    state names (e.g. ``Running``), which `ArcInterface` maps onto `JobStatuses`.
+
+    Admission control, the result cache and resubmission are handled by `ArcInterface`, so
+    backends only need to implement the methods below.
+    """
+
+    def __init__(self, config, logger):
+        """
+        :param config: The `ConnectionConfig` in use
+        :param logger: `JasminArcLogger` to write log messages to
+        """
+        self.config = config
+        self.logger = logger
+
+    def configure(self, config):
+        """
+        Apply a new `ConnectionConfig`, invalidating any state that depends on the old one
+        """
+        self.config = config
+
+    def submit(self, description):
+        """
+        Submit a job
+
+        :param description:              String containing the job description in JSDL format
+        :raises InvalidJobDescription:   if the description cannot be parsed
+        :raises NoTargetsAvailableError: if there is nowhere to run the job
+        :raises JobSubmissionError:      if the job cannot be submitted
+
+        :return: Job ID
+        """
+        raise NotImplementedError
+
+    def get_states(self, job_ids=None):
+        """
+        Return the states of several jobs
+
+        :param job_ids: List of job IDs, or ``None`` to return the states of all jobs known to the
+                        backend
+        :return:        Dictionary mapping job IDs to ARC general states. Jobs that could not be
+                        found are omitted
+        """
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        """
+        Cancel a job
+
+        :raises JobNotFoundError: if no job with the given ID could be found
+        :return:                  ``True`` if the job was cancelled, ``False`` otherwise
+        """
+        raise NotImplementedError
+
+    def retrieve(self, job_id, directory):
+        """
+        Copy a job's outputs (the `OUTPUT_FILE` file/directory, ``stdout.txt`` and ``stderr.txt``)
+        to a local directory. The directory may contain files from an earlier, interrupted call;
+        backends should not copy these again if they are complete. Retrieval only succeeds once
+        the job has reached a terminal state, and a job with no outputs is retrieved successfully
+
+        :param job_id:            ID of the job
+        :param directory:         Existing directory to save the outputs in
+        :raises JobNotFoundError: if no job with the given ID could be found
+
+        :return: A tuple of (whether all outputs were retrieved, ARC general state of the job)
+        """
+        raise NotImplementedError
+
+    def submit_jobs(self, descriptions):
+        """
+        Submit several jobs, as in `submit`. Backends that can submit several jobs together should
+        override this to do so
+
+        :param descriptions: List of strings containing job descriptions in JSDL format
+        :return:             List with, for each description, the job ID or the exception that
+                             prevented the job from being submitted
+        """
+        results = []
+        for description in descriptions:
+            try:
+                results.append(self.submit(description))
+            except (InvalidJobDescription, NoTargetsAvailableError, JobSubmissionError) as ex:
+                results.append(ex)
+        return results
+
+    def cancel_jobs(self, job_ids):
+        """
+        Cancel several jobs. Backends that can look up several jobs at once should override this
+        to do so
+
+        :param job_ids: List of job IDs
+        :return:        Dictionary mapping job IDs to whether each job was cancelled. Jobs that
+                        could not be found are omitted
+        """
+        results = {}
+        for job_id in job_ids:
+            try:
+                results[job_id] = self.cancel(job_id)
+            except JobNotFoundError:
+                pass
+        return results
+
+    def retrieve_jobs(self, directories, parallel=1):
+        """
+        Retrieve the outputs of several jobs, as in `retrieve`. Backends that can look up several
+        jobs at once should override this to do so
+
+        :param directories: Dictionary mapping job IDs to the directory to save each job's outputs
+                            in
+        :param parallel:    Maximum number of jobs to retrieve at once
+        :return:            Dictionary mapping job IDs to tuples of (whether the retrieval
+                            succeeded, ARC general state of the job). Jobs that could not be found
+                            are omitted
+        """
+        def retrieve(job_id):
+            try:
+                return self.retrieve(job_id, directories[job_id])
+            except JobNotFoundError:
+                return None
+
+        job_ids = list(directories)
+        with ThreadPoolExecutor(max(parallel, 1)) as executor:
+            results = zip(job_ids, executor.map(retrieve, job_ids))
+        return dict((job_id, result) for job_id, result in results if result is not None)
@@ -0,0 +1,136 @@
+import threading
+
+
+class TargetStats(object):
+    """
+    Locally measured statistics for submissions to a single execution target. Values are
+    exponentially weighted moving averages, so older measurements decay over time
+    """
+
+    __slots__ = ("latency", "success_rate", "attempts")
+
+    def __init__(self):
+        self.latency = None
+        self.success_rate = None
+        self.attempts = 0
+
+    def update(self, duration, success, decay):
+        """
+        Add a new measurement
+
+        :param duration: Time taken for the submission attempt in seconds
+        :param success:  Whether the submission succeeded
+        :param decay:    Weight given to the previous value (between 0 and 1)
+        """
+        outcome = 1.0 if success else 0.0
+        if self.attempts == 0:
+            self.latency = duration
+            self.success_rate = outcome
+        else:
+            self.latency = decay * self.latency + (1 - decay) * duration
+            self.success_rate = decay * self.success_rate + (1 - decay) * outcome
+        self.attempts += 1
+
+
+class TargetBroker(object):
+    """
+    Rank ``arc.ExecutionTarget`` instances for job submission, using the load advertised by each
+    target's ComputingShare together with submission latency and success rate measured locally.
+
+    The available strategies are:
+
+    * ``ordered``: use targets in the order they were discovered
+    * ``load``: prefer targets with the most free slots and fewest waiting jobs
+    * ``latency``: prefer targets with the highest success rate and lowest submission latency
+    * ``combined``: combine the load and latency measures into a single score
+
+    Targets with no recorded statistics are assumed to be fast and reliable, so that new targets
+    are tried.
+    """
+
+    def __init__(self, strategy="combined", decay=0.7):
+        """
+        :param strategy: Name of the ranking strategy (see above)
+        :param decay:    Weight given to previous statistics when adding a new measurement
+        """
+        self.strategy = strategy
+        self.decay = decay
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def target_key(target):
+        """
+        Return a key identifying the given target across calls
+        """
+        endpoint = target.ComputingEndpoint
+        return (endpoint.URLString, endpoint.InterfaceName)
+
+    @staticmethod
+    def load_score(target):
+        """
+        Return a score for the load on a target based on the free slots and waiting jobs
+        advertised in its ComputingShare. Higher is better. Values the target does not publish
+        (given as negative numbers by ARC) are treated as zero
+        """
+        share = target.ComputingShare
+        free_slots = max(getattr(share, "FreeSlots", -1), 0)
+        waiting_jobs = max(getattr(share, "WaitingJobs", -1), 0)
+        return float(free_slots) / (1 + waiting_jobs)
+
+    def get_stats(self, target):
+        """
+        Return the `TargetStats` for a target, or ``None`` if no submissions have been recorded
+        """
+        with self.lock:
+            return self.stats.get(self.target_key(target))
+
+    def record(self, target, duration, success):
+        """
+        Record the outcome of a submission attempt
+
+        :param target:   The ``arc.ExecutionTarget`` the job was submitted to
+        :param duration: Time taken for the submission attempt in seconds
+        :param success:  Whether the submission succeeded
+        """
+        key = self.target_key(target)
+        with self.lock:
+            stats = self.stats.setdefault(key, TargetStats())
+            stats.update(duration, success, self.decay)
+
+    def history_score(self, target):
+        """
+        Return a tuple of (success rate, latency) for a target, using optimistic values if no
+        submissions have been recorded
+        """
+        stats = self.get_stats(target)
+        if stats is None:
+            return (1.0, 0.0)
+        return (stats.success_rate, stats.latency)
+
+    def rank(self, targets):
+        """
+        Return a list of targets sorted from most to least preferred. The sort is stable, so
+        targets with equal scores stay in their original order
+
+        :param targets: Iterable of ``arc.ExecutionTarget`` objects
+        :return:        List of targets
+        """
+        targets = list(targets)
+
+        if self.strategy == "ordered":
+            return targets
+
+        if self.strategy == "load":
+            return sorted(targets, key=lambda t: -self.load_score(t))
+
+        if self.strategy == "latency":
+            def key(target):
+                success_rate, latency = self.history_score(target)
+                return (-success_rate, latency)
+            return sorted(targets, key=key)
+
+        def combined_key(target):
+            success_rate, latency = self.history_score(target)
+            return -success_rate * (1 + self.load_score(target)) / (1 + latency)
+        return sorted(targets, key=combined_key)
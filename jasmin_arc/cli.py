@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from arc_interface import ArcInterface
+from constants import ARC_STATUS_MAPPING, ARC_TERMINAL_STATES, LogLevels
+
+# Keys in job lines read by `submit` that are passed to `ArcInterface.submit_jobs`
+SUBMIT_KEYS = ("executable", "args", "input_files", "cpus", "memory", "wall_time", "queue",
+               "environment")
+
+
+class OutputWriter(object):
+    """
+    Write results as JSON lines, one per job, as soon as they are available. Writes from
+    different threads are not interleaved
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.errors = 0
+
+    def write(self, **fields):
+        with self.lock:
+            if "error" in fields:
+                self.errors += 1
+            self.stream.write(json.dumps(fields, sort_keys=True) + "\n")
+            self.stream.flush()
+
+
+def read_lines(path):
+    """
+    Return the lines of a file, where ``-`` means standard input
+    """
+    if path == "-":
+        return sys.stdin.readlines()
+    with open(path) as input_file:
+        return input_file.readlines()
+
+
+def read_job_ids(args):
+    """
+    Return the job IDs given on the command line and in the ``--ids-from`` file. Lines in the file
+    can be plain job IDs or JSON objects with a ``job_id`` key, such as the output of the other
+    commands
+    """
+    job_ids = list(args.job_ids)
+    if args.ids_from:
+        for line in read_lines(args.ids_from):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                line = json.loads(line).get("job_id")
+                if not line:
+                    continue
+            job_ids.append(line)
+
+    # Remove duplicates but keep the order
+    seen = set()
+    return [job_id for job_id in job_ids if not (job_id in seen or seen.add(job_id))]
+
+
+def output_dir_name(job_id):
+    """
+    Return the name of the directory to save a job's outputs in under ``fetch --dest``: the last
+    component of the job ID, which is unique to the job
+    """
+    return job_id.rstrip("/").rsplit("/", 1)[-1]
+
+
+def submit(arc_iface, args, output):
+    """
+    Submit the jobs described in a JSON lines file
+    """
+    jobs = []
+    for line_number, line in enumerate(read_lines(args.jobs_file), 1):
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+            if not isinstance(job, dict) or "executable" not in job:
+                raise ValueError("no executable given")
+            unknown = set(job) - set(SUBMIT_KEYS)
+            if unknown:
+                raise ValueError("unknown key(s): {}".format(", ".join(sorted(unknown))))
+            jobs.append((line_number, job))
+        except ValueError as ex:
+            output.write(line=line_number, error="Invalid job: {}".format(ex))
+
+    def submit_batch(batch):
+        return arc_iface.submit_jobs([job for _, job in batch])
+
+    batches = [jobs[i:i + args.batch_size] for i in range(0, len(jobs), args.batch_size)]
+    with ThreadPoolExecutor(args.parallel) as executor:
+        futures = dict((executor.submit(submit_batch, batch), batch) for batch in batches)
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                results = future.result()
+            except Exception as ex:
+                results = [ex] * len(batch)
+            for (line_number, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    output.write(line=line_number, error=str(result))
+                else:
+                    output.write(line=line_number, job_id=result)
+
+
+def status(arc_iface, args, output):
+    """
+    Print the status of each job, using a single status query
+    """
+    job_ids = read_job_ids(args)
+    statuses = arc_iface.get_job_statuses(job_ids)
+    for job_id in job_ids:
+        if job_id in statuses:
+            output.write(job_id=job_id, status=statuses[job_id].value)
+        else:
+            output.write(job_id=job_id, error="Job not found")
+
+
+def wait(arc_iface, args, output):
+    """
+    Wait for jobs to finish, printing each job's status when it completes or fails
+    """
+    remaining = read_job_ids(args)
+    deadline = time.time() + args.timeout if args.timeout else None
+
+    while True:
+        # Use ARC's states, since states such as Undefined that are reported briefly are mapped to
+        # the failed status but are not terminal
+        states = arc_iface.get_job_states(remaining)
+        still_running = []
+        for job_id in remaining:
+            if job_id not in states:
+                output.write(job_id=job_id, error="Job not found")
+            elif states[job_id] in ARC_TERMINAL_STATES:
+                output.write(job_id=job_id, status=ARC_STATUS_MAPPING[states[job_id]].value)
+            else:
+                still_running.append(job_id)
+        remaining = still_running
+        if not remaining:
+            return
+
+        if deadline is not None and time.time() >= deadline:
+            for job_id in remaining:
+                fields = {"job_id": job_id, "error": "Timed out waiting for job"}
+                if states.get(job_id) is not None:
+                    fields["status"] = ARC_STATUS_MAPPING[states[job_id]].value
+                output.write(**fields)
+            return
+        if deadline is None:
+            time.sleep(args.interval)
+        else:
+            time.sleep(max(min(args.interval, deadline - time.time()), 0))
+
+
+def fetch(arc_iface, args, output):
+    """
+    Download the outputs of jobs
+    """
+    job_ids = read_job_ids(args)
+    destinations = None
+    if args.dest:
+        destinations = dict((job_id, os.path.join(args.dest, output_dir_name(job_id)))
+                            for job_id in job_ids)
+    outputs = arc_iface.save_jobs_outputs(job_ids, parallel=args.parallel,
+                                          destinations=destinations)
+    for job_id in job_ids:
+        if job_id not in outputs:
+            output.write(job_id=job_id, error="Job not found")
+        elif outputs[job_id] is None:
+            output.write(job_id=job_id, error="Failed to retrieve outputs")
+        else:
+            output.write(job_id=job_id, outputs=outputs[job_id])
+
+
+def cancel(arc_iface, args, output):
+    """
+    Cancel jobs
+    """
+    job_ids = read_job_ids(args)
+    results = arc_iface.cancel_jobs(job_ids)
+    for job_id in job_ids:
+        if job_id not in results:
+            output.write(job_id=job_id, error="Job not found")
+        elif not results[job_id]:
+            output.write(job_id=job_id, error="Failed to cancel job")
+        else:
+            output.write(job_id=job_id, cancelled=True)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="jasmin-arc",
+        description="Submit and manage jobs on LOTUS via ARC. Results are written to standard "
+                    "output as one JSON object per line, and log messages to standard error"
+    )
+    parser.add_argument("--config", help="Path to config JSON file")
+    parser.add_argument("--profile", help="Name of a profile in the config file to apply")
+    parser.add_argument("--log-level", choices=[level.name for level in LogLevels],
+                        default=LogLevels.WARNING.name, help="Level of detail to log "
+                                                            "(default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    submit_parser = subparsers.add_parser(
+        "submit", help="Submit jobs",
+        description="Submit jobs described in a file with one JSON object per line, with keys "
+                    "matching the arguments of ArcInterface.submit_job, e.g. "
+                    '{"executable": "/bin/echo", "args": ["hello"]}'
+    )
+    submit_parser.add_argument("--from", dest="jobs_file", required=True, metavar="FILE",
+                               help="File to read jobs from, or - for standard input")
+    submit_parser.add_argument("--batch-size", type=int, default=50,
+                               help="Number of jobs to submit together, which lets the backend "
+                                    "share work such as choosing targets and updating the job "
+                                    "list between them (default: %(default)s)")
+    submit_parser.add_argument("--parallel", type=int, default=1,
+                               help="Number of batches to submit at once (default: %(default)s)")
+    submit_parser.set_defaults(func=submit)
+
+    def add_job_ids(subparser):
+        subparser.add_argument("job_ids", nargs="*", metavar="JOB_ID", help="Job IDs")
+        subparser.add_argument("--ids-from", metavar="FILE",
+                               help="File to read job IDs from, one per line, or - for standard "
+                                    "input. Lines may also be JSON objects with a job_id key")
+
+    status_parser = subparsers.add_parser("status", help="Show the status of jobs")
+    add_job_ids(status_parser)
+    status_parser.set_defaults(func=status)
+
+    wait_parser = subparsers.add_parser("wait", help="Wait for jobs to complete or fail")
+    add_job_ids(wait_parser)
+    wait_parser.add_argument("--interval", type=float, default=30,
+                             help="Seconds between status queries (default: %(default)s)")
+    wait_parser.add_argument("--timeout", type=float, default=0,
+                             help="Maximum number of seconds to wait, or 0 to wait indefinitely")
+    wait_parser.set_defaults(func=wait)
+
+    fetch_parser = subparsers.add_parser("fetch", help="Download job outputs")
+    add_job_ids(fetch_parser)
+    fetch_parser.add_argument("--parallel", type=int, default=1,
+                              help="Number of jobs to download at once (default: %(default)s)")
+    fetch_parser.add_argument("--dest", metavar="DIR",
+                              help="Directory to save each job's outputs in, in a subdirectory "
+                                   "named after the job. Running the command again only "
+                                   "downloads outputs that are missing. Outputs are saved in "
+                                   "temp directories if not given")
+    fetch_parser.set_defaults(func=fetch)
+
+    cancel_parser = subparsers.add_parser("cancel", help="Cancel jobs")
+    add_job_ids(cancel_parser)
+    cancel_parser.set_defaults(func=cancel)
+
+    return parser
+
+
+def main(argv=None, stdout=sys.stdout):
+    """
+    Entry point for the ``jasmin-arc`` command
+
+    :return: Exit status: 0 if all jobs were handled successfully, 1 otherwise
+    """
+    args = get_parser().parse_args(argv)
+    if getattr(args, "parallel", 1) < 1:
+        args.parallel = 1
+    if getattr(args, "batch_size", 1) < 1:
+        args.batch_size = 1
+
+    arc_iface = ArcInterface(args.config, log=sys.stderr, log_level=LogLevels[args.log_level],
+                             profile=args.profile)
+    output = OutputWriter(stdout)
+    args.func(arc_iface, args, output)
+    return 1 if output.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,72 +1,424 @@
 import os
+import copy
+import json
 
 import arc
 
 from exceptions import InvalidConfigError
+from constants import TARGET_RANKING_STRATEGIES, ADMISSION_MODES, BACKENDS
+
+
+#: Prefix of environment variables that override config options, e.g. ``JASMIN_ARC_OUTPUT_FILE``
+ENV_VAR_PREFIX = "JASMIN_ARC_"
+
+#: Environment variable used to select a profile when none is given explicitly
+PROFILE_ENV_VAR = "JASMIN_ARC_PROFILE"
+
+#: Key in a config file under which named profiles are defined
+PROFILES_KEY = "profiles"
+
+# Both ``str`` and ``unicode`` on Python 2 (JSON strings are loaded as unicode)
+STRING_TYPES = (str, type(u""))
+
+TRUE_STRINGS = ("1", "true", "yes", "on")
+FALSE_STRINGS = ("0", "false", "no", "off")
+
+
+class Option(object):
+    """
+    Descriptor for a single typed config option. Values are validated and resolved once when a
+    `ConnectionConfig` is created, and are read-only afterwards: lists are stored as tuples, and
+    dicts are copied each time they are read so callers cannot modify the config through them
+    """
+
+    def __init__(self, type, default, path=False, choices=None):
+        """
+        :param type:    The type values must have: one of ``str``, ``int``, ``float``, ``bool``,
+                        ``list`` or ``dict``
+        :param default: Default value. ``None`` is only allowed if this is the default
+        :param path:    Whether the value is a filesystem path, in which case ``~`` is expanded to
+                        the user's home directory
+        :param choices: Optional collection of allowed values
+        """
+        self.type = type
+        self.path = path
+        self.choices = choices
+        self.name = None  # Set when ConnectionConfig class is created
+        self.default = default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return _copy_value(instance._values[self.name])
+
+    def __set__(self, instance, value):
+        raise AttributeError("Config is immutable: use replace() to change '{}'"
+                             .format(self.name))
+
+    def __repr__(self):
+        return repr(self.default)
+
+    def resolve(self, value):
+        """
+        Convert a value given in a config file or environment variable to the type of this option,
+        and expand paths
+
+        :raises InvalidConfigError: if the value cannot be converted or is not an allowed choice
+        :return:                    The resolved value
+        """
+        if value is None:
+            if self.default is not None:
+                raise InvalidConfigError("'{}' cannot be null".format(self.name))
+            return None
+
+        if isinstance(value, STRING_TYPES) and self.type is not str:
+            value = self.parse_string(value)
+
+        if self.type is float and isinstance(value, int) and not isinstance(value, bool):
+            value = float(value)
+        elif self.type is list and isinstance(value, tuple):
+            value = list(value)
+
+        expected = STRING_TYPES if self.type is str else self.type
+        if not isinstance(value, expected) or (self.type is int and isinstance(value, bool)):
+            raise InvalidConfigError("'{}' must be of type {}, not {}"
+                                     .format(self.name, self.type.__name__, type(value).__name__))
+
+        if self.choices is not None and value not in self.choices:
+            raise InvalidConfigError("'{}' must be one of {}".format(self.name,
+                                                                      ", ".join(self.choices)))
+
+        if self.path:
+            value = os.path.expanduser(value)
+        elif self.type is list:
+            # Store as tuple so that the config remains immutable and hashable
+            value = tuple(value)
+        elif self.type is dict:
+            value = dict(value)
+
+        return value
+
+    def parse_string(self, value):
+        """
+        Parse a string (e.g. from an environment variable) into this option's type. Lists are
+        given as comma separated values, and dicts as JSON
+        """
+        try:
+            if self.type is bool:
+                if value.lower() in TRUE_STRINGS:
+                    return True
+                if value.lower() in FALSE_STRINGS:
+                    return False
+                raise ValueError("invalid boolean '{}'".format(value))
+            if self.type is list:
+                return [item.strip() for item in value.split(",") if item.strip()]
+            if self.type is dict:
+                return json.loads(value)
+            return self.type(value)
+
+        except ValueError as ex:
+            raise InvalidConfigError("Invalid value for '{}': {}".format(self.name, ex))
 
 
 class ConnectionConfig(object):
     """
-    Class to define available config options and their default values
+    Class to define available config options and their default values.
+
+    All values are validated and resolved (including expansion of ``~`` in paths) when the config
+    is created. Values are taken from (in increasing order of precedence): the defaults below,
+    the config file, the selected profile in the config file, and environment variables named
+    ``JASMIN_ARC_<OPTION>``.
+
+    Config objects are immutable - use `replace` to create a modified copy.
     """
 
+    __slots__ = ("_values", "profile")
+
+    #: Where to run jobs: ``arc`` to submit them to LOTUS via the ARC server(s), or ``local`` to run
+    #: them on this machine (see `LocalBackend`), e.g. for development and testing
+    BACKEND = Option(str, "arc", choices=BACKENDS)
+
     #: Path to the private key file associated with your grid certificate
-    CLIENT_KEY = "~/.arc/userkey-nopass.pem"
+    CLIENT_KEY = Option(str, "~/.arc/userkey-nopass.pem", path=True)
 
     #: Path to grid certificate file
-    CLIENT_CERT = "~/.arc/usercert.pem"
+    CLIENT_CERT = Option(str, "~/.arc/usercert.pem", path=True)
 
     #: Path to directory containing trusted CA certificates
-    CERTS_DIR = "/etc/grid-security/certificates"
+    CERTS_DIR = Option(str, "/etc/grid-security/certificates", path=True)
 
     #: Path to the ``arcproxy`` binary, which is used to generate a proxy certificate from the
     #: private key and certificate
-    ARCPROXY_PATH = "/usr/bin/arcproxy"
+    ARCPROXY_PATH = Option(str, "/usr/bin/arcproxy", path=True)
 
     #: Path to save the generated proxy certificate to
-    PROXY_FILE = "/tmp/arcproxy_file"
+    PROXY_FILE = Option(str, "/tmp/arcproxy_file", path=True)
 
     #: URL to the ARC server
-    ARC_SERVER = "jasmin-ce.ceda.ac.uk:60000/arex"
+    ARC_SERVER = Option(str, "jasmin-ce.ceda.ac.uk:60000/arex")
+
+    #: List of URLs of ARC servers to distribute jobs across. If empty, only `ARC_SERVER` is used
+    ARC_SERVERS = Option(list, [])
+
+    #: Number of seconds to cache the execution targets discovered on each ARC server for. Set to
+    #: 0 to discover targets on every submission
+    TARGET_CACHE_TTL = Option(int, 60)
 
     #: Number of seconds to set the validity period to when generating a proxy file (default: 12
     #: hours)
-    PROXY_VALIDITY_PERIOD = 12 * 60 * 60
+    PROXY_VALIDITY_PERIOD = Option(int, 12 * 60 * 60)
 
     #: The number of seconds the proxy file can have till expiry before a new proxy
     #: is automatically generated
-    PROXY_RENEWAL_THRESHOLD = 10
+    PROXY_RENEWAL_THRESHOLD = Option(int, 10)
 
     #: Path to job information file used by ARC client tools (arcstat, arcget etc) to load
     #: information about submitted jobs
-    JOBS_INFO_FILE = "~/.arc/jobs.dat"
+    JOBS_INFO_FILE = Option(str, "~/.arc/jobs.dat", path=True)
 
     #: The name of the file/directory to download when retrieving job outputs.
-    OUTPUT_FILE = "output"
+    OUTPUT_FILE = Option(str, "output")
+
+    #: Strategy used to choose which execution target to submit jobs to first: one of
+    #: ``ordered``, ``load``, ``latency`` or ``combined`` (see `TargetBroker`)
+    TARGET_RANKING_STRATEGY = Option(str, "combined", choices=TARGET_RANKING_STRATEGIES)
+
+    #: Weight (between 0 and 1) given to previous measurements when updating the submission
+    #: latency and success rate statistics for a target. Lower values adapt more quickly
+    TARGET_STATS_DECAY = Option(float, 0.7)
+
+    #: Default number of CPU cores to request for each job, or 0 to use the LOTUS default
+    JOB_CPUS = Option(int, 0)
+
+    #: Default amount of memory to request for each job in MB, or 0 to use the LOTUS default
+    JOB_MEMORY = Option(int, 0)
+
+    #: Default wall time limit for each job in seconds, or 0 to use the LOTUS default
+    JOB_WALL_TIME = Option(int, 0)
+
+    #: Default queue to submit jobs to. If not set, the queue is chosen by the ARC server
+    JOB_QUEUE = Option(str, None)
+
+    #: Environment variables to set for every job, as a dictionary mapping names to values
+    JOB_ENVIRONMENT = Option(dict, {})
+
+    #: Directory to store the descriptions of submitted jobs in, so they can be resubmitted with
+    #: `ArcInterface.resubmit_job`, e.g. ``~/.arc/jasmin_arc_jobs``. If not set, descriptions are
+    #: not stored and jobs cannot be resubmitted
+    JOB_STORE_DIR = Option(str, None, path=True)
+
+    #: Maximum number of times `ArcInterface.resubmit_failed` resubmits a job that has failed, or 0
+    #: to never resubmit jobs automatically. Requires `JOB_STORE_DIR`
+    AUTO_RESUBMIT_ATTEMPTS = Option(int, 0)
+
+    #: ARC job states that cause a job to be resubmitted by `ArcInterface.resubmit_failed`
+    AUTO_RESUBMIT_STATES = Option(list, ["Failed", "Killed"])
+
+    #: Maximum number of jobs to submit per second, or 0 for no limit
+    SUBMIT_RATE = Option(float, 0.0)
+
+    #: Number of jobs that can be submitted in a burst before `SUBMIT_RATE` applies
+    SUBMIT_BURST = Option(int, 1)
+
+    #: Maximum number of jobs submitted by this client that can be in flight (i.e. not yet
+    #: finished, failed or cancelled) at once, or 0 for no limit. Jobs are released when their
+    #: status is checked, and the statuses of in-flight jobs are queried when the limit is reached
+    MAX_IN_FLIGHT = Option(int, 0)
+
+    #: What to do when submitting a job would exceed `SUBMIT_RATE` or `MAX_IN_FLIGHT`: ``block``
+    #: to wait until there is capacity, or ``reject`` to raise `SubmissionLimitError`
+    ADMISSION_MODE = Option(str, "block", choices=ADMISSION_MODES)
+
+    #: Maximum number of seconds to wait for capacity in ``block`` mode, or 0 to wait indefinitely
+    ADMISSION_TIMEOUT = Option(float, 0.0)
+
+    #: Maximum number of attempts for target discovery, job submission, status queries and output
+    #: retrieval when they fail transiently (1 means no retries)
+    RETRY_ATTEMPTS = Option(int, 3)
 
-    def __init__(self, config_dict, logger=None):
+    #: Delay in seconds before the first retry. The delay doubles for each further retry, and
+    #: random jitter is applied
+    RETRY_BASE_DELAY = Option(float, 1.0)
+
+    #: Maximum delay in seconds between retries
+    RETRY_MAX_DELAY = Option(float, 30.0)
+
+    #: Number of consecutive failed submissions after which an execution target is skipped for
+    #: `BREAKER_COOLDOWN` seconds, or 0 to never skip targets
+    BREAKER_FAILURE_THRESHOLD = Option(int, 3)
+
+    #: Number of seconds to skip a failing execution target for. ARC servers that fail are also
+    #: tried last for this long, doubling for each further consecutive failure
+    BREAKER_COOLDOWN = Option(float, 300.0)
+
+    #: Directory to cache the outputs of completed jobs in, so that submitting an identical job
+    #: (same executable, arguments, input file contents and `OUTPUT_FILE`) returns the earlier
+    #: job's outputs instead of running it again. Outputs are cached when they are saved, by any
+    #: process using the same directory. If not set, results are not cached
+    RESULT_CACHE_DIR = Option(str, None, path=True)
+
+    #: Maximum number of job results to keep in `RESULT_CACHE_DIR`. The least recently used
+    #: results are removed first
+    RESULT_CACHE_SIZE = Option(int, 100)
+
+    #: Default number of seconds between job status refreshes in `JobWatcher`
+    STATUS_POLL_INTERVAL = Option(float, 30.0)
+
+    #: Directory to create the session directories of jobs run by the ``local`` backend in
+    LOCAL_WORK_DIR = Option(str, "~/.arc/jasmin_arc_local", path=True)
+
+    #: Maximum number of jobs the ``local`` backend runs at once, or 0 to use the number of CPUs
+    LOCAL_MAX_WORKERS = Option(int, 0)
+
+    #: Path to the Unix socket the agent (see `AgentServer`) listens on
+    AGENT_SOCKET = Option(str, "~/.arc/jasmin_arc_agent.sock", path=True)
+
+    #: Whether to send requests through the agent when one is running on `AGENT_SOCKET` with the
+    #: same `BACKEND`, instead of contacting the ARC server directly
+    USE_AGENT = Option(bool, True)
+
+    #: Number of seconds the agent reuses the job states it has queried for, so that status
+    #: requests from many clients are answered with one query. Set to 0 to query for every request
+    AGENT_STATUS_TTL = Option(float, 5.0)
+
+    #: Number of seconds to wait for the agent to answer a request before failing with
+    #: `AgentError`, or 0 to wait indefinitely
+    AGENT_TIMEOUT = Option(float, 120.0)
+
+    #: Number of seconds to wait for the agent to download job outputs, or 0 to wait indefinitely
+    AGENT_RETRIEVE_TIMEOUT = Option(float, 3600.0)
+
+    def __init__(self, config_dict=None, logger=None, profile=None, environ=None):
         """
         :param config_dict: A dictionary containing options to override. Each key should be one of
-                            the default options listed above
+                            the default options listed above. A ``profiles`` key may map profile
+                            names to further dictionaries of overrides
         :param logger:      An instance of ``arc.Logger`` used to log warnings about invalid config
                             options
+        :param profile:     Name of the profile to apply, or ``None`` to use the profile named in
+                            the ``JASMIN_ARC_PROFILE`` environment variable (if any)
+        :param environ:     Mapping to read environment variable overrides from (default:
+                            ``os.environ``)
+
+        :raises InvalidConfigError: if an option has an invalid value or the profile does not exist
         """
-        for key, value in config_dict.items():
-            if hasattr(self, key):
-                setattr(self, key, value)
-            elif logger:
+        config_dict = dict(config_dict or {})
+        environ = os.environ if environ is None else environ
+
+        profiles = config_dict.pop(PROFILES_KEY, {})
+        profile = profile or environ.get(PROFILE_ENV_VAR)
+        if profile:
+            try:
+                config_dict.update(profiles[profile])
+            except KeyError:
+                raise InvalidConfigError("Profile '{}' is not defined".format(profile))
+
+        for key in config_dict:
+            if key not in self.option_names() and logger:
                 logger.msg(arc.WARNING, "'{}' is not a valid config option".format(key))
 
-    def __getattribute__(self, key):
+        values = {}
+        for name in self.option_names():
+            option = self.get_option(name)
+            env_var = ENV_VAR_PREFIX + name
+            if env_var in environ:
+                raw = environ[env_var]
+            else:
+                raw = config_dict.get(name, option.default)
+            values[name] = option.resolve(raw)
+
+        object.__setattr__(self, "_values", values)
+        object.__setattr__(self, "profile", profile)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Config is immutable: use replace() to change '{}'".format(key))
+
+    def __eq__(self, other):
+        return isinstance(other, ConnectionConfig) and self._values == other._values
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self.key()))
+
+    def __repr__(self):
+        return "ConnectionConfig({})".format(", ".join("{}={!r}".format(name, value)
+                                                      for name, value in self.key()))
+
+    def key(self):
         """
-        Expand ~ to home directory in config values
+        Return a tuple of (name, value) pairs that identifies this config, suitable for use as a
+        key for caches that depend on config values
         """
-        val = super(ConnectionConfig, self).__getattribute__(key)
-        home_dir = os.environ.get("HOME")
-        if home_dir:
-            try:
-                val = val.replace("~", home_dir)
-            except AttributeError:
-                pass
+        return tuple((name, _hashable(self._values[name])) for name in self.option_names())
+
+    def replace(self, **changes):
+        """
+        Return a new config with the given options changed. Values are validated and resolved in
+        the same way as in the constructor, but environment variables are not re-read.
+
+        :raises InvalidConfigError: if an option name or value is invalid
+        :return:                    A new `ConnectionConfig`
+        """
+        values = dict(self._values)
+        for name, value in changes.items():
+            if name not in self.option_names():
+                raise InvalidConfigError("'{}' is not a valid config option".format(name))
+            values[name] = self.get_option(name).resolve(value)
+
+        new_config = object.__new__(ConnectionConfig)
+        object.__setattr__(new_config, "_values", values)
+        object.__setattr__(new_config, "profile", self.profile)
+        return new_config
+
+    def arc_servers(self):
+        """
+        Return the list of ARC server URLs to use: `ARC_SERVERS` if set, otherwise `ARC_SERVER`
+        """
+        return list(self.ARC_SERVERS) or [self.ARC_SERVER]
+
+    def as_dict(self):
+        """
+        Return a dictionary mapping option names to values. Modifying it does not affect the
+        config
+        """
+        return dict((name, _copy_value(value)) for name, value in self._values.items())
+
+    @classmethod
+    def option_names(cls):
+        """
+        Return a sorted list of the names of all available options
+        """
+        return _OPTION_NAMES
+
+    @classmethod
+    def get_option(cls, name):
+        """
+        Return the `Option` descriptor for the given option name
+        """
+        return cls.__dict__[name]
+
+
+def _copy_value(value):
+    """
+    Return a config value that is safe to hand to callers: a copy of dicts, which are mutable,
+    and other values unchanged
+    """
+    return copy.deepcopy(value) if isinstance(value, dict) else value
+
+
+def _hashable(value):
+    """
+    Convert a config value to a hashable equivalent
+    """
+    if isinstance(value, dict):
+        return tuple(sorted(value.items()))
+    return value
+
 
-        return val
+_OPTION_NAMES = []
+for _name, _value in sorted(vars(ConnectionConfig).items()):
+    if isinstance(_value, Option):
+        _value.name = _name
+        _OPTION_NAMES.append(_name)
@@ -31,6 +31,9 @@ ARC_STATUS_MAPPING = {
     "Other": JobStatuses.FAILED
 }
 
+#: ARC job states after which a job will not change state again
+ARC_TERMINAL_STATES = ("Finished", "Killed", "Failed", "Deleted")
+
 
 class LogLevels(Enum):
     """
@@ -60,3 +63,14 @@ class LogLevels(Enum):
     #: FATAL level designates very severe error events that will presumably lead the application to
     #: abort
     FATAL = arc.FATAL
+
+
+#: Strategies available for ranking execution targets when submitting jobs (see `TargetBroker`)
+TARGET_RANKING_STRATEGIES = ("ordered", "load", "latency", "combined")
+
+#: Behaviours available when a submission would exceed the admission limits (see
+#: `AdmissionController`)
+ADMISSION_MODES = ("block", "reject")
+
+#: Backends available for running jobs (see `ArcInterface`)
+BACKENDS = ("arc", "local")
@@ -38,3 +38,22 @@ class InputFileError(Exception):
     """
     Input file does not exist or is not a file
     """
+
+
+class SubmissionLimitError(JobSubmissionError):
+    """
+    Job could not be submitted without exceeding the configured submission rate or maximum number
+    of jobs in flight
+    """
+
+
+class WorkflowError(Exception):
+    """
+    Workflow is invalid, e.g. it contains a cycle or depends on an unknown job
+    """
+
+
+class AgentError(Exception):
+    """
+    The agent could not be reached, or failed to handle a request
+    """
@@ -0,0 +1,181 @@
+import threading
+import time
+from collections import OrderedDict
+
+from broker import TargetBroker
+
+
+class ArcServer(object):
+    """
+    State kept about a single ARC CE server: its cached execution targets, recent health and the
+    jobs submitted to it
+    """
+
+    #: Maximum factor the failure cool-down is multiplied by for repeated failures
+    MAX_COOLDOWN_FACTOR = 8
+
+    def __init__(self, url):
+        """
+        :param url: URL of the ARC server, as given in the config
+        """
+        self.url = url
+        self.targets = None
+        self.targets_time = None
+        self.consecutive_failures = 0
+        self.last_failure_time = None
+        self.submitted_jobs = 0
+        # IDs of jobs submitted to this server that are not known to have finished
+        self.in_flight = set()
+
+    def get_cached_targets(self, ttl):
+        """
+        Return the cached list of execution targets, or ``None`` if there are none or they are
+        older than `ttl` seconds
+        """
+        if self.targets is None or ttl <= 0:
+            return None
+        if time.time() - self.targets_time > ttl:
+            self.clear_targets()
+            return None
+        return self.targets
+
+    def set_targets(self, targets):
+        """
+        Cache a list of execution targets discovered on this server
+        """
+        self.targets = list(targets)
+        self.targets_time = time.time()
+
+    def clear_targets(self):
+        """
+        Remove cached targets so that they are rediscovered on next use
+        """
+        self.targets = None
+        self.targets_time = None
+
+    def load_score(self, ttl):
+        """
+        Return the total load score (see `TargetBroker.load_score`) of the targets cached in the
+        last `ttl` seconds, or 0 if there are none. Higher is better
+        """
+        return sum(TargetBroker.load_score(target) for target in self.get_cached_targets(ttl) or [])
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.last_failure_time = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.last_failure_time = time.time()
+
+    def is_cooling_down(self, cooldown):
+        """
+        Return whether the server failed recently enough that it should only be tried after
+        healthy servers. The cool-down starts at `cooldown` seconds and doubles with each further
+        consecutive failure, up to `MAX_COOLDOWN_FACTOR` times. Once it has passed the server is
+        ranked normally again, so the next submission probes whether it has recovered
+        """
+        if not self.consecutive_failures:
+            return False
+        factor = min(2 ** (self.consecutive_failures - 1), self.MAX_COOLDOWN_FACTOR)
+        return time.time() - self.last_failure_time < cooldown * factor
+
+    def matches_job(self, job_id):
+        """
+        Return whether the given job ID looks like it was issued by this server. ARC job IDs are
+        URLs under the server's URL, e.g. ``https://<server>/arex/<id>``
+        """
+        address = self.url.split("://", 1)[-1].rstrip("/")
+        return address in job_id
+
+
+class ServerPool(object):
+    """
+    Collection of ARC servers that jobs can be submitted to. Servers are ranked for submission by
+    health and load, and the server each job was submitted to is remembered so that queries about
+    a job only go to the server that owns it
+    """
+
+    def __init__(self, urls, target_cache_ttl=60, failure_cooldown=300.0):
+        """
+        :param urls:             List of ARC server URLs
+        :param target_cache_ttl: Number of seconds to cache each server's execution targets for
+        :param failure_cooldown: Number of seconds a server that failed is ranked last for (see
+                                 `ArcServer.is_cooling_down`)
+        """
+        self.servers = OrderedDict((url, ArcServer(url)) for url in urls)
+        self.target_cache_ttl = target_cache_ttl
+        self.failure_cooldown = failure_cooldown
+        self.job_owners = {}
+        self.lock = threading.Lock()
+
+    def reconfigure(self, urls, target_cache_ttl, failure_cooldown):
+        """
+        Change the list of servers, keeping the state of servers that remain in the pool. Cached
+        targets are cleared since they may depend on the config in use
+        """
+        with self.lock:
+            self.servers = OrderedDict((url, self.servers.get(url) or ArcServer(url))
+                                       for url in urls)
+            for server in self.servers.values():
+                server.clear_targets()
+            self.target_cache_ttl = target_cache_ttl
+            self.failure_cooldown = failure_cooldown
+
+    def ranked(self):
+        """
+        Return the list of servers in the order submissions should be attempted: servers that
+        are not cooling down after a failure first, then by fewest jobs in flight from this
+        client, then by decreasing load score of recently discovered targets. The sort is stable
+        so servers otherwise keep their configured order
+        """
+        with self.lock:
+            servers = list(self.servers.values())
+            return sorted(servers, key=lambda s: (s.is_cooling_down(self.failure_cooldown),
+                                                  len(s.in_flight),
+                                                  -s.load_score(self.target_cache_ttl)))
+
+    def all_servers(self):
+        """
+        Return the list of servers in their configured order
+        """
+        with self.lock:
+            return list(self.servers.values())
+
+    def add_job(self, job_id, server):
+        """
+        Record that the given job has been submitted to the given server
+        """
+        with self.lock:
+            self.job_owners[job_id] = server.url
+            server.submitted_jobs += 1
+            server.in_flight.add(job_id)
+
+    def job_finished(self, job_id):
+        """
+        Record that a job is no longer in flight, e.g. because it has reached a terminal state
+        """
+        with self.lock:
+            for server in self.servers.values():
+                server.in_flight.discard(job_id)
+
+    def set_owner(self, job_id, server):
+        """
+        Record that an existing job was found on the given server
+        """
+        with self.lock:
+            self.job_owners[job_id] = server.url
+
+    def servers_for_job(self, job_id):
+        """
+        Return the list of servers that should be queried to find the given job: the server that
+        owns it if known, otherwise any servers whose URL matches the job ID, and otherwise all
+        servers
+        """
+        with self.lock:
+            owner = self.job_owners.get(job_id)
+            if owner in self.servers:
+                return [self.servers[owner]]
+
+            matching = [s for s in self.servers.values() if s.matches_job(job_id)]
+            return matching or list(self.servers.values())
@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class JobStore(object):
+    """
+    Local store of the descriptions of submitted jobs, so that jobs can be resubmitted without
+    rebuilding their descriptions, and of the lineage between jobs and their resubmissions.
+
+    Each description is stored in a file named after a hash of the job ID. Lineage is stored in a
+    JSON file mapping each job ID to the ID of the job it was resubmitted from (``parent``) and the
+    ID of the job it was resubmitted as (``retry``).
+    """
+
+    LINEAGE_FILENAME = "lineage.json"
+
+    def __init__(self, directory):
+        """
+        :param directory: Directory to store descriptions in. Created if it does not exist
+        """
+        self.directory = directory
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        lineage_path = os.path.join(directory, self.LINEAGE_FILENAME)
+        self.lineage = {}
+        if os.path.isfile(lineage_path):
+            with open(lineage_path) as lineage_file:
+                self.lineage = json.load(lineage_file)
+
+    def description_path(self, job_id):
+        filename = hashlib.sha1(job_id.encode("utf-8")).hexdigest() + ".description"
+        return os.path.join(self.directory, filename)
+
+    def save_lineage(self):
+        """
+        Write the lineage file, replacing the old one atomically. Callers must hold the lock
+        """
+        lineage_path = os.path.join(self.directory, self.LINEAGE_FILENAME)
+        with open(lineage_path + ".tmp", "w") as lineage_file:
+            json.dump(self.lineage, lineage_file)
+        os.rename(lineage_path + ".tmp", lineage_path)
+
+    def save(self, job_id, description):
+        """
+        Store the description a job was submitted with
+
+        :param job_id:      ID of the submitted job
+        :param description: The job description as a string
+        """
+        path = self.description_path(job_id)
+        with open(path + ".tmp", "w") as description_file:
+            description_file.write(description)
+        os.rename(path + ".tmp", path)
+
+    def load(self, job_id):
+        """
+        Return the stored description of a job, or ``None`` if there is none
+        """
+        try:
+            with open(self.description_path(job_id)) as description_file:
+                return description_file.read()
+        except IOError:
+            return None
+
+    def add_retry(self, job_id, retry_id):
+        """
+        Record that a job was resubmitted with a new ID
+        """
+        with self.lock:
+            self.lineage.setdefault(job_id, {})["retry"] = retry_id
+            self.lineage.setdefault(retry_id, {})["parent"] = job_id
+            self.save_lineage()
+
+    def get_lineage(self, job_id):
+        """
+        Return the list of IDs of the original job and each resubmission of it, in order, for the
+        chain containing the given job
+        """
+        with self.lock:
+            first = job_id
+            while self.lineage.get(first, {}).get("parent"):
+                first = self.lineage[first]["parent"]
+
+            chain = [first]
+            while self.lineage.get(chain[-1], {}).get("retry"):
+                chain.append(self.lineage[chain[-1]]["retry"])
+            return chain
+
+    def latest(self, job_id):
+        """
+        Return the ID of the most recent resubmission of a job, or the job ID itself if it has not
+        been resubmitted
+        """
+        with self.lock:
+            while self.lineage.get(job_id, {}).get("retry"):
+                job_id = self.lineage[job_id]["retry"]
+            return job_id
+
+    def resubmissions(self, job_id):
+        """
+        Return the number of times the original job in the given job's chain has been
+        resubmitted, up to and including the given job
+        """
+        with self.lock:
+            count = 0
+            while self.lineage.get(job_id, {}).get("parent"):
+                job_id = self.lineage[job_id]["parent"]
+                count += 1
+            return count
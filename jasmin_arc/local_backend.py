@@ -0,0 +1,353 @@
+import os
+import json
+import errno
+import time
+import uuid
+import shutil
+import signal
+import threading
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor
+
+import arc
+
+from backend import Backend
+from constants import ARC_TERMINAL_STATES
+from outputs import copy_if_changed, copy_missing
+from exceptions import InvalidJobDescription, JobNotFoundError
+
+
+#: Prefix of the IDs of jobs run by `LocalBackend`
+JOB_ID_PREFIX = "local://"
+
+# Namespaces used in the JSDL template
+JSDL_NAMESPACES = {
+    "jsdl": "http://schemas.ggf.org/jsdl/2005/11/jsdl",
+    "posix": "http://schemas.ggf.org/jsdl/2005/11/jsdl-posix"
+}
+
+# Names of the files `run_job` keeps in each session directory to record the state of a job. These
+# start with a dot so they are not mistaken for job outputs
+JOB_FILE = ".job.json"
+PID_FILE = ".pid"
+EXIT_CODE_FILE = ".exit_code"
+CANCELLED_FILE = ".cancelled"
+TIMED_OUT_FILE = ".timed_out"
+# Written once a job's files have been removed by `clean_session`
+CLEANED_FILE = ".cleaned"
+STATE_FILES = (JOB_FILE, PID_FILE, EXIT_CODE_FILE, CANCELLED_FILE, TIMED_OUT_FILE, CLEANED_FILE)
+
+# Number of seconds between checks for cancellation and wall time expiry while a job runs
+POLL_INTERVAL = 0.1
+
+
+def write_marker(session_dir, filename, contents=""):
+    """
+    Write a state file in a session directory atomically, so readers never see a partial file
+    """
+    path = os.path.join(session_dir, filename)
+    with open(path + ".tmp", "w") as marker_file:
+        marker_file.write(contents)
+    os.rename(path + ".tmp", path)
+
+
+def clean_session(session_dir):
+    """
+    Remove a job's input and output files from its session directory, keeping only the files that
+    record its state so that it can still be queried
+    """
+    for name in os.listdir(session_dir):
+        if name in STATE_FILES:
+            continue
+        path = os.path.join(session_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    write_marker(session_dir, CLEANED_FILE)
+
+
+def run_job(session_dir, executable, args, environment, wall_time, stdout_name, stderr_name):
+    """
+    Run a job's executable in its session directory, and record its process ID and exit code
+    there. This runs in a worker process of `LocalBackend`'s pool, so must be a module-level
+    function
+
+    :return: Exit code of the job
+    """
+    if os.path.exists(os.path.join(session_dir, CANCELLED_FILE)):
+        write_marker(session_dir, EXIT_CODE_FILE, str(-signal.SIGTERM))
+        clean_session(session_dir)
+        return -signal.SIGTERM
+
+    # Executables staged as input files are run from the session directory, as on ARC
+    if not os.path.isabs(executable) and os.path.isfile(os.path.join(session_dir, executable)):
+        executable = os.path.join(session_dir, executable)
+
+    env = dict(os.environ)
+    env.update(environment)
+
+    with open(os.path.join(session_dir, stdout_name), "w") as stdout_file, \
+            open(os.path.join(session_dir, stderr_name), "w") as stderr_file:
+        try:
+            process = subprocess.Popen([executable] + args, cwd=session_dir, env=env,
+                                       stdout=stdout_file, stderr=stderr_file)
+        except OSError as ex:
+            stderr_file.write("Failed to run {}: {}\n".format(executable, ex))
+            write_marker(session_dir, EXIT_CODE_FILE, "127")
+            return 127
+
+        write_marker(session_dir, PID_FILE, str(process.pid))
+        start_time = time.time()
+        while process.poll() is None:
+            if os.path.exists(os.path.join(session_dir, CANCELLED_FILE)):
+                process.terminate()
+            elif wall_time and time.time() - start_time > wall_time:
+                write_marker(session_dir, TIMED_OUT_FILE)
+                process.kill()
+            time.sleep(POLL_INTERVAL)
+
+    write_marker(session_dir, EXIT_CODE_FILE, str(process.returncode))
+    if os.path.exists(os.path.join(session_dir, CANCELLED_FILE)):
+        clean_session(session_dir)
+    return process.returncode
+
+
+def process_exists(pid):
+    """
+    Return whether a process with the given ID is running
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        # EPERM means the process exists but belongs to another user
+        return ex.errno == errno.EPERM
+    return True
+
+
+class LocalBackend(Backend):
+    """
+    Backend that runs jobs on the local machine in a pool of worker processes, for development
+    and testing without access to an ARC server.
+
+    Each job runs in its own session directory under `LOCAL_WORK_DIR`, into which input files are
+    copied, and ``stdout`` and ``stderr`` are written to ``stdout.txt`` and ``stderr.txt`` as on
+    ARC. The state of each job is recorded in its session directory, so jobs can be queried and
+    their outputs retrieved from other processes. CPU, memory and queue requirements are ignored.
+
+    Once a job's outputs have been retrieved, or a cancelled job has stopped, its files are
+    removed from the session directory (see `clean_session`), leaving only the small files that
+    record its state. Outputs can therefore only be retrieved once, as with ``arcget``.
+    """
+
+    def __init__(self, config, logger):
+        super(LocalBackend, self).__init__(config, logger)
+        self.executor = None
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def configure(self, config):
+        if config.LOCAL_MAX_WORKERS != self.config.LOCAL_MAX_WORKERS:
+            with self.lock:
+                # Jobs already given to the old pool still run; new jobs go to a new pool
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+        self.config = config
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.config.LOCAL_MAX_WORKERS or None)
+            return self.executor
+
+    def session_dir(self, job_id):
+        """
+        Return the session directory of a job
+
+        :raises JobNotFoundError: if the job ID was not issued by this backend
+        """
+        if not job_id.startswith(JOB_ID_PREFIX):
+            raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+        path = os.path.join(self.config.LOCAL_WORK_DIR, job_id[len(JOB_ID_PREFIX):])
+        if not os.path.isfile(os.path.join(path, JOB_FILE)):
+            raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+        return path
+
+    def parse_description(self, description):
+        """
+        Extract the information needed to run a job from a JSDL description rendered from the
+        job template
+
+        :raises InvalidJobDescription: if the description cannot be parsed
+        :return:                       Dictionary describing the job
+        """
+        try:
+            root = ElementTree.fromstring(description)
+        except ElementTree.ParseError as ex:
+            raise InvalidJobDescription("Could not parse job description XML: {}".format(ex))
+
+        app = root.find("jsdl:JobDescription/jsdl:Application/posix:POSIXApplication",
+                        JSDL_NAMESPACES)
+        executable = app.find("posix:Executable", JSDL_NAMESPACES) if app is not None else None
+        if executable is None or not executable.text:
+            raise InvalidJobDescription("Job description does not specify an executable")
+
+        def text(path, default):
+            element = app.find(path, JSDL_NAMESPACES)
+            return element.text if element is not None and element.text else default
+
+        job = {
+            "executable": executable.text.strip(),
+            "args": [arg.text or "" for arg in app.findall("posix:Argument", JSDL_NAMESPACES)],
+            "environment": dict((env.get("name"), env.text or "")
+                                for env in app.findall("posix:Environment", JSDL_NAMESPACES)),
+            "wall_time": int(text("posix:WallTimeLimit", 0)),
+            "stdout": text("posix:Output", "stdout.txt"),
+            "stderr": text("posix:Error", "stderr.txt"),
+            "input_files": {},
+            "output_files": []
+        }
+
+        # Staging elements with a source are input files; those without are outputs
+        for staging in root.findall("jsdl:JobDescription/jsdl:DataStaging", JSDL_NAMESPACES):
+            name = staging.find("jsdl:FileName", JSDL_NAMESPACES).text
+            uri = staging.find("jsdl:Source/jsdl:URI", JSDL_NAMESPACES)
+            if uri is None:
+                job["output_files"].append(name)
+            elif uri.text.startswith("file://"):
+                job["input_files"][name] = uri.text[len("file://"):]
+            else:
+                raise InvalidJobDescription("Unsupported input file URL: {}".format(uri.text))
+
+        return job
+
+    def submit(self, description):
+        job = self.parse_description(description)
+
+        job_uuid = uuid.uuid4().hex
+        session_dir = os.path.join(self.config.LOCAL_WORK_DIR, job_uuid)
+        os.makedirs(session_dir)
+        for name, local_path in job["input_files"].items():
+            shutil.copy2(local_path, os.path.join(session_dir, name))
+        # Record which process's pool runs the job, so other processes can tell whether a job
+        # that has not started yet is still queued
+        job["owner"] = os.getpid()
+        write_marker(session_dir, JOB_FILE, json.dumps(job))
+
+        job_id = JOB_ID_PREFIX + job_uuid
+        future = self.get_executor().submit(run_job, session_dir, job["executable"], job["args"],
+                                            job["environment"], job["wall_time"], job["stdout"],
+                                            job["stderr"])
+        with self.lock:
+            self.futures[job_id] = future
+        self.logger.msg(arc.DEBUG, "Running job locally in {}".format(session_dir))
+        return job_id
+
+    def get_state(self, job_id):
+        """
+        Return the ARC general state of a job from the files in its session directory
+
+        :raises JobNotFoundError: if no job with the given ID could be found
+        """
+        session_dir = self.session_dir(job_id)
+
+        def exists(filename):
+            return os.path.exists(os.path.join(session_dir, filename))
+
+        if exists(EXIT_CODE_FILE):
+            with open(os.path.join(session_dir, EXIT_CODE_FILE)) as exit_code_file:
+                exit_code = int(exit_code_file.read())
+            if exit_code == 0:
+                return "Finished"
+            return "Killed" if exists(CANCELLED_FILE) or exists(TIMED_OUT_FILE) else "Failed"
+
+        with self.lock:
+            future = self.futures.get(job_id)
+        if future is None:
+            with open(os.path.join(session_dir, JOB_FILE)) as job_file:
+                owner = json.load(job_file).get("owner")
+            if owner is None or not process_exists(owner):
+                # The process running the job exited without recording its exit code
+                return "Killed" if exists(CANCELLED_FILE) else "Failed"
+
+        if exists(PID_FILE):
+            return "Running"
+        if exists(CANCELLED_FILE):
+            return "Killed"
+        if future is not None and future.done():
+            # The worker process died without recording the job's exit code
+            return "Failed"
+        return "Queuing"
+
+    def get_states(self, job_ids=None):
+        if job_ids is None:
+            if not os.path.isdir(self.config.LOCAL_WORK_DIR):
+                return {}
+            job_ids = [JOB_ID_PREFIX + name for name in os.listdir(self.config.LOCAL_WORK_DIR)]
+
+        states = {}
+        for job_id in job_ids:
+            try:
+                states[job_id] = self.get_state(job_id)
+            except JobNotFoundError:
+                pass
+        return states
+
+    def cancel(self, job_id):
+        session_dir = self.session_dir(job_id)
+        if os.path.exists(os.path.join(session_dir, EXIT_CODE_FILE)):
+            return False
+
+        write_marker(session_dir, CANCELLED_FILE)
+        with self.lock:
+            future = self.futures.get(job_id)
+        if future is not None:
+            # Jobs that have not started yet never run; running jobs are stopped, and their files
+            # removed, by their worker
+            if future.cancel():
+                clean_session(session_dir)
+            return True
+
+        # The job belongs to another process's pool, so signal it directly
+        try:
+            with open(os.path.join(session_dir, PID_FILE)) as pid_file:
+                os.kill(int(pid_file.read()), signal.SIGTERM)
+        except (IOError, OSError, ValueError):
+            pass
+        with open(os.path.join(session_dir, JOB_FILE)) as job_file:
+            owner = json.load(job_file).get("owner")
+        if owner is None or not process_exists(owner):
+            # No worker is left to remove the job's files
+            clean_session(session_dir)
+        return True
+
+    def retrieve(self, job_id, directory):
+        session_dir = self.session_dir(job_id)
+        state = self.get_state(job_id)
+        if state not in ARC_TERMINAL_STATES:
+            # Outputs are not complete until the job has ended
+            return (False, state)
+
+        if os.path.exists(os.path.join(session_dir, CLEANED_FILE)):
+            self.logger.msg(arc.WARNING, "Outputs have already been retrieved or discarded",
+                            job_id=job_id, phase="retrieve")
+            return (False, state)
+
+        with open(os.path.join(session_dir, JOB_FILE)) as job_file:
+            job = json.load(job_file)
+
+        # Files copied by an earlier call are only copied again if they have changed
+        for name in job["output_files"] + [job["stdout"], job["stderr"]]:
+            src = os.path.join(session_dir, name)
+            if os.path.isdir(src):
+                copy_missing(src, os.path.join(directory, name))
+            elif os.path.isfile(src):
+                copy_if_changed(src, os.path.join(directory, name))
+
+        clean_session(session_dir)
+        return (True, state)
@@ -0,0 +1,188 @@
+import os
+import json
+import zlib
+import shutil
+import hashlib
+
+
+#: Name of the file recording the ID of the job whose outputs were saved by
+#: `ArcInterface.save_job_outputs`, and the size and SHA-256 checksum of each file
+MANIFEST_FILENAME = ".jasmin_arc_manifest.json"
+
+#: Suffix added to a destination directory to get the staging directory outputs are downloaded to
+#: before being moved into place
+STAGING_SUFFIX = ".partial"
+
+# Size of chunks to read when computing checksums
+CHUNK_SIZE = 1024 * 1024
+
+
+def list_files(directory):
+    """
+    Return the paths, relative to `directory`, of all files under it except the manifest
+    """
+    paths = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(root, filename), directory)
+            if path != MANIFEST_FILENAME:
+                paths.append(path)
+    return sorted(paths)
+
+
+def file_checksum(path, algorithm="sha256"):
+    """
+    Return the hex checksum of a file. `algorithm` is ``adler32`` or any algorithm supported by
+    ``hashlib``
+    """
+    with open(path, "rb") as f:
+        chunks = iter(lambda: f.read(CHUNK_SIZE), b"")
+        if algorithm == "adler32":
+            value = 1
+            for chunk in chunks:
+                value = zlib.adler32(chunk, value)
+            return "{:08x}".format(value & 0xffffffff)
+
+        digest = hashlib.new(algorithm)
+        for chunk in chunks:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def checksum_matches(path, checksum):
+    """
+    Return whether a local file matches a checksum reported by ARC in the form
+    ``<algorithm>:<value>``, or ``None`` if there is no checksum or its algorithm is not
+    supported, so the file cannot be checked
+    """
+    if not checksum or ":" not in checksum:
+        return None
+    algorithm, value = checksum.split(":", 1)
+    algorithm = algorithm.lower()
+    if algorithm != "adler32" and algorithm not in hashlib.algorithms_guaranteed:
+        return None
+    return file_checksum(path, algorithm).lstrip("0") == value.lower().lstrip("0")
+
+
+def copy_if_changed(src, dest):
+    """
+    Copy a local file unless `dest` is already a copy of it with the same size and modification
+    time
+    """
+    if (os.path.isfile(dest) and os.path.getsize(dest) == os.path.getsize(src) and
+            int(os.path.getmtime(dest)) == int(os.path.getmtime(src))):
+        return
+    if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    shutil.copy2(src, dest)
+
+
+def copy_missing(src_dir, dest_dir):
+    """
+    Copy the files under `src_dir` to `dest_dir` with `copy_if_changed`
+    """
+    for path in list_files(src_dir):
+        copy_if_changed(os.path.join(src_dir, path), os.path.join(dest_dir, path))
+
+
+def write_manifest(directory, job_id, files=None):
+    """
+    Write the manifest of a directory holding a job's outputs, replacing any existing one
+    atomically
+
+    :param directory: The directory
+    :param job_id:    ID of the job the outputs belong to
+    :param files:     Dictionary mapping paths to their size and SHA-256 checksum, or ``None`` to
+                      record the files currently in the directory
+    """
+    if files is None:
+        files = {}
+        for path in list_files(directory):
+            full_path = os.path.join(directory, path)
+            files[path] = {"size": os.path.getsize(full_path), "sha256": file_checksum(full_path)}
+
+    manifest_path = os.path.join(directory, MANIFEST_FILENAME)
+    with open(manifest_path + ".tmp", "w") as manifest_file:
+        json.dump({"job_id": job_id, "files": files}, manifest_file, indent=2, sort_keys=True)
+    os.rename(manifest_path + ".tmp", manifest_path)
+
+
+def read_manifest(directory):
+    """
+    Return the manifest of a directory, or ``None`` if it has none
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or "files" not in manifest:
+        return None
+    return manifest
+
+
+def is_complete(directory, job_id):
+    """
+    Return whether a directory contains a complete set of outputs of a job: it has a manifest for
+    the job and every file in it is present with the recorded size and SHA-256 checksum
+    """
+    manifest = read_manifest(directory)
+    if manifest is None or manifest.get("job_id") != job_id:
+        return False
+    files = manifest["files"]
+    for path, info in files.items():
+        full_path = os.path.join(directory, path)
+        # Sizes are compared first so that missing or truncated files are found without hashing
+        if not os.path.isfile(full_path) or os.path.getsize(full_path) != info["size"]:
+            return False
+    return all(file_checksum(os.path.join(directory, path)) == info["sha256"]
+               for path, info in files.items())
+
+
+def prepare_staging(dest, job_id):
+    """
+    Return the staging directory for saving a job's outputs to a destination, creating it if
+    needed. Files downloaded for the same job by earlier attempts are kept so that they do not
+    need to be downloaded again, and a destination with an incomplete manifest is moved back to
+    staging so missing files can be downloaded. A staging directory left by an attempt to save a
+    different job's outputs is emptied
+
+    :raises IOError: if the destination exists and is not empty, but was not created by
+                     `finalise` for the same job
+    """
+    staging = dest + STAGING_SUFFIX
+    if os.path.isdir(staging):
+        manifest = read_manifest(staging)
+        if manifest is None or manifest.get("job_id") != job_id:
+            shutil.rmtree(staging)
+
+    if os.path.isdir(dest):
+        manifest = read_manifest(dest)
+        if not os.listdir(dest):
+            os.rmdir(dest)
+        elif manifest is None:
+            raise IOError("Destination {} already exists and does not contain job outputs"
+                          .format(dest))
+        elif manifest.get("job_id") != job_id:
+            raise IOError("Destination {} already contains the outputs of job {}"
+                          .format(dest, manifest.get("job_id")))
+        elif not os.path.exists(staging):
+            os.rename(dest, staging)
+        else:
+            copy_missing(dest, staging)
+            shutil.rmtree(dest)
+
+    if not os.path.isdir(staging):
+        os.makedirs(staging)
+        # Record which job the staged files belong to until `finalise` lists them
+        write_manifest(staging, job_id, files={})
+    return staging
+
+
+def finalise(staging, dest, job_id):
+    """
+    Write the manifest of a job's outputs in a staging directory and move it to its destination
+    atomically
+    """
+    write_manifest(staging, job_id)
+    os.rename(staging, dest)
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+
+# Size of chunks to read when hashing input files
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultCache(object):
+    """
+    Local store of job outputs, keyed on a hash of everything that determines a job's outputs:
+    the executable, arguments, contents of input files and name of the output file. When the
+    store is full, the least recently used entries are evicted.
+
+    Each entry is a copy of the directory returned by `ArcInterface.save_job_outputs`, stored
+    under ``<directory>/<key>``. An index file records the ID of the job that produced each entry
+    and when it was last used. A second file records the keys of jobs that have been submitted but
+    whose outputs have not been cached yet, so that they are cached when saved by any process.
+
+    Both files are read again before each change, so several processes can share a cache.
+    """
+
+    INDEX_FILENAME = "index.json"
+    PENDING_FILENAME = "pending.json"
+
+    def __init__(self, directory, max_entries=100):
+        """
+        :param directory:   Directory to store cached outputs in. Created if it does not exist
+        :param max_entries: Maximum number of results to keep
+        """
+        self.directory = directory
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.index = self.load_index()
+
+    @staticmethod
+    def make_key(executable, args, input_files, output_file, extra=None):
+        """
+        Return a key identifying a job by its executable, arguments, input file names and
+        contents, output file name, and any extra JSON-serialisable data that affects the outputs
+
+        :raises IOError: if an input file cannot be read
+        """
+        digest = hashlib.sha256()
+        description = json.dumps([executable, list(args), output_file, extra], sort_keys=True)
+        digest.update(description.encode("utf-8"))
+
+        # Input files are identified by the name they are staged as and their contents, so the
+        # key does not depend on where the files are stored locally
+        for path in sorted(input_files, key=os.path.basename):
+            digest.update(os.path.basename(path).encode("utf-8"))
+            with open(path, "rb") as input_file:
+                for chunk in iter(lambda: input_file.read(HASH_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def load_index(self):
+        index_path = os.path.join(self.directory, self.INDEX_FILENAME)
+        self.index_mtime = os.path.getmtime(index_path) if os.path.isfile(index_path) else None
+        return self.load_file(self.INDEX_FILENAME)
+
+    def refresh_index(self):
+        """
+        Read the index again if another process has changed it. Callers must hold the lock
+        """
+        index_path = os.path.join(self.directory, self.INDEX_FILENAME)
+        mtime = os.path.getmtime(index_path) if os.path.isfile(index_path) else None
+        if mtime != self.index_mtime:
+            self.index = self.load_index()
+
+    def save_index(self):
+        """
+        Write the index, replacing the old one atomically. Callers must hold the lock
+        """
+        self.save_file(self.INDEX_FILENAME, self.index)
+        self.index_mtime = os.path.getmtime(os.path.join(self.directory, self.INDEX_FILENAME))
+
+    def load_file(self, filename):
+        path = os.path.join(self.directory, filename)
+        if not os.path.isfile(path):
+            return {}
+        with open(path) as json_file:
+            return json.load(json_file)
+
+    def save_file(self, filename, data):
+        path = os.path.join(self.directory, filename)
+        # Temp file is unique to the process so concurrent writers do not share it
+        temp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(temp_path, "w") as json_file:
+            json.dump(data, json_file)
+        os.rename(temp_path, path)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, mark_used=True):
+        """
+        Look up a cached result and, unless `mark_used` is ``False``, mark it as recently used
+
+        :return: A tuple of (job ID, path to the cached outputs directory), or ``None`` if there is
+                 no cached result for the key
+        """
+        with self.lock:
+            self.refresh_index()
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            if not os.path.isdir(self.entry_path(key)):
+                # Cached files have been removed from outside
+                del self.index[key]
+                self.save_index()
+                return None
+
+            if mark_used:
+                entry["last_used"] = time.time()
+                self.save_index()
+            return (entry["job_id"], self.entry_path(key))
+
+    def put(self, key, outputs_dir, job_id):
+        """
+        Store a copy of a job's outputs, evicting the least recently used results if the cache is
+        full
+
+        :param key:         Key from `make_key`
+        :param outputs_dir: Directory containing the job's downloaded outputs
+        :param job_id:      ID of the job that produced the outputs
+        """
+        with self.lock:
+            self.refresh_index()
+            # Copy to a temporary location first so a partial copy is never used
+            temp_path = self.entry_path(key) + ".tmp"
+            if os.path.exists(temp_path):
+                shutil.rmtree(temp_path)
+            shutil.copytree(outputs_dir, temp_path)
+            if os.path.exists(self.entry_path(key)):
+                shutil.rmtree(self.entry_path(key))
+            os.rename(temp_path, self.entry_path(key))
+
+            self.index[key] = {"job_id": job_id, "last_used": time.time()}
+            self.evict()
+            self.save_index()
+
+    def evict(self):
+        """
+        Remove least recently used entries until there are at most `max_entries`. Callers must hold
+        the lock
+        """
+        by_age = sorted(self.index, key=lambda k: self.index[k]["last_used"])
+        for key in by_age[:max(len(by_age) - self.max_entries, 0)]:
+            self.remove(key)
+
+    def remove(self, key):
+        """
+        Remove an entry. Callers must hold the lock
+        """
+        self.index.pop(key, None)
+        if os.path.isdir(self.entry_path(key)):
+            shutil.rmtree(self.entry_path(key))
+
+    def invalidate(self, key):
+        """
+        Remove the cached result for a key, if there is one
+        """
+        with self.lock:
+            self.refresh_index()
+            self.remove(key)
+            self.save_index()
+
+    def clear(self):
+        """
+        Remove all cached results
+        """
+        with self.lock:
+            self.refresh_index()
+            for key in list(self.index):
+                self.remove(key)
+            self.save_index()
+
+    def find_job(self, job_id):
+        """
+        Return the key of the cached result produced by a job, or ``None`` if there is none
+        """
+        with self.lock:
+            self.refresh_index()
+            for key, entry in self.index.items():
+                if entry["job_id"] == job_id:
+                    return key
+        return None
+
+    def add_pending(self, job_id, key):
+        """
+        Record that a job was submitted for a key with no cached result, so that its outputs can be
+        cached once they are saved
+        """
+        with self.lock:
+            pending = self.load_file(self.PENDING_FILENAME)
+            pending[job_id] = key
+            self.save_file(self.PENDING_FILENAME, pending)
+
+    def get_pending(self, job_id):
+        """
+        Return the key recorded for a job with `add_pending`, or ``None``
+        """
+        with self.lock:
+            return self.load_file(self.PENDING_FILENAME).get(job_id)
+
+    def pop_pending(self, job_id):
+        """
+        Remove and return the key recorded for a job with `add_pending`, or ``None``
+        """
+        with self.lock:
+            pending = self.load_file(self.PENDING_FILENAME)
+            key = pending.pop(job_id, None)
+            if key is not None:
+                self.save_file(self.PENDING_FILENAME, pending)
+            return key
+
+    def __len__(self):
+        with self.lock:
+            self.refresh_index()
+            return len(self.index)
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+
+import arc
+
+
+class RetryPolicy(object):
+    """
+    Retry operations that fail transiently, waiting for an exponentially increasing delay with
+    random jitter between attempts
+    """
+
+    #: Exceptions that are treated as transient failures
+    RETRY_EXCEPTIONS = (RuntimeError, IOError)
+
+    def __init__(self, attempts=3, base_delay=1.0, max_delay=30.0, logger=None):
+        """
+        :param attempts:   Maximum number of attempts (1 means no retries)
+        :param base_delay: Delay in seconds before the first retry, before jitter is applied
+        :param max_delay:  Maximum delay between attempts in seconds
+        :param logger:     Optional ``arc.Logger`` used to log retries
+        """
+        self.attempts = max(attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = logger
+
+    def delay(self, attempt):
+        """
+        Return the number of seconds to wait after the given (zero-based) failed attempt. Uses
+        "full jitter": a random delay between 0 and the exponential backoff value
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, description, func, *args, **kwargs):
+        """
+        Call a function, retrying if it raises one of `RETRY_EXCEPTIONS` or if its result is
+        rejected by `retry_if`. If all attempts fail, the last exception is raised or the last
+        result is returned
+
+        :param description: Description of the operation used in log messages
+        :param func:        The function to call
+        :param retry_if:    Optional keyword argument: a function that takes the result and
+                            returns ``True`` if the call should be retried
+        :return:            The result of the function
+        """
+        retry_if = kwargs.pop("retry_if", None)
+
+        for attempt in range(self.attempts):
+            last_attempt = attempt == self.attempts - 1
+            try:
+                result = func(*args, **kwargs)
+            except self.RETRY_EXCEPTIONS as ex:
+                if last_attempt:
+                    raise
+                reason = str(ex)
+            else:
+                if last_attempt or retry_if is None or not retry_if(result):
+                    return result
+                reason = "unsuccessful result"
+
+            delay = self.delay(attempt)
+            if self.logger:
+                self.logger.msg(arc.DEBUG, "{} failed ({}), retrying in {:.1f}s"
+                                           .format(description, reason, delay))
+            time.sleep(delay)
+
+
+class CircuitBreaker(object):
+    """
+    Track failures for a set of endpoints, and stop using an endpoint for a cool-down period once
+    it has failed a number of times in a row. After the cool-down a single attempt is allowed: if
+    it succeeds the endpoint is used as normal again, otherwise the cool-down restarts
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=300.0):
+        """
+        :param failure_threshold: Number of consecutive failures after which an endpoint is
+                                  skipped, or 0 to never skip endpoints
+        :param cooldown:          Number of seconds to skip an endpoint for
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.opened_at = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key):
+        """
+        Return whether the endpoint with the given key should be used. Once the cool-down has
+        passed, only the first caller is allowed to try the endpoint; others are refused for
+        another cool-down period unless that attempt is recorded as a success
+        """
+        with self.lock:
+            opened_at = self.opened_at.get(key)
+            if opened_at is None:
+                return True
+            if time.time() - opened_at < self.cooldown:
+                return False
+            self.opened_at[key] = time.time()
+            return True
+
+    def record_success(self, key):
+        with self.lock:
+            self.failures.pop(key, None)
+            self.opened_at.pop(key, None)
+
+    def record_failure(self, key):
+        with self.lock:
+            self.failures[key] = self.failures.get(key, 0) + 1
+            if 0 < self.failure_threshold <= self.failures[key]:
+                self.opened_at[key] = time.time()
@@ -0,0 +1,172 @@
+import threading
+from collections import namedtuple
+
+import arc
+
+from constants import ARC_STATUS_MAPPING, ARC_TERMINAL_STATES
+
+
+#: Event describing a change in a job's status. `old` is ``None`` the first time a job is seen
+StatusChange = namedtuple("StatusChange", ["job_id", "old", "new"])
+
+
+class JobWatcher(object):
+    """
+    Watch the status of jobs from a single background thread, and notify subscribers when a
+    job's status changes. All subscribers share one status query per interval, so watching the
+    same jobs from several components does not generate extra traffic to the ARC server.
+
+    Changes are detected by comparing each job's ARC state with the state seen on the previous
+    refresh, and are reported as values in `JobStatuses` when the mapped status changes. Once a
+    job has reached a terminal state and its change has been reported, it is no longer queried.
+    """
+
+    def __init__(self, arc_iface, interval=None, queue=None):
+        """
+        :param arc_iface: The `ArcInterface` to query job states with
+        :param interval:  Number of seconds between refreshes (default: the `STATUS_POLL_INTERVAL`
+                          config option)
+        :param queue:     Optional queue (e.g. ``Queue.Queue``) to put a `StatusChange` event on for
+                          every change to any job, in addition to calling subscribers
+        """
+        self.arc_iface = arc_iface
+        self.interval = interval if interval is not None else arc_iface.config.STATUS_POLL_INTERVAL
+        self.queue = queue
+
+        self.subscriptions = {}
+        self.next_token = 0
+        self.states = {}
+        # IDs of jobs whose terminal state has been reported, which are no longer watched
+        self.finished = set()
+        self.lock = threading.Lock()
+
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def subscribe(self, callback, job_ids=None):
+        """
+        Register a function to be called as ``callback(job_id, old, new)`` when the status of a job
+        changes. Callbacks are run on the watcher thread, so should return quickly
+
+        :param callback: The function to call
+        :param job_ids:  List of job IDs to receive changes for, or ``None`` for all jobs
+        :return:         A token that can be passed to `unsubscribe`
+        """
+        with self.lock:
+            token = self.next_token
+            self.next_token += 1
+            self.subscriptions[token] = (callback, None if job_ids is None else set(job_ids))
+            return token
+
+    def unsubscribe(self, token):
+        """
+        Remove a subscription made with `subscribe`
+        """
+        with self.lock:
+            self.subscriptions.pop(token, None)
+
+    def get_watched_job_ids(self):
+        """
+        Return the set of job IDs subscribers are interested in, or ``None`` if all jobs should be
+        queried
+        """
+        with self.lock:
+            if self.queue is not None:
+                return None
+            job_ids = set()
+            for _, subscribed_ids in self.subscriptions.values():
+                if subscribed_ids is None:
+                    return None
+                job_ids.update(subscribed_ids)
+            return job_ids
+
+    def refresh(self):
+        """
+        Query job states once and dispatch any changes. Called periodically by the background
+        thread, but can also be called directly
+        """
+        job_ids = self.get_watched_job_ids()
+        if job_ids is not None:
+            with self.lock:
+                # Forget jobs that are no longer subscribed to
+                self.finished &= job_ids
+                for job_id in set(self.states) - job_ids:
+                    del self.states[job_id]
+                job_ids -= self.finished
+            if not job_ids:
+                return
+
+        new_states = self.arc_iface.get_job_states(None if job_ids is None else list(job_ids))
+
+        changes = []
+        with self.lock:
+            if job_ids is None:
+                # Forget finished jobs that are no longer known to the server
+                self.finished &= set(new_states)
+
+            for job_id, state in new_states.items():
+                if job_id in self.finished:
+                    continue
+                old_state = self.states.get(job_id)
+                if state in ARC_TERMINAL_STATES:
+                    self.finished.add(job_id)
+                    self.states.pop(job_id, None)
+                else:
+                    self.states[job_id] = state
+                if state == old_state:
+                    continue
+
+                old = ARC_STATUS_MAPPING[old_state] if old_state is not None else None
+                new = ARC_STATUS_MAPPING[state]
+                if old != new:
+                    changes.append(StatusChange(job_id, old, new))
+
+            subscriptions = list(self.subscriptions.values())
+
+        for change in changes:
+            self.dispatch(change, subscriptions)
+
+    def dispatch(self, change, subscriptions):
+        """
+        Send a change to the event queue and to interested subscribers. Exceptions raised by
+        callbacks are logged so that one failing subscriber does not affect the others
+        """
+        if self.queue is not None:
+            self.queue.put(change)
+
+        for callback, job_ids in subscriptions:
+            if job_ids is not None and change.job_id not in job_ids:
+                continue
+            try:
+                callback(*change)
+            except Exception as ex:
+                self.arc_iface.logger.msg(arc.WARNING, "Job status callback failed: {}".format(ex))
+
+    def start(self):
+        """
+        Start the background thread. The first refresh happens immediately
+        """
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="JobWatcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the background thread and wait for it to finish
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as ex:
+                self.arc_iface.logger.msg(arc.WARNING, "Failed to refresh job states: {}"
+                                                       .format(ex))
+            self.stop_event.wait(self.interval)
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+import arc
+
+from constants import ARC_TERMINAL_STATES
+from arc_interface import SUBMIT_ERRORS
+from exceptions import WorkflowError, SubmissionLimitError
+
+
+class NodeStates(object):
+    """
+    Possible states of a node in a `Workflow`
+    """
+    PENDING = "pending"
+    SUBMITTED = "submitted"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    #: A node is skipped if any of its ancestors failed
+    SKIPPED = "skipped"
+
+    FINISHED = (COMPLETED, FAILED, SKIPPED)
+
+
+class Workflow(object):
+    """
+    Run a set of jobs with dependencies between them. A job is submitted as soon as all the jobs
+    it depends on have completed, optionally with their output files as its input files.
+
+    Progress is saved to a JSON state file after every change, so if the process running the
+    workflow exits, running it again with the same state file resumes without resubmitting jobs
+    that have already been submitted.
+    """
+
+    def __init__(self, arc_iface, state_file=None, max_concurrent=0, poll_interval=None,
+                 max_missing_polls=3):
+        """
+        :param arc_iface:         The `ArcInterface` to submit jobs with
+        :param state_file:        Path to the file to save progress to, or ``None`` to not save
+                                  progress
+        :param max_concurrent:    Maximum number of jobs to have submitted and not finished at
+                                  once, or 0 for no limit
+        :param poll_interval:     Number of seconds between status checks (default: the
+                                  `STATUS_POLL_INTERVAL` config option)
+        :param max_missing_polls: Number of status checks in a row a submitted job can be missing
+                                  from (e.g. because the ARC server has purged it) before it is
+                                  marked as failed
+        """
+        self.arc_iface = arc_iface
+        self.state_file = state_file
+        self.max_concurrent = max_concurrent
+        self.max_missing_polls = max(max_missing_polls, 1)
+        if poll_interval is None:
+            poll_interval = arc_iface.config.STATUS_POLL_INTERVAL
+        self.poll_interval = poll_interval
+
+        self.nodes = OrderedDict()
+        self.states = {}
+
+    def add_job(self, name, executable, args=[], input_files=[], depends_on=[],
+                use_parent_outputs=False, **resources):
+        """
+        Add a job to the workflow
+
+        :param name:               Unique name for the job within the workflow
+        :param executable:         The command to run (see `ArcInterface.submit_job`)
+        :param args:               List of arguments to pass to the executable
+        :param input_files:        List of paths to local files to copy to the session directory
+        :param depends_on:         List of names of jobs that must complete before this job is
+                                   submitted
+        :param use_parent_outputs: Whether to download the `OUTPUT_FILE` of each job in
+                                   `depends_on` and add the file(s) to this job's input files.
+                                   Output files from different parents must have different names
+        :param resources:          Resource requirements to pass to `ArcInterface.submit_job`
+                                   (``cpus``, ``memory``, ``wall_time``, ``queue`` and
+                                   ``environment``)
+
+        :raises WorkflowError: if a job with the same name has already been added
+        """
+        if name in self.nodes:
+            raise WorkflowError("Job '{}' is already in the workflow".format(name))
+
+        self.nodes[name] = {
+            "executable": executable,
+            "args": list(args),
+            "input_files": list(input_files),
+            "depends_on": list(depends_on),
+            "use_parent_outputs": use_parent_outputs,
+            "resources": resources
+        }
+
+    def validate(self):
+        """
+        Check that all dependencies exist and there are no cycles
+
+        :raises WorkflowError: if the workflow is invalid
+        """
+        for name, node in self.nodes.items():
+            for parent in node["depends_on"]:
+                if parent not in self.nodes:
+                    raise WorkflowError("Job '{}' depends on unknown job '{}'".format(name, parent))
+
+        # Depth first search for cycles
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise WorkflowError("Workflow contains a cycle involving job '{}'".format(name))
+            visiting.add(name)
+            for parent in self.nodes[name]["depends_on"]:
+                visit(parent)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.nodes:
+            visit(name)
+
+    def load_state(self):
+        """
+        Load progress from the state file, if it exists. Jobs in the state file that are not in
+        the workflow are ignored
+        """
+        self.states = dict((name, {"state": NodeStates.PENDING, "job_id": None,
+                                   "output_dir": None, "missing_polls": 0})
+                           for name in self.nodes)
+
+        if self.state_file and os.path.isfile(self.state_file):
+            with open(self.state_file) as state_file:
+                saved = json.load(state_file)
+            for name, node_state in saved.items():
+                if name in self.states:
+                    self.states[name].update(node_state)
+
+    def save_state(self):
+        """
+        Write progress to the state file. The file is replaced atomically so that it is never left
+        partially written
+        """
+        if not self.state_file:
+            return
+        temp_filename = self.state_file + ".tmp"
+        with open(temp_filename, "w") as state_file:
+            json.dump(self.states, state_file, indent=2, sort_keys=True)
+        os.rename(temp_filename, self.state_file)
+
+    def set_state(self, name, state, **kwargs):
+        self.states[name]["state"] = state
+        self.states[name].update(kwargs)
+        self.arc_iface.logger.msg(arc.INFO, "Workflow job '{}' is {}".format(name, state))
+        self.save_state()
+
+    def run(self, timeout=None):
+        """
+        Run the workflow until every job has completed, failed or been skipped
+
+        :param timeout:        Maximum number of seconds to run for, or ``None`` to run until the
+                               workflow finishes. Progress is saved to the state file, so the
+                               workflow can be resumed after a timeout
+        :raises WorkflowError: if the workflow is invalid, or if it does not finish within
+                               `timeout` seconds
+        :return:               Dictionary mapping job names to their final state (see
+                               `NodeStates`), job ID and output directory (if outputs were
+                               downloaded)
+        """
+        self.validate()
+        self.load_state()
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while True:
+            self.update_submitted()
+            self.skip_failed_descendants()
+            self.submit_ready()
+
+            if all(s["state"] in NodeStates.FINISHED for s in self.states.values()):
+                return self.states
+
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    unfinished = sum(1 for s in self.states.values()
+                                     if s["state"] not in NodeStates.FINISHED)
+                    raise WorkflowError("Workflow did not finish within {} seconds ({} job(s) "
+                                        "unfinished)".format(timeout, unfinished))
+                time.sleep(min(self.poll_interval, remaining))
+            else:
+                time.sleep(self.poll_interval)
+
+    def update_submitted(self):
+        """
+        Check the status of all submitted jobs with a single query, and record any that have
+        finished. Jobs missing from `max_missing_polls` queries in a row are marked as failed
+        """
+        submitted = dict((s["job_id"], name) for name, s in self.states.items()
+                         if s["state"] == NodeStates.SUBMITTED)
+        if not submitted:
+            return
+
+        # ARC states are used rather than statuses, since states such as Undefined that may only be
+        # reported briefly are mapped to the failed status
+        states = self.arc_iface.get_job_states(list(submitted))
+        for job_id, name in submitted.items():
+            state = states.get(job_id)
+            if state is None:
+                missing_polls = self.states[name].get("missing_polls", 0) + 1
+                if missing_polls >= self.max_missing_polls:
+                    self.arc_iface.logger.msg(arc.WARNING, "Workflow job '{}' ({}) could not be "
+                                                           "found".format(name, job_id))
+                    self.set_state(name, NodeStates.FAILED, missing_polls=missing_polls)
+                else:
+                    self.states[name]["missing_polls"] = missing_polls
+                    self.save_state()
+                continue
+
+            self.states[name]["missing_polls"] = 0
+            if state == "Finished":
+                self.set_state(name, NodeStates.COMPLETED)
+            elif state in ARC_TERMINAL_STATES:
+                self.set_state(name, NodeStates.FAILED)
+
+    def skip_failed_descendants(self):
+        """
+        Mark pending jobs as skipped if any job they depend on has failed or been skipped
+        """
+        changed = True
+        while changed:
+            changed = False
+            for name, node in self.nodes.items():
+                if self.states[name]["state"] != NodeStates.PENDING:
+                    continue
+                if any(self.states[p]["state"] in (NodeStates.FAILED, NodeStates.SKIPPED)
+                       for p in node["depends_on"]):
+                    self.set_state(name, NodeStates.SKIPPED)
+                    changed = True
+
+    def submit_ready(self):
+        """
+        Submit pending jobs whose dependencies have all completed, up to the concurrency limit.
+        Jobs that cannot be submitted are marked as failed
+        """
+        running = sum(1 for s in self.states.values() if s["state"] == NodeStates.SUBMITTED)
+
+        for name, node in self.nodes.items():
+            if self.max_concurrent > 0 and running >= self.max_concurrent:
+                return
+            if self.states[name]["state"] != NodeStates.PENDING:
+                continue
+            if not all(self.states[p]["state"] == NodeStates.COMPLETED
+                       for p in node["depends_on"]):
+                continue
+
+            input_files = list(node["input_files"])
+            if node["use_parent_outputs"]:
+                parent_files = self.get_parent_outputs(node["depends_on"])
+                if parent_files is None:
+                    self.set_state(name, NodeStates.FAILED)
+                    continue
+                input_files.extend(parent_files)
+
+            try:
+                job_id = self.arc_iface.submit_job(node["executable"], node["args"], input_files,
+                                                   **node["resources"])
+            except SubmissionLimitError:
+                # Admission limits are temporary, so try again after the next status check
+                return
+            except SUBMIT_ERRORS as ex:
+                # Failing the job lets its descendants be skipped, and stops a resumed workflow
+                # from failing to submit it again
+                self.arc_iface.logger.msg(arc.WARNING, "Could not submit workflow job '{}': {}"
+                                                       .format(name, ex))
+                self.set_state(name, NodeStates.FAILED, error=str(ex))
+                continue
+            self.set_state(name, NodeStates.SUBMITTED, job_id=job_id)
+            running += 1
+
+    def get_parent_outputs(self, parents):
+        """
+        Download the outputs of the given jobs (if not already downloaded) and return a list of
+        paths to the output files, or ``None`` if the outputs of any job could not be downloaded
+
+        :raises WorkflowError: if two parents have output files with the same name
+        """
+        output_name = self.arc_iface.config.OUTPUT_FILE
+        paths = {}
+        for parent in parents:
+            state = self.states[parent]
+            if not state["output_dir"] or not os.path.isdir(state["output_dir"]):
+                output_dir = self.arc_iface.save_job_outputs(state["job_id"])
+                if output_dir is None:
+                    return None
+                state["output_dir"] = output_dir
+                self.save_state()
+
+            output_path = os.path.join(state["output_dir"], output_name)
+            if os.path.isdir(output_path):
+                files = [os.path.join(dirpath, filename)
+                         for dirpath, _, filenames in os.walk(output_path)
+                         for filename in filenames]
+            elif os.path.isfile(output_path):
+                files = [output_path]
+            else:
+                files = []
+
+            for path in files:
+                filename = os.path.basename(path)
+                if filename in paths:
+                    raise WorkflowError("Output file '{}' is produced by more than one parent job"
+                                        .format(filename))
+                paths[filename] = path
+
+        return list(paths.values())
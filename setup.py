@@ -11,7 +11,12 @@ if __name__ == "__main__":
         version="0.1",
         install_requires=[
             "Jinja2",
-            "enum34"
+            "enum34",
+            "futures; python_version < '3'",
+            "logutils; python_version < '3'"
         ],
+        entry_points={
+            "console_scripts": ["jasmin-arc=jasmin_arc.cli:main"]
+        },
         license="BSD",
     )
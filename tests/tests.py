@@ -3,9 +3,36 @@ import os
 import subprocess
 import json
 import tempfile
+import shutil
+import threading
+import time
+import zlib
+import logging
+import xml.etree.ElementTree as ElementTree
+
+import arc
 
 from jasmin_arc.arc_interface import ArcInterface
-from jasmin_arc.exceptions import InvalidConfigError, ProxyGenerationError, JobNotFoundError
+from jasmin_arc.config import ConnectionConfig
+from jasmin_arc.broker import TargetBroker
+from jasmin_arc.federation import ServerPool
+from jasmin_arc.admission import AdmissionController
+from jasmin_arc.retry import RetryPolicy, CircuitBreaker
+from jasmin_arc.watcher import JobWatcher, StatusChange
+from jasmin_arc.constants import JobStatuses, LogLevels
+from jasmin_arc.workflow import Workflow, NodeStates
+from jasmin_arc.result_cache import ResultCache
+from jasmin_arc.job_store import JobStore
+from jasmin_arc.backend import Backend
+from jasmin_arc.arc_backend import ArcBackend
+from jasmin_arc.local_backend import LocalBackend, JSDL_NAMESPACES
+from jasmin_arc.agent import AgentServer, AgentBackend, StatusCache
+from jasmin_arc.outputs import (MANIFEST_FILENAME, STAGING_SUFFIX, is_complete,
+                                prepare_staging)
+from jasmin_arc import cli
+from jasmin_arc.exceptions import (InvalidConfigError, ProxyGenerationError, JobNotFoundError,
+                                   InputFileError, InvalidJobDescription, JobSubmissionError,
+                                   SubmissionLimitError, WorkflowError, AgentError)
 from base import ArcTestCase
 
 
@@ -14,6 +41,1395 @@ from base import ArcTestCase
 BASE_TEMP_DIR = tempfile.mkdtemp()
 
 
+class ConfigTests(unittest.TestCase):
+
+    def test_values_resolved(self):
+        """
+        Test that paths are expanded and values converted to the correct type once on creation
+        """
+        config = ConnectionConfig({"PROXY_FILE": "~/proxy~file", "OUTPUT_FILE": "out~put"},
+                                  environ={"JASMIN_ARC_PROXY_RENEWAL_THRESHOLD": "30"})
+        self.assertEqual(config.PROXY_FILE, os.path.expanduser("~/proxy~file"))
+        self.assertEqual(config.OUTPUT_FILE, "out~put")
+        self.assertEqual(config.PROXY_RENEWAL_THRESHOLD, 30)
+
+    def test_invalid_values(self):
+        """
+        Test that values of the wrong type are rejected
+        """
+        with self.assertRaises(InvalidConfigError):
+            ConnectionConfig({"PROXY_VALIDITY_PERIOD": "twelve hours"}, environ={})
+        with self.assertRaises(InvalidConfigError):
+            ConnectionConfig({}, environ={"JASMIN_ARC_PROXY_VALIDITY_PERIOD": "twelve hours"})
+
+    def test_profiles(self):
+        """
+        Test that profiles override the top-level options, and environment variables override
+        profiles
+        """
+        config_dict = {
+            "OUTPUT_FILE": "a",
+            "ARC_SERVER": "server-a",
+            "profiles": {"test": {"OUTPUT_FILE": "b", "ARC_SERVER": "server-b"}}
+        }
+        config = ConnectionConfig(config_dict, profile="test",
+                                  environ={"JASMIN_ARC_ARC_SERVER": "server-c"})
+        self.assertEqual(config.OUTPUT_FILE, "b")
+        self.assertEqual(config.ARC_SERVER, "server-c")
+
+        with self.assertRaises(InvalidConfigError):
+            ConnectionConfig(config_dict, profile="nonexistent", environ={})
+
+    def test_immutable(self):
+        """
+        Test that config cannot be modified in place, and that `replace` returns a modified copy
+        """
+        config = ConnectionConfig({}, environ={})
+        with self.assertRaises(AttributeError):
+            config.OUTPUT_FILE = "other"
+
+        new_config = config.replace(OUTPUT_FILE="other")
+        self.assertEqual(new_config.OUTPUT_FILE, "other")
+        self.assertEqual(config.OUTPUT_FILE, ConnectionConfig({}, environ={}).OUTPUT_FILE)
+        self.assertNotEqual(config, new_config)
+        self.assertRaises(InvalidConfigError, config.replace, NOT_AN_OPTION=1)
+
+        # Dict values cannot be modified through attributes or `as_dict`
+        config = ConnectionConfig({"JOB_ENVIRONMENT": {"A": "1"}}, environ={})
+        config.JOB_ENVIRONMENT["B"] = "2"
+        config.as_dict()["JOB_ENVIRONMENT"]["C"] = "3"
+        self.assertEqual(config.JOB_ENVIRONMENT, {"A": "1"})
+        self.assertEqual(config, ConnectionConfig({"JOB_ENVIRONMENT": {"A": "1"}}, environ={}))
+
+
+class FakeTarget(object):
+    """
+    Minimal stand-in for ``arc.ExecutionTarget`` with the attributes used by `TargetBroker`
+    """
+    class Info(object):
+        def __init__(self, **kwargs):
+            self.__dict__.update(kwargs)
+
+    def __init__(self, url, free_slots=-1, waiting_jobs=-1):
+        self.ComputingEndpoint = self.Info(URLString=url, InterfaceName="test")
+        self.ComputingShare = self.Info(FreeSlots=free_slots, WaitingJobs=waiting_jobs)
+
+
+class BrokerTests(unittest.TestCase):
+
+    def test_rank_by_load(self):
+        """
+        Test that targets with more free slots and fewer waiting jobs are preferred
+        """
+        busy = FakeTarget("busy", free_slots=1, waiting_jobs=50)
+        idle = FakeTarget("idle", free_slots=10, waiting_jobs=0)
+        unknown = FakeTarget("unknown")
+        broker = TargetBroker("load")
+        self.assertEqual(broker.rank([unknown, busy, idle]), [idle, busy, unknown])
+
+        broker.strategy = "ordered"
+        self.assertEqual(broker.rank([unknown, busy, idle]), [unknown, busy, idle])
+
+    def test_rank_by_history(self):
+        """
+        Test that targets that have failed or been slow are moved down the ranking, and that old
+        measurements decay
+        """
+        slow = FakeTarget("slow")
+        flaky = FakeTarget("flaky")
+        fast = FakeTarget("fast")
+        broker = TargetBroker("latency", decay=0.5)
+        broker.record(slow, 20, True)
+        broker.record(flaky, 1, False)
+        broker.record(fast, 1, True)
+        self.assertEqual(broker.rank([flaky, slow, fast]), [fast, slow, flaky])
+
+        broker.record(flaky, 1, True)
+        self.assertEqual(broker.get_stats(flaky).success_rate, 0.5)
+
+
+class ServerPoolTests(unittest.TestCase):
+
+    def test_ranking(self):
+        """
+        Test that servers with recent failures are ranked last, and otherwise servers with the
+        most free capacity are preferred
+        """
+        pool = ServerPool(["ce1.ac.uk/arex", "ce2.ac.uk/arex", "ce3.ac.uk/arex"])
+        ce1, ce2, ce3 = pool.ranked()
+        ce1.record_failure()
+        ce3.set_targets([FakeTarget("t", free_slots=5, waiting_jobs=0)])
+        self.assertEqual(pool.ranked(), [ce3, ce2, ce1])
+
+        ce1.record_success()
+        self.assertEqual(pool.ranked(), [ce3, ce1, ce2])
+
+        # Stale targets are ignored
+        ce3.targets_time -= pool.target_cache_ttl + 1
+        self.assertEqual(pool.ranked(), [ce1, ce2, ce3])
+
+    def test_spread_and_cooldown(self):
+        """
+        Test that submissions are spread across servers by the number of jobs in flight, and that
+        a failed server is ranked normally again once its cool-down has passed
+        """
+        pool = ServerPool(["ce1.ac.uk/arex", "ce2.ac.uk/arex"], failure_cooldown=60)
+        ce1, ce2 = pool.ranked()
+        ce1.set_targets([FakeTarget("t", free_slots=5, waiting_jobs=0)])
+        pool.add_job("job-a", ce1)
+        self.assertEqual(pool.ranked(), [ce2, ce1])
+        pool.job_finished("job-a")
+        self.assertEqual(pool.ranked(), [ce1, ce2])
+
+        ce1.record_failure()
+        self.assertEqual(pool.ranked(), [ce2, ce1])
+        ce1.last_failure_time -= 61
+        self.assertEqual(pool.ranked(), [ce1, ce2])
+
+        # The cool-down doubles for each consecutive failure
+        ce1.record_failure()
+        ce1.last_failure_time -= 61
+        self.assertEqual(pool.ranked(), [ce2, ce1])
+
+    def test_job_owners(self):
+        """
+        Test that only the server owning a job is queried for it
+        """
+        pool = ServerPool(["ce1.ac.uk:443/arex", "ce2.ac.uk:443/arex"])
+        ce1, ce2 = pool.ranked()
+        pool.add_job("job-a", ce2)
+        self.assertEqual(pool.servers_for_job("job-a"), [ce2])
+        self.assertEqual(pool.servers_for_job("https://ce1.ac.uk:443/arex/abc"), [ce1])
+        self.assertEqual(pool.servers_for_job("unknown"), [ce1, ce2])
+
+
+class AdmissionTests(unittest.TestCase):
+
+    def test_reject_when_full(self):
+        """
+        Test that submissions are rejected when the maximum number of jobs are in flight, and
+        allowed again once a job finishes
+        """
+        admission = AdmissionController(max_in_flight=1, mode="reject")
+        admission.acquire()
+        admission.add_job("job-1")
+        self.assertRaises(SubmissionLimitError, admission.acquire)
+
+        admission.job_finished("job-1")
+        admission.acquire()
+        admission.cancel_reservation()
+        self.assertEqual(admission.stats()["in_flight"], 0)
+
+    def test_block_until_capacity(self):
+        """
+        Test that in block mode a submission waits until a job finishes
+        """
+        admission = AdmissionController(max_in_flight=1, mode="block", timeout=5)
+        admission.acquire()
+        admission.add_job("job-1")
+
+        timer = threading.Timer(0.2, admission.job_finished, ["job-1"])
+        timer.start()
+        start_time = time.time()
+        admission.acquire()
+        self.assertTrue(time.time() - start_time >= 0.1)
+        self.assertTrue(admission.stats()["max_wait_time"] >= 0.1)
+
+        timer.join()
+
+        # Should time out waiting for the rate limit
+        limited = AdmissionController(rate=0.01, mode="block", timeout=0.1)
+        limited.acquire()
+        self.assertRaises(SubmissionLimitError, limited.acquire)
+
+    def test_rate_limit(self):
+        """
+        Test that the submission rate is limited once the burst has been used
+        """
+        admission = AdmissionController(rate=0.01, burst=2, mode="reject")
+        admission.acquire()
+        admission.acquire()
+        self.assertRaises(SubmissionLimitError, admission.acquire)
+
+        # Reconfiguring should not refill the burst
+        admission.configure(0.01, 3, 0, "reject", 0)
+        self.assertRaises(SubmissionLimitError, admission.acquire)
+
+    def test_reconcile(self):
+        """
+        Test that jobs whose status is never checked are released by reconciling with the
+        backend when the in-flight limit is reached
+        """
+        finished = []
+        admission = AdmissionController(max_in_flight=1, mode="reject",
+                                        reconcile=lambda job_ids: list(finished))
+        admission.acquire()
+        admission.add_job("job-1")
+        self.assertRaises(SubmissionLimitError, admission.acquire)
+
+        # Reconciliation is rate limited
+        finished.append("job-1")
+        self.assertRaises(SubmissionLimitError, admission.acquire)
+        admission.last_reconcile_time -= AdmissionController.RECONCILE_INTERVAL
+        admission.acquire()
+
+
+class RetryTests(unittest.TestCase):
+
+    def test_retry(self):
+        """
+        Test that transient failures are retried until the attempts are used up
+        """
+        results = [RuntimeError("connection reset"), False, True]
+
+        def flaky():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        policy = RetryPolicy(attempts=3, base_delay=0.01)
+        self.assertTrue(policy.call("test", flaky, retry_if=lambda result: not result))
+        self.assertEqual(results, [])
+
+        results = [RuntimeError("connection reset")] * 2
+        self.assertRaises(RuntimeError, RetryPolicy(attempts=2, base_delay=0.01).call, "test",
+                          flaky)
+
+    def test_submission_retries(self):
+        """
+        Test that submissions rejected by a target are not retried, but errors are
+        """
+        class SubmitTarget(FakeTarget):
+            def __init__(self, url, results):
+                super(SubmitTarget, self).__init__(url)
+                self.results = results
+                self.attempts = 0
+
+            def Submit(self, user_config, job_description, job):
+                self.attempts += 1
+                result = self.results.pop(0)
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+        a = ArcInterface(log=None)
+        backend = ArcBackend(a.config, a.logger, a.env)
+        backend.retry.base_delay = 0.01
+        rejecting = SubmitTarget("rejecting", [False, True])
+        flaky = SubmitTarget("flaky", [RuntimeError("connection reset"), True])
+        self.assertEqual(backend.submit_to_targets([rejecting, flaky], [None], [None], None),
+                         [True])
+        self.assertEqual((rejecting.attempts, flaky.attempts), (1, 2))
+
+        # Jobs a target rejects move on to the next target, but the rest of the batch is still
+        # submitted to it and the rejection does not count towards its circuit breaker
+        backend.circuit_breaker.failure_threshold = 1
+        partial = SubmitTarget("partial", [True, False, True])
+        accepting = SubmitTarget("accepting", [True])
+        self.assertEqual(backend.submit_to_targets([partial, accepting], [None] * 3, [None] * 3,
+                                                   None), [True, True, True])
+        self.assertEqual((partial.attempts, accepting.attempts), (3, 1))
+        self.assertTrue(backend.circuit_breaker.allow(TargetBroker.target_key(partial)))
+
+    def test_unreachable_server(self):
+        """
+        Test that target discovery is retried when the retriever reports that the server could not
+        be queried, rather than treating the server as having no targets
+        """
+        class Status(object):
+            SUCCESSFUL = "SUCCESSFUL"
+
+            def __init__(self, status):
+                self.status = status
+
+            def getStatus(self):
+                return self.status
+
+            def str(self):
+                return self.status
+
+        class Endpoint(object):
+            COMPUTINGINFO = "computinginfo"
+
+            def __init__(self, url, capability):
+                self.URLString = url
+
+        statuses = ["FAILED", "SUCCESSFUL"]
+
+        class Retriever(object):
+            def __init__(self, user_config, endpoints):
+                self.status = Status(statuses.pop(0))
+
+            def wait(self):
+                pass
+
+            def GetStatusOfEndpoint(self, endpoint):
+                return self.status
+
+            def GetExecutionTargets(self):
+                if self.status.getStatus() == Status.SUCCESSFUL:
+                    return [FakeTarget("target")]
+                return []
+
+        patch_arc(self, Endpoint=Endpoint, ComputingServiceRetriever=Retriever,
+                  EndpointQueryingStatus=Status)
+        a = ArcInterface(log=None)
+        backend = ArcBackend(a.config, a.logger, a.env)
+        backend.retry.base_delay = 0.01
+        server = ServerPool(["ce1.ac.uk/arex"]).ranked()[0]
+        targets = backend.get_targets(server, None)
+        self.assertEqual([t.ComputingEndpoint.URLString for t in targets], ["target"])
+        self.assertEqual(statuses, [])
+
+        statuses.extend(["FAILED"] * backend.retry.attempts)
+        server.clear_targets()
+        self.assertRaises(RuntimeError, backend.get_targets, server, None)
+
+    def test_batch_submission_server_error(self):
+        """
+        Test that jobs submitted to one server are kept when another server cannot be reached
+        """
+        class Job(object):
+            JobID = None
+
+        class NamingTarget(FakeTarget):
+            def __init__(self, url, results):
+                super(NamingTarget, self).__init__(url)
+                self.results = results
+
+            def Submit(self, user_config, job_description, job):
+                job.JobID = "https://ce2.ac.uk/arex/{}".format(job_description)
+                return self.results.pop(0)
+
+        def get_targets(server, user_config):
+            if server.url == "ce1.ac.uk/arex":
+                raise RuntimeError("connection refused")
+            return [NamingTarget("ce2", [True, False])]
+
+        patch_arc(self, Job=Job)
+        a = ArcInterface(log=None)
+        backend = ArcBackend(a.config, a.logger, a.env)
+        backend.get_user_config = lambda: None
+        backend.get_targets = get_targets
+        backend.servers = ServerPool(["ce1.ac.uk/arex", "ce2.ac.uk/arex"])
+
+        submitted, rejected = backend.submit_job_descriptions(["a", "b"])
+        self.assertEqual(submitted.JobID, "https://ce2.ac.uk/arex/a")
+        self.assertEqual([server.url for server in backend.servers.servers_for_job(
+            submitted.JobID)], ["ce2.ac.uk/arex"])
+        self.assertIsInstance(rejected, JobSubmissionError)
+
+    def test_circuit_breaker(self):
+        """
+        Test that an endpoint is skipped after repeated failures until the cool-down has passed
+        """
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=0.2)
+        breaker.record_failure("target")
+        self.assertTrue(breaker.allow("target"))
+        breaker.record_failure("target")
+        self.assertFalse(breaker.allow("target"))
+        self.assertTrue(breaker.allow("other target"))
+
+        time.sleep(0.25)
+        self.assertTrue(breaker.allow("target"))
+        # Only a single trial is allowed after the cool-down
+        self.assertFalse(breaker.allow("target"))
+        breaker.record_success("target")
+        self.assertTrue(breaker.allow("target"))
+        breaker.record_failure("target")
+        self.assertTrue(breaker.allow("target"))
+
+
+def patch_arc(test, **fakes):
+    """
+    Replace attributes of the ``arc`` module with fakes for the rest of a test
+    """
+    missing = object()
+    for name, fake in fakes.items():
+        original = getattr(arc, name, missing)
+        if original is missing:
+            test.addCleanup(delattr, arc, name)
+        else:
+            test.addCleanup(setattr, arc, name, original)
+        setattr(arc, name, fake)
+
+
+class FakeDataStatus(object):
+    """
+    Stand-in for ``arc.DataStatus``, which is true if the operation succeeded
+    """
+    def __init__(self, success):
+        self.success = success
+
+    def __bool__(self):
+        return self.success
+    __nonzero__ = __bool__
+
+
+class FakeFileInfo(object):
+    """
+    Stand-in for ``arc.FileInfo``
+    """
+    file_type_file = 1
+    file_type_dir = 2
+
+    def __init__(self, name, file_type, size=0, checksum=""):
+        self.name = name
+        self.file_type = file_type
+        self.size = size
+        self.checksum = checksum
+
+    def GetName(self):
+        return self.name
+
+    def GetType(self):
+        return self.file_type
+
+    def GetSize(self):
+        return self.size
+
+    def GetCheckSum(self):
+        return self.checksum
+
+
+class FakeURL(object):
+    """
+    Stand-in for ``arc.URL``
+    """
+    def __init__(self, url=""):
+        self.url = url
+
+    def str(self):
+        return self.url
+
+
+class FakeSession(object):
+    """
+    A job's session directory on a fake ARC server, with stand-ins for the ARC data classes that
+    read from it. Files are given as a dictionary mapping paths to contents
+    """
+    URL = "gsiftp://ce.example.com/jobs/abc"
+
+    def __init__(self, files):
+        self.files = files
+        self.listable = True
+        self.transfers = []
+
+    def datapoint_from_url(self, url, user_config):
+        session = self
+
+        class DataPoint(object):
+            def List(self, verb):
+                prefix = url[len(session.URL) + 1:]
+                entries = {}
+                for path, contents in session.files.items():
+                    if prefix and not path.startswith(prefix + "/"):
+                        continue
+                    name, _, rest = path[len(prefix) + 1 if prefix else 0:].partition("/")
+                    if rest:
+                        entries[name] = FakeFileInfo(name, FakeFileInfo.file_type_dir)
+                    else:
+                        checksum = "adler32:{:08x}".format(zlib.adler32(contents) & 0xffffffff)
+                        entries[name] = FakeFileInfo(name, FakeFileInfo.file_type_file,
+                                                     len(contents), checksum)
+                return (FakeDataStatus(session.listable), list(entries.values()))
+
+        datapoint = DataPoint()
+        datapoint.url = url
+        return datapoint
+
+    def DataMover(self):
+        session = self
+
+        class DataMover(object):
+            def retry(self, retry):
+                pass
+
+            def Transfer(self, source, destination, cache, url_map):
+                path = source.url[len(session.URL) + 1:]
+                session.transfers.append(path)
+                with open(destination.url[len("file://"):], "wb") as f:
+                    f.write(session.files[path])
+                return FakeDataStatus(True)
+
+        return DataMover()
+
+    def patch(self, test):
+        """
+        Replace the ARC classes used to retrieve outputs with fakes for the rest of a test
+        """
+        class DataPoint(object):
+            INFO_TYPE_ALL = 0
+
+        class Job(object):
+            SESSIONDIR = 0
+
+        fakes = {
+            "URL": FakeURL, "Job": Job, "DataPoint": DataPoint, "DataStatus": FakeDataStatus,
+            "FileInfo": FakeFileInfo, "FileCache": object, "URLMap": object,
+            "datapoint_from_url": self.datapoint_from_url, "DataMover": self.DataMover
+        }
+        patch_arc(test, **fakes)
+
+
+class FakeJob(object):
+    """
+    Stand-in for ``arc.Job`` for a finished job in a `FakeSession`
+    """
+    JobID = FakeSession.URL
+
+    class State(object):
+        @staticmethod
+        def GetGeneralState():
+            return "Finished"
+
+    def __init__(self):
+        self.full_retrievals = 0
+
+    def GetURLToResource(self, resource, url):
+        url.url = FakeSession.URL + "/"
+        return True
+
+    def Retrieve(self, user_config, url, force):
+        self.full_retrievals += 1
+        return True
+
+
+class ArcRetrievalTests(unittest.TestCase):
+
+    def test_resumable_retrieval(self):
+        """
+        Test that outputs are downloaded file by file, that files already downloaded are only
+        downloaded again if their checksum does not match, and that the whole job is retrieved if
+        its session directory cannot be listed
+        """
+        session = FakeSession({"stdout.txt": b"hello\n", "outputs/result.txt": b"42\n"})
+        session.patch(self)
+        a = ArcInterface(log=None)
+        backend = ArcBackend(a.config, a.logger, a.env)
+        backend.retry.base_delay = 0.01
+        backend.get_user_config = lambda: None
+        job = FakeJob()
+        directory = tempfile.mkdtemp(dir=BASE_TEMP_DIR)
+
+        self.assertEqual(backend.retrieve_job(job, directory), (True, "Finished"))
+        self.assertEqual(sorted(session.transfers), ["outputs/result.txt", "stdout.txt"])
+        with open(os.path.join(directory, "outputs", "result.txt")) as f:
+            self.assertEqual(f.read(), "42\n")
+
+        # A file with the right size but the wrong contents is downloaded again
+        with open(os.path.join(directory, "stdout.txt"), "w") as f:
+            f.write("HELLO\n")
+        session.transfers = []
+        self.assertEqual(backend.retrieve_job(job, directory), (True, "Finished"))
+        self.assertEqual(session.transfers, ["stdout.txt"])
+        with open(os.path.join(directory, "stdout.txt")) as f:
+            self.assertEqual(f.read(), "hello\n")
+
+        session.listable = False
+        self.assertEqual(backend.retrieve_job(job, directory), (True, "Finished"))
+        self.assertEqual(job.full_retrievals, 1)
+
+
+class FakeArcInterface(object):
+    """
+    Stand-in for `ArcInterface` that returns job states from a dictionary
+    """
+    def __init__(self, states):
+        self.states = states
+        self.queries = []
+
+    def get_job_states(self, job_ids=None):
+        self.queries.append(job_ids)
+        return dict((job_id, state) for job_id, state in self.states.items()
+                    if job_ids is None or job_id in job_ids)
+
+
+class WatcherTests(unittest.TestCase):
+
+    def test_status_changes(self):
+        """
+        Test that subscribers are notified of status changes for the jobs they subscribed to, and
+        that a single query is made per refresh
+        """
+        arc_iface = FakeArcInterface({"job-1": "Queuing", "job-2": "Queuing"})
+        watcher = JobWatcher(arc_iface, interval=60)
+        changes = []
+        watcher.subscribe(lambda *args: changes.append(args), ["job-1"])
+        watcher.subscribe(lambda *args: changes.append(args), ["job-1"])
+
+        watcher.refresh()
+        arc_iface.states.update({"job-1": "Running", "job-2": "Running"})
+        watcher.refresh()
+        # Finishing maps to IN_PROGRESS like Running, so no change should be reported
+        arc_iface.states["job-1"] = "Finishing"
+        watcher.refresh()
+        arc_iface.states["job-1"] = "Finished"
+        watcher.refresh()
+
+        # Finished jobs are no longer queried
+        watcher.refresh()
+
+        self.assertEqual(len(arc_iface.queries), 4)
+        self.assertEqual(watcher.states, {})
+        self.assertEqual(changes, [
+            ("job-1", None, JobStatuses.NOT_STARTED),
+            ("job-1", None, JobStatuses.NOT_STARTED),
+            ("job-1", JobStatuses.NOT_STARTED, JobStatuses.IN_PROGRESS),
+            ("job-1", JobStatuses.NOT_STARTED, JobStatuses.IN_PROGRESS),
+            ("job-1", JobStatuses.IN_PROGRESS, JobStatuses.COMPLETED),
+            ("job-1", JobStatuses.IN_PROGRESS, JobStatuses.COMPLETED)
+        ])
+
+    def test_event_queue(self):
+        """
+        Test that changes to all jobs are put on the event queue
+        """
+        try:
+            from queue import Queue
+        except ImportError:
+            from Queue import Queue
+
+        events = Queue()
+        arc_iface = FakeArcInterface({"job-1": "Preparing"})
+        watcher = JobWatcher(arc_iface, interval=0.05, queue=events)
+        watcher.start()
+        try:
+            self.assertEqual(events.get(timeout=5),
+                             StatusChange("job-1", None, JobStatuses.NOT_SUBMITTED))
+            arc_iface.states["job-1"] = "Failed"
+            self.assertEqual(events.get(timeout=5),
+                             StatusChange("job-1", JobStatuses.NOT_SUBMITTED, JobStatuses.FAILED))
+        finally:
+            watcher.stop()
+        self.assertEqual(arc_iface.queries[0], None)
+
+
+class FakeSubmitter(object):
+    """
+    Stand-in for `ArcInterface` where every submitted job completes (or fails, if the executable
+    is ``/bin/false``) by the next status query. Jobs running ``/bin/sleep`` never finish, jobs
+    running ``/bin/missing`` are never found, jobs running ``/bin/undefined`` are in the
+    ``Undefined`` state for one query before completing, and ``/bin/unsubmittable`` cannot be
+    submitted
+    """
+    class Logger(object):
+        def msg(self, level, message):
+            pass
+
+    def __init__(self):
+        self.config = ConnectionConfig({}, environ={})
+        self.logger = self.Logger()
+        self.submitted = []
+
+        self.queried = set()
+
+    def submit_job(self, executable, args=[], input_files=[], **resources):
+        if executable == "/bin/unsubmittable":
+            raise InputFileError("{} is not a file".format(executable))
+        self.submitted.append((executable, args))
+        return "{}-{}".format(executable, len(self.submitted))
+
+    def get_job_states(self, job_ids):
+        states = {}
+        for job_id in job_ids:
+            if job_id.startswith("/bin/false"):
+                states[job_id] = "Failed"
+            elif job_id.startswith("/bin/sleep"):
+                states[job_id] = "Running"
+            elif job_id.startswith("/bin/undefined") and job_id not in self.queried:
+                states[job_id] = "Undefined"
+            elif not job_id.startswith("/bin/missing"):
+                states[job_id] = "Finished"
+            self.queried.add(job_id)
+        return states
+
+
+class WorkflowTests(unittest.TestCase):
+
+    def test_dependencies(self):
+        """
+        Test that jobs are submitted only after the jobs they depend on complete, and that jobs
+        depending on failed jobs are skipped
+        """
+        arc_iface = FakeSubmitter()
+        workflow = Workflow(arc_iface, max_concurrent=1, poll_interval=0)
+        workflow.add_job("reduce", "/bin/echo", ["reduce"], depends_on=["map-1", "map-2"])
+        workflow.add_job("map-1", "/bin/echo", ["map-1"], depends_on=["prepare"])
+        workflow.add_job("map-2", "/bin/echo", ["map-2"], depends_on=["prepare"])
+        workflow.add_job("prepare", "/bin/echo", ["prepare"])
+        workflow.add_job("broken", "/bin/false")
+        workflow.add_job("after-broken", "/bin/echo", depends_on=["broken"])
+
+        states = workflow.run()
+        submitted_args = [args for _, args in arc_iface.submitted if args]
+        self.assertEqual(submitted_args, [["prepare"], ["map-1"], ["map-2"], ["reduce"]])
+        self.assertEqual(states["reduce"]["state"], NodeStates.COMPLETED)
+        self.assertEqual(states["broken"]["state"], NodeStates.FAILED)
+        self.assertEqual(states["after-broken"]["state"], NodeStates.SKIPPED)
+
+    def test_resume(self):
+        """
+        Test that running a workflow again with the same state file does not resubmit jobs
+        """
+        state_file = os.path.join(tempfile.mkdtemp(dir=BASE_TEMP_DIR), "state.json")
+        for _ in range(2):
+            arc_iface = FakeSubmitter()
+            workflow = Workflow(arc_iface, state_file=state_file, poll_interval=0)
+            workflow.add_job("first", "/bin/echo")
+            workflow.add_job("second", "/bin/echo", depends_on=["first"])
+            states = workflow.run()
+        self.assertEqual(arc_iface.submitted, [])
+        self.assertEqual(states["second"]["state"], NodeStates.COMPLETED)
+
+    def test_missing_jobs_and_timeout(self):
+        """
+        Test that jobs that cannot be found are marked as failed, and that a workflow that does
+        not finish in time raises an error
+        """
+        workflow = Workflow(FakeSubmitter(), poll_interval=0, max_missing_polls=2)
+        workflow.add_job("missing", "/bin/missing")
+        workflow.add_job("after-missing", "/bin/echo", depends_on=["missing"])
+        states = workflow.run(timeout=5)
+        self.assertEqual(states["missing"]["state"], NodeStates.FAILED)
+        self.assertEqual(states["missing"]["missing_polls"], 2)
+        self.assertEqual(states["after-missing"]["state"], NodeStates.SKIPPED)
+
+        # Jobs that cannot be submitted fail without stopping the workflow, and jobs in the
+        # Undefined state are not treated as finished
+        workflow = Workflow(FakeSubmitter(), poll_interval=0)
+        workflow.add_job("unsubmittable", "/bin/unsubmittable")
+        workflow.add_job("after-unsubmittable", "/bin/echo", depends_on=["unsubmittable"])
+        workflow.add_job("undefined", "/bin/undefined")
+        workflow.add_job("after-undefined", "/bin/echo", depends_on=["undefined"])
+        states = workflow.run(timeout=5)
+        self.assertEqual(states["unsubmittable"]["state"], NodeStates.FAILED)
+        self.assertEqual(states["after-unsubmittable"]["state"], NodeStates.SKIPPED)
+        self.assertEqual(states["after-undefined"]["state"], NodeStates.COMPLETED)
+
+        workflow = Workflow(FakeSubmitter(), poll_interval=0.01)
+        workflow.add_job("sleep", "/bin/sleep")
+        self.assertRaises(WorkflowError, workflow.run, timeout=0.1)
+        self.assertEqual(workflow.states["sleep"]["state"], NodeStates.SUBMITTED)
+
+    def test_invalid_workflow(self):
+        """
+        Test that cycles and unknown dependencies are rejected
+        """
+        workflow = Workflow(FakeSubmitter())
+        workflow.add_job("a", "/bin/echo", depends_on=["b"])
+        workflow.add_job("b", "/bin/echo", depends_on=["a"])
+        self.assertRaises(WorkflowError, workflow.validate)
+
+        workflow = Workflow(FakeSubmitter())
+        workflow.add_job("a", "/bin/echo", depends_on=["nonexistent"])
+        self.assertRaises(WorkflowError, workflow.validate)
+
+
+class ResultCacheTests(unittest.TestCase):
+
+    def make_outputs(self, contents):
+        outputs_dir = tempfile.mkdtemp(dir=BASE_TEMP_DIR)
+        with open(os.path.join(outputs_dir, "stdout.txt"), "w") as f:
+            f.write(contents)
+        return outputs_dir
+
+    def test_key(self):
+        """
+        Test that the key depends on input file contents and names but not their location
+        """
+        dir1 = tempfile.mkdtemp(dir=BASE_TEMP_DIR)
+        dir2 = tempfile.mkdtemp(dir=BASE_TEMP_DIR)
+        paths = []
+        for directory, contents in ((dir1, "a"), (dir2, "a"), (dir2, "b")):
+            path = os.path.join(directory, "input-{}.txt".format(len(paths) // 2))
+            with open(path, "w") as f:
+                f.write(contents)
+            paths.append(path)
+
+        key = ResultCache.make_key("/bin/cat", ["input-0.txt"], [paths[0]], "output")
+        self.assertEqual(key, ResultCache.make_key("/bin/cat", ["input-0.txt"], [paths[1]],
+                                                   "output"))
+        self.assertNotEqual(key, ResultCache.make_key("/bin/cat", ["input-0.txt"], [paths[2]],
+                                                      "output"))
+        self.assertNotEqual(key, ResultCache.make_key("/bin/cat", ["input-0.txt"], [paths[0]],
+                                                      "other"))
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used result is evicted when the cache is full, and that
+        results can be invalidated
+        """
+        cache = ResultCache(tempfile.mkdtemp(dir=BASE_TEMP_DIR), max_entries=2)
+        cache.put("a", self.make_outputs("a"), "job-a")
+        time.sleep(0.01)
+        cache.put("b", self.make_outputs("b"), "job-b")
+        time.sleep(0.01)
+        job_id, path = cache.get("a")
+        self.assertEqual(job_id, "job-a")
+        with open(os.path.join(path, "stdout.txt")) as f:
+            self.assertEqual(f.read(), "a")
+
+        time.sleep(0.01)
+        cache.put("c", self.make_outputs("c"), "job-c")
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a"))
+        # Index should be persisted
+        self.assertEqual(len(ResultCache(cache.directory)), 1)
+
+
+class JobStoreTests(unittest.TestCase):
+
+    def test_lineage(self):
+        """
+        Test that descriptions are stored and the lineage of resubmitted jobs is recorded and
+        persisted
+        """
+        store = JobStore(tempfile.mkdtemp(dir=BASE_TEMP_DIR))
+        store.save("job-1", "<JobDefinition/>")
+        self.assertEqual(store.load("job-1"), "<JobDefinition/>")
+        self.assertIsNone(store.load("job-2"))
+
+        store.add_retry("job-1", "job-2")
+        store.add_retry("job-2", "job-3")
+        store = JobStore(store.directory)
+        self.assertEqual(store.get_lineage("job-2"), ["job-1", "job-2", "job-3"])
+        self.assertEqual(store.latest("job-1"), "job-3")
+        self.assertEqual(store.resubmissions("job-3"), 2)
+        self.assertEqual(store.resubmissions("job-1"), 0)
+
+
+class LocalBackendTests(unittest.TestCase):
+    """
+    Tests that run jobs with the local backend, so do not need an ARC server
+    """
+    TIMEOUT = 30
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=BASE_TEMP_DIR) as config_file:
+            json.dump({
+                "BACKEND": "local",
+                "LOCAL_WORK_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR),
+                "JOB_STORE_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR),
+                "OUTPUT_FILE": "outfile.txt"
+            }, config_file)
+        self.arc_iface = ArcInterface(config_file.name, log=None)
+
+    def wait_for_state(self, job_id, states):
+        """
+        Wait until a job is in one of the given ARC states, and return its state
+        """
+        deadline = time.time() + self.TIMEOUT
+        while time.time() < deadline:
+            state = self.arc_iface.get_job_states([job_id]).get(job_id)
+            if state in states:
+                return state
+            time.sleep(0.1)
+        self.fail("Job {} did not reach any of the states {}".format(job_id, states))
+
+    def test_run_job(self):
+        """
+        Run a job with an input file and environment variables, and check its outputs are
+        retrieved
+        """
+        a = self.arc_iface
+        input_file = os.path.join(tempfile.mkdtemp(dir=BASE_TEMP_DIR), "input.txt")
+        with open(input_file, "w") as f:
+            f.write("input contents")
+
+        job_id = a.submit_job("/bin/bash", ["-c", "echo $MY_VARIABLE; cp input.txt outfile.txt"],
+                              input_files=[input_file], environment={"MY_VARIABLE": "my value"})
+        self.assertEqual(self.wait_for_state(job_id, ["Finished", "Failed"]), "Finished")
+        self.assertEqual(a.get_job_status(job_id), JobStatuses.COMPLETED)
+
+        out_dir = a.save_job_outputs(job_id)
+        with open(os.path.join(out_dir, "stdout.txt")) as f:
+            self.assertEqual(f.read().strip(), "my value")
+        with open(os.path.join(out_dir, "outfile.txt")) as f:
+            self.assertEqual(f.read(), "input contents")
+
+    def test_job_description(self):
+        """
+        Check that resource requirements and environment variables are rendered into the JSDL
+        description, and that invalid resource requirements are rejected
+        """
+        a = self.arc_iface
+        a.config = a.config.replace(JOB_ENVIRONMENT={"FROM_CONFIG": "config value"})
+        jsdl, _, _ = a.prepare_job("/bin/true", cpus=4, memory=512, wall_time=600,
+                                   queue="short-serial", environment={"MY_VARIABLE": "my value"})
+
+        namespaces = dict(JSDL_NAMESPACES, arc="http://www.nordugrid.org/ws/schemas/jsdl-arc")
+        root = ElementTree.fromstring(jsdl)
+        app = root.find("jsdl:JobDescription/jsdl:Application/posix:POSIXApplication", namespaces)
+        resources = root.find("jsdl:JobDescription/jsdl:Resources", namespaces)
+
+        def text(element, path):
+            return element.find(path, namespaces).text.strip()
+
+        self.assertEqual(text(resources, "jsdl:TotalCPUCount/jsdl:Exact"), "4")
+        self.assertEqual(text(resources, "jsdl:IndividualPhysicalMemory/jsdl:UpperBoundedRange"),
+                         str(512 * 1024 * 1024))
+        self.assertEqual(text(app, "posix:WallTimeLimit"), "600")
+        self.assertEqual(text(resources, "arc:CandidateTarget/arc:QueueName"), "short-serial")
+        self.assertEqual(dict((env.get("name"), env.text)
+                              for env in app.findall("posix:Environment", namespaces)),
+                         {"FROM_CONFIG": "config value", "MY_VARIABLE": "my value"})
+
+        # Requirements left at their 0 defaults are omitted
+        jsdl, _, _ = a.prepare_job("/bin/true")
+        root = ElementTree.fromstring(jsdl)
+        self.assertIsNone(root.find("jsdl:JobDescription/jsdl:Resources", namespaces))
+        self.assertIsNone(root.find("jsdl:JobDescription/jsdl:Application/"
+                                    "posix:POSIXApplication/posix:WallTimeLimit", namespaces))
+
+        for name in ("cpus", "memory", "wall_time"):
+            for value in (-1, 0, True, "2", 1.5):
+                self.assertRaises(InvalidJobDescription, a.prepare_job, "/bin/true",
+                                  **{name: value})
+                self.assertRaises(InvalidJobDescription, a.submit_job, "/bin/true",
+                                  **{name: value})
+
+    def test_resumable_outputs(self):
+        """
+        Check that outputs are saved to a given destination with a manifest, and that saving them
+        again only copies files that are missing
+        """
+        a = self.arc_iface
+        job_id = a.submit_job("/bin/bash", ["-c", "echo hello > outfile.txt"])
+        self.wait_for_state(job_id, ["Finished"])
+
+        dest = os.path.join(tempfile.mkdtemp(dir=BASE_TEMP_DIR), "outputs")
+        session_dir = a.backend.session_dir(job_id)
+
+        # Simulate an interrupted download: only the missing files should be copied
+        staging = prepare_staging(dest, job_id)
+        shutil.copy2(os.path.join(session_dir, "stdout.txt"), staging)
+        stdout_inode = os.stat(os.path.join(staging, "stdout.txt")).st_ino
+        self.assertEqual(a.save_job_outputs(job_id, dest), dest)
+        self.assertFalse(os.path.exists(dest + STAGING_SUFFIX))
+        self.assertEqual(os.stat(os.path.join(dest, "stdout.txt")).st_ino, stdout_inode)
+        with open(os.path.join(dest, "outfile.txt")) as f:
+            self.assertEqual(f.read(), "hello\n")
+        with open(os.path.join(dest, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["job_id"], job_id)
+        self.assertEqual(set(manifest["files"]), {"outfile.txt", "stdout.txt", "stderr.txt"})
+        self.assertEqual(manifest["files"]["outfile.txt"]["size"], len("hello\n"))
+
+        # The job's files are removed once retrieved, but its state can still be queried
+        self.assertFalse(os.path.exists(os.path.join(session_dir, "outfile.txt")))
+        self.assertEqual(a.get_job_states([job_id]), {job_id: "Finished"})
+
+        # Complete outputs are not retrieved again
+        retrieve_jobs = a.backend.retrieve_jobs
+        a.backend.retrieve_jobs = None
+        self.assertEqual(a.save_job_outputs(job_id, dest), dest)
+        a.backend.retrieve_jobs = retrieve_jobs
+
+        # Directories not created by save_job_outputs are not overwritten
+        self.assertRaises(IOError, a.save_job_outputs, job_id, BASE_TEMP_DIR)
+
+        # Nor are the outputs of a different job, even when they are incomplete
+        other_id = a.submit_job("/bin/bash", ["-c", "echo other > outfile.txt"])
+        self.wait_for_state(other_id, ["Finished"])
+        self.assertRaises(IOError, a.save_job_outputs, other_id, dest)
+        os.remove(os.path.join(dest, "stderr.txt"))
+        self.assertRaises(IOError, a.save_job_outputs, other_id, dest)
+
+        # Files that no longer match their recorded checksum are not complete
+        with open(os.path.join(dest, "outfile.txt"), "w") as f:
+            f.write("HELLO\n")
+        os.utime(os.path.join(dest, "outfile.txt"), (0, 0))
+        self.assertFalse(is_complete(dest, job_id))
+
+        # Outputs of unfinished jobs are not saved
+        running_id = a.submit_job("/bin/sleep", ["30"])
+        running_dest = os.path.join(tempfile.mkdtemp(dir=BASE_TEMP_DIR), "outputs")
+        self.assertEqual(a.save_job_outputs(running_id, running_dest), None)
+        self.assertFalse(os.path.exists(running_dest))
+        self.assertFalse(os.path.exists(running_dest + STAGING_SUFFIX))
+        a.cancel_job(running_id)
+
+    def test_resubmit_failed(self):
+        """
+        Check that failed jobs are only resubmitted by `resubmit_failed`, up to the configured
+        number of attempts
+        """
+        a = self.arc_iface
+        a.config = a.config.replace(AUTO_RESUBMIT_ATTEMPTS=1)
+        job_id = a.submit_job("/bin/false")
+        self.assertEqual(self.wait_for_state(job_id, ["Finished", "Failed"]), "Failed")
+        # Checking the status does not resubmit the job
+        self.assertEqual(a.get_job_lineage(job_id), [job_id])
+
+        new_job_id = a.resubmit_failed([job_id])[job_id]
+        self.assertEqual(a.get_job_lineage(job_id), [job_id, new_job_id])
+        self.assertEqual(self.wait_for_state(job_id, ["Finished", "Failed"]), "Failed")
+        self.assertEqual(a.resubmit_failed([job_id]), {})
+
+        # Jobs cannot be resubmitted without a job store
+        a.config = a.config.replace(JOB_STORE_DIR=None)
+        self.assertEqual(a.resubmit_failed([job_id]), {})
+        self.assertRaises(InvalidConfigError, a.resubmit_job, job_id)
+
+    def test_result_cache_across_processes(self):
+        """
+        Check that a job's outputs are cached when they are saved by a different `ArcInterface`
+        from the one that submitted it, as with separate ``submit`` and ``fetch`` commands
+        """
+        cache_dir = tempfile.mkdtemp(dir=BASE_TEMP_DIR)
+        config = self.arc_iface.config.replace(RESULT_CACHE_DIR=cache_dir)
+        submitter = ArcInterface(log=None)
+        submitter.config = config
+        job_id = submitter.submit_job("/bin/echo", ["cached"])
+        self.wait_for_state(job_id, ["Finished"])
+
+        fetcher = ArcInterface(log=None)
+        fetcher.config = config
+        self.assertIsNotNone(fetcher.save_job_outputs(job_id))
+
+        resubmitter = ArcInterface(log=None)
+        resubmitter.config = config
+        self.assertEqual(resubmitter.submit_job("/bin/echo", ["cached"]), job_id)
+        other = ArcInterface(log=None)
+        other.config = config
+        self.assertEqual(other.get_job_status(job_id), JobStatuses.COMPLETED)
+
+    def test_submit_jobs(self):
+        """
+        Check that jobs submitted together each get their own result, and that jobs admission
+        control rejects do not stop the rest of the batch
+        """
+        a = self.arc_iface
+        a.config = a.config.replace(MAX_IN_FLIGHT=2, ADMISSION_MODE="reject")
+        results = a.submit_jobs([
+            {"executable": "/bin/echo", "args": ["one"]},
+            {"executable": "/bin/echo", "input_files": ["/nonexistent"]},
+            {"executable": "/bin/echo", "args": ["two"]},
+            {"executable": "/bin/echo", "args": ["three"]}
+        ])
+        self.assertIsInstance(results[1], InputFileError)
+        self.assertIsInstance(results[3], SubmissionLimitError)
+        for job_id in (results[0], results[2]):
+            self.assertEqual(self.wait_for_state(job_id, ["Finished", "Failed"]), "Finished")
+            self.assertEqual(a.get_job_lineage(job_id), [job_id])
+
+        # Reservations are released if the backend fails to submit a batch at all
+        def fail(descriptions):
+            raise RuntimeError("server unreachable")
+        a.backend.submit_jobs = fail
+        results = a.submit_jobs([{"executable": "/bin/echo"}, {"executable": "/bin/echo"}])
+        self.assertEqual([type(result) for result in results], [RuntimeError] * 2)
+        self.assertEqual(a.get_admission_stats()["in_flight"], 0)
+
+    def test_failure_and_cancel(self):
+        """
+        Check that failed, timed out and cancelled jobs are reported as failed
+        """
+        a = self.arc_iface
+        failed_id = a.submit_job("/bin/false")
+        timed_out_id = a.submit_job("/bin/sleep", ["30"], wall_time=1)
+        cancelled_id = a.submit_job("/bin/sleep", ["30"])
+
+        self.wait_for_state(cancelled_id, ["Running"])
+        a.cancel_job(cancelled_id)
+
+        self.assertEqual(self.wait_for_state(failed_id, ["Finished", "Failed"]), "Failed")
+        self.assertEqual(self.wait_for_state(timed_out_id, ["Finished", "Killed"]), "Killed")
+        self.assertEqual(self.wait_for_state(cancelled_id, ["Finished", "Killed"]), "Killed")
+        self.assertEqual(a.get_job_status(cancelled_id), JobStatuses.FAILED)
+
+        # A cancelled job's files are removed once it has stopped, so there are no outputs to save
+        stdout_path = os.path.join(a.backend.session_dir(cancelled_id), "stdout.txt")
+        deadline = time.time() + self.TIMEOUT
+        while os.path.exists(stdout_path) and time.time() < deadline:
+            time.sleep(0.1)
+        self.assertFalse(os.path.exists(stdout_path))
+        self.assertIsNone(a.save_job_outputs(cancelled_id))
+
+        self.assertRaises(JobNotFoundError, a.get_job_status, "local://nonexistent")
+
+
+class CountingBackend(Backend):
+    """
+    Backend with a fixed set of jobs that counts status queries. Retrievals wait until
+    `release_retrievals` is set
+    """
+    def __init__(self):
+        self.queries = 0
+        self.queried_ids = []
+        self.submitted = []
+        self.release_retrievals = threading.Event()
+
+    def submit(self, description):
+        if not description:
+            raise InvalidJobDescription("Empty job description")
+        self.submitted.append(description)
+        return "job-{}".format(len(self.submitted))
+
+    def get_states(self, job_ids=None):
+        self.queries += 1
+        self.queried_ids.append(job_ids)
+        states = dict(("job-{}".format(i + 1), "Running") for i in range(len(self.submitted)))
+        if job_ids is None:
+            return states
+        return dict((job_id, states[job_id]) for job_id in job_ids if job_id in states)
+
+    def cancel(self, job_id):
+        raise JobNotFoundError("Could not find a job with ID '{}'".format(job_id))
+
+    def retrieve(self, job_id, directory):
+        self.release_retrievals.wait()
+        return (True, "Finished")
+
+
+class AgentTests(unittest.TestCase):
+
+    def start_agent(self, backend, backend_name="local", status_ttl=60):
+        socket_path = os.path.join(tempfile.mkdtemp(dir=BASE_TEMP_DIR), "agent.sock")
+        agent = AgentServer(backend, backend_name, socket_path, status_ttl)
+        agent.start()
+        self.addCleanup(agent.stop)
+        return agent
+
+    def test_status_coalescing(self):
+        """
+        Check that status requests from several clients share one query, that submissions are
+        seen by the next query, and that errors are raised with their original type
+        """
+        backend = CountingBackend()
+        agent = self.start_agent(backend)
+        socket_path = agent.socket_path
+
+        self.assertEqual(AgentBackend.call(socket_path, "submit", "<JobDefinition/>"), "job-1")
+        for _ in range(5):
+            self.assertEqual(AgentBackend.call(socket_path, "get_states", ["job-1", "job-9"]),
+                             {"job-1": "Running"})
+        self.assertEqual(backend.queries, 1)
+
+        self.assertEqual(backend.queried_ids, [["job-1", "job-9"]])
+
+        AgentBackend.call(socket_path, "submit", "<JobDefinition/>")
+        self.assertEqual(AgentBackend.call(socket_path, "get_states", None),
+                         {"job-1": "Running", "job-2": "Running"})
+        self.assertEqual(backend.queries, 2)
+        self.assertEqual(backend.queried_ids[-1], None)
+
+        self.assertRaises(JobNotFoundError, AgentBackend.call, socket_path, "cancel", "job-3")
+        self.assertRaises(AgentError, AgentBackend.call, socket_path, "nonexistent")
+
+        # Errors for individual jobs in a batch are returned with their original type
+        client = AgentBackend(ConnectionConfig({"AGENT_SOCKET": socket_path}, environ={}), None)
+        results = client.submit_jobs(["<JobDefinition/>", ""])
+        self.assertEqual(results[0], "job-3")
+        self.assertIsInstance(results[1], InvalidJobDescription)
+
+    def test_status_cache_requested_jobs(self):
+        """
+        Check that the status cache only queries the jobs requested since its last query, and
+        queries again when a job it does not cover is requested
+        """
+        backend = CountingBackend()
+        for _ in range(3):
+            backend.submit("<JobDefinition/>")
+        cache = StatusCache(backend.get_states, 60)
+
+        self.assertEqual(cache.get(["job-1"]), {"job-1": "Running"})
+        self.assertEqual(cache.get(["job-1"]), {"job-1": "Running"})
+        self.assertEqual(backend.queried_ids, [["job-1"]])
+
+        # A job not covered by the cached states is queried along with those that are
+        self.assertEqual(cache.get(["job-2"]), {"job-2": "Running"})
+        self.assertEqual(cache.get(["job-1", "job-2"]), {"job-1": "Running", "job-2": "Running"})
+        self.assertEqual(backend.queried_ids, [["job-1"], ["job-1", "job-2"]])
+
+        # Once the states expire, only the jobs requested since the last query are queried
+        cache.time -= 120
+        self.assertEqual(cache.get(["job-2"]), {"job-2": "Running"})
+        self.assertEqual(backend.queried_ids[-1], ["job-1", "job-2"])
+        self.assertEqual(cache.get(["job-3"]), {"job-3": "Running"})
+        self.assertEqual(backend.queried_ids[-1], ["job-1", "job-2", "job-3"])
+        cache.time -= 120
+        cache.get(["job-3"])
+        self.assertEqual(backend.queried_ids[-1], ["job-3"])
+
+    def test_concurrent_requests(self):
+        """
+        Check that a slow download does not block other requests, and that clients give up on
+        requests the agent does not answer in time
+        """
+        backend = CountingBackend()
+        self.addCleanup(backend.release_retrievals.set)
+        socket_path = self.start_agent(backend, status_ttl=0).socket_path
+
+        self.assertRaises(AgentError, AgentBackend.call, socket_path, "retrieve", "job-1", "/tmp",
+                          timeout=0.2)
+        retrieval = threading.Thread(target=AgentBackend.call,
+                                     args=(socket_path, "retrieve", "job-1", "/tmp"))
+        retrieval.start()
+        self.assertEqual(AgentBackend.call(socket_path, "submit", "<JobDefinition/>", timeout=5),
+                         "job-1")
+        self.assertEqual(AgentBackend.call(socket_path, "get_states", None, timeout=5),
+                         {"job-1": "Running"})
+        backend.release_retrievals.set()
+        retrieval.join(5)
+        self.assertFalse(retrieval.is_alive())
+
+    def test_interface_uses_agent(self):
+        """
+        Check that `ArcInterface` sends requests through a running agent with the same backend,
+        and not one with a different backend
+        """
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=BASE_TEMP_DIR) as config_file:
+            json.dump({"BACKEND": "local", "USE_AGENT": False,
+                       "LOCAL_WORK_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR),
+                       "JOB_STORE_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR)}, config_file)
+        agent_iface = ArcInterface(config_file.name, log=None)
+        self.assertIsInstance(agent_iface.backend, LocalBackend)
+        agent = self.start_agent(agent_iface.backend, status_ttl=0)
+
+        a = ArcInterface(config_file.name, log=None)
+        a.config = a.config.replace(USE_AGENT=True, AGENT_SOCKET=agent.socket_path)
+        self.assertIsInstance(a.backend, AgentBackend)
+
+        job_id = a.submit_job("/bin/echo", ["via agent"])
+        deadline = time.time() + 30
+        while a.get_job_status(job_id) != JobStatuses.COMPLETED and time.time() < deadline:
+            time.sleep(0.1)
+        with open(os.path.join(a.save_job_outputs(job_id), "stdout.txt")) as f:
+            self.assertEqual(f.read().strip(), "via agent")
+
+        a.config = a.config.replace(BACKEND="arc")
+        self.assertNotIsInstance(a.backend, AgentBackend)
+
+
+class ListHandler(logging.Handler):
+    """
+    Logging handler that stores the records it receives
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LoggingTests(unittest.TestCase):
+
+    def test_logging_integration(self):
+        """
+        Check that messages are sent to a ``logging.Logger`` once however many interfaces use it,
+        and that records have structured fields
+        """
+        logger = logging.getLogger("jasmin_arc.tests.logging")
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        handler = ListHandler()
+        logger.addHandler(handler)
+
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=BASE_TEMP_DIR) as config_file:
+            json.dump({"BACKEND": "local", "USE_AGENT": False,
+                       "LOCAL_WORK_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR),
+                       "JOB_STORE_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR)}, config_file)
+        a = ArcInterface(config_file.name, log=logger)
+        b = ArcInterface(config_file.name, log=logger)
+        self.assertIs(a.logger.bridge, b.logger.bridge)
+
+        job_id = a.submit_job("/bin/true")
+        # Messages logged by ARC itself go through the same destination
+        a.logger.arc_logger.msg(LogLevels.WARNING.value, "message from arc")
+        a.logger.flush()
+
+        submitted = [r for r in handler.records if r.phase == "submit"]
+        self.assertEqual(len(submitted), 1)
+        self.assertEqual(submitted[0].job_id, job_id)
+        self.assertTrue(submitted[0].duration >= 0)
+
+        from_arc = [r for r in handler.records if r.getMessage() == "message from arc"]
+        self.assertEqual(len(from_arc), 1)
+        self.assertEqual(from_arc[0].levelno, logging.WARNING)
+        self.assertIsNone(from_arc[0].job_id)
+
+
+class OutputCollector(object):
+    """
+    File-like object that stores the JSON lines written to it
+    """
+    def __init__(self):
+        self.results = []
+
+    def write(self, line):
+        self.results.append(json.loads(line))
+
+    def flush(self):
+        pass
+
+
+class CliTests(unittest.TestCase):
+
+    def run_cli(self, *argv):
+        """
+        Run a command with a config that uses the local backend, and return its exit status and
+        results
+        """
+        output = OutputCollector()
+        exit_status = cli.main(["--config", self.config_path] + list(argv), stdout=output)
+        return exit_status, output.results
+
+    def setUp(self):
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=BASE_TEMP_DIR) as config_file:
+            json.dump({"BACKEND": "local", "USE_AGENT": False,
+                       "LOCAL_WORK_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR),
+                       "JOB_STORE_DIR": tempfile.mkdtemp(dir=BASE_TEMP_DIR)}, config_file)
+        self.config_path = config_file.name
+
+    def test_bulk_commands(self):
+        """
+        Submit jobs from a file, wait for them, and fetch their outputs, passing the output of
+        each command to the next
+        """
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=BASE_TEMP_DIR) as jobs_file:
+            for i in range(3):
+                jobs_file.write(json.dumps({"executable": "/bin/echo", "args": [str(i)]}) + "\n")
+            jobs_file.write(json.dumps({"args": ["no executable"]}) + "\n")
+
+        exit_status, results = self.run_cli("submit", "--from", jobs_file.name, "--parallel", "2",
+                                            "--batch-size", "2")
+        self.assertEqual(exit_status, 1)
+        self.assertEqual([r["line"] for r in results if "error" in r], [4])
+        submitted = sorted((r for r in results if "job_id" in r), key=lambda r: r["line"])
+        self.assertEqual(len(submitted), 3)
+
+        with tempfile.NamedTemporaryFile("w", delete=False, dir=BASE_TEMP_DIR) as ids_file:
+            for result in submitted:
+                ids_file.write(json.dumps(result) + "\n")
+
+        exit_status, results = self.run_cli("wait", "--ids-from", ids_file.name,
+                                            "--interval", "0.1", "--timeout", "30")
+        self.assertEqual(exit_status, 0)
+        self.assertEqual([r["status"] for r in results], [JobStatuses.COMPLETED.value] * 3)
+
+        exit_status, results = self.run_cli("fetch", "--ids-from", ids_file.name,
+                                            "--parallel", "3")
+        self.assertEqual(exit_status, 0)
+        for i, result in enumerate(results):
+            self.assertEqual(result["job_id"], submitted[i]["job_id"])
+            with open(os.path.join(result["outputs"], "stdout.txt")) as f:
+                self.assertEqual(f.read().strip(), str(i))
+
+        exit_status, results = self.run_cli("cancel", submitted[0]["job_id"], "local://unknown")
+        self.assertEqual(exit_status, 1)
+        self.assertEqual(results, [
+            {"job_id": submitted[0]["job_id"], "error": "Failed to cancel job"},
+            {"job_id": "local://unknown", "error": "Job not found"}
+        ])
+
+
 class JasminArcTests(ArcTestCase):
 
     def test_invalid_config(self):
@@ -54,19 +1470,18 @@ class JasminArcTests(ArcTestCase):
         """
         a = self.ARC_INTERFACE
         n = 60
-        a.config.PROXY_VALIDITY_PERIOD = n
-        a.config.PROXY_RENEWAL_THRESHOLD = n - 3
+        a.config = a.config.replace(PROXY_VALIDITY_PERIOD=n, PROXY_RENEWAL_THRESHOLD=n - 3)
 
         # Delete proxy if it exists from previous tests
         if os.path.isfile(a.config.PROXY_FILE):
             os.unlink(a.config.PROXY_FILE)
 
         # Create initial proxy and save creation time
-        a.get_user_config()
+        a.backend.get_user_config()
         t1 = os.path.getmtime(a.config.PROXY_FILE)
         # Wait till after proxy should be renewed
         self.wait(5)
-        a.get_user_config()
+        a.backend.get_user_config()
         # Check proxy file has been modified
         t2 = os.path.getmtime(a.config.PROXY_FILE)
         self.assertTrue(t2 > t1)
@@ -124,12 +1539,40 @@ class JobSubmissionTests(ArcTestCase):
         a = self.ARC_INTERFACE
         message = "my message here"
         outfile = "outfile.txt"
-        a.config.OUTPUT_FILE = outfile
+        a.config = a.config.replace(OUTPUT_FILE=outfile)
         job_id = a.submit_job("/bin/bash", ["-c", "echo '{}' > {}".format(message, outfile)])
         self.wait(self.BASIC_SUBMISSION_TIMEOUT)
         outfile_contents = self.get_output_file_contents(job_id, outfile)
         self.assertEqual(outfile_contents.strip(), message)
 
+    def test_resources(self):
+        """
+        Submit a job with resource requirements and environment variables, and check the
+        environment variables are set when the job runs
+        """
+        a = self.ARC_INTERFACE
+        job_id = a.submit_job("/bin/bash", ["-c", "echo $MY_VARIABLE"], cpus=1, memory=512,
+                              wall_time=600, environment={"MY_VARIABLE": "my value"})
+        self.wait(self.BASIC_SUBMISSION_TIMEOUT)
+        stdout = self.get_output_file_contents(job_id, "stdout.txt")
+        self.assertEqual(stdout.strip(), "my value")
+
+    def test_resubmit(self):
+        """
+        Submit a job, resubmit it, and check the resubmitted job runs and is linked to the
+        original
+        """
+        a = self.ARC_INTERFACE
+        if not a.config.JOB_STORE_DIR:
+            a.config = a.config.replace(JOB_STORE_DIR=tempfile.mkdtemp(dir=BASE_TEMP_DIR))
+        job_id = a.submit_job("/bin/echo", ["resubmitted"])
+        new_job_id = a.resubmit_job(job_id)
+        self.assertEqual(a.get_job_lineage(new_job_id), [job_id, new_job_id])
+
+        self.wait(self.BASIC_SUBMISSION_TIMEOUT)
+        stdout = self.get_output_file_contents(job_id, "stdout.txt")
+        self.assertEqual(stdout.strip(), "resubmitted")
+
     def test_input_files(self):
         """
         Create some input files, submit a job that calls `find`, and verify the input files are